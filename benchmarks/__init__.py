@@ -0,0 +1 @@
+# Micro-benchmarks for the hot paths. Run each module with `python -m benchmarks.<name>`.
@@ -0,0 +1,57 @@
+"""
+Compare deck generation throughput: the original per-card Fisher-Yates shuffle
+(random.randint per swap, one pass per suit) against DeckPool's batched shuffles.
+
+Usage: python -m benchmarks.decks [decks]
+"""
+import random
+import sys
+import time
+
+from services.game_service import CARD_VALUES, DeckCards, DeckPool
+
+
+def fisher_yates_deck(suits):
+    deck = {}
+    for suit in suits:
+        array = CARD_VALUES[:]
+        for i in range(len(array) - 1, 0, -1):
+            j = random.randint(0, i)
+            array[i], array[j] = array[j], array[i]
+        deck[suit] = array
+    return deck
+
+
+def decks_per_second(make_deck, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        make_deck()
+    return count / (time.perf_counter() - start)
+
+
+def main(count):
+    suits = DeckCards().suits
+    pooled = DeckCards(pool=DeckPool(size=4 * count))
+    batch = DeckPool(size=0)
+
+    pooled.pool.refill()
+
+    results = {
+        "fisher-yates": decks_per_second(lambda: fisher_yates_deck(suits), count),
+        "batch generate": count / _timed(lambda: batch.generate(4 * count)),
+        "pool (warm)": decks_per_second(pooled.initialize_deck, count),
+    }
+
+    print(f"decks per second over {count} decks")
+    for name, rate in results.items():
+        print(f"  {name:<15} {rate:>12,.0f}")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
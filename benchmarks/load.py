@@ -0,0 +1,164 @@
+"""
+Load-test the API with a realistic mix of /start-game, /pull-card, /users and /reset-game calls.
+
+By default the real ASGI app is driven in-process (no sockets) against REDIS_URL if a server
+answers there, otherwise fakeredis; --url targets a running server instead. Reports requests
+per second and p50/p95/p99 latency per endpoint, and can save the results as a JSON baseline
+or compare them with one, exiting with status 1 when an endpoint regressed past --threshold.
+
+Usage: python -m benchmarks.load [--requests N] [--concurrency N] [--url URL]
+                                 [--save baseline.json] [--compare baseline.json] [--threshold 0.2]
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import httpx
+
+# Relative weight of each endpoint in the traffic mix (Discord play is mostly drawing cards)
+MIX = {"pull-card": 60, "start-game": 20, "users": 10, "reset-game": 10}
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, users: int = 20, seed: int = None):
+        self.client = client
+        self.random = random.Random(seed)
+        self.userids = []
+        self.games = []  # (userid, gameid)
+        self.samples = {name: [] for name in MIX}
+        self.errors = {name: 0 for name in MIX}
+        self.users = users
+
+    async def setup(self):
+        for i in range(self.users):
+            response = await self.client.post("/users/", params={
+                "username": f"bench{i}", "email": f"bench{i}@example.com", "full_name": f"Bench User {i}"
+            })
+            self.userids.append(response.json()["user"]["userid"])
+        for userid in self.userids + ["guest"]:
+            await self.start_game(userid)
+
+    async def start_game(self, userid):
+        response = await self.client.get("/start-game", params={"userid": userid})
+        data = response.json().get("data") or {}
+        if "game_id" in data:
+            self.games.append((userid, data["game_id"]))
+        return response
+
+    async def call(self, name):
+        userid, gameid = self.random.choice(self.games)
+        if name == "pull-card":
+            return await self.client.get("/pull-card", params={"userid": userid, "gameid": gameid})
+        if name == "start-game":
+            return await self.start_game(self.random.choice(self.userids + ["guest"]))
+        if name == "users":
+            return await self.client.get("/users", params={"limit": 50})
+        return await self.client.post("/reset-game", params={"gameid": gameid, "userid": userid})
+
+    async def worker(self, requests):
+        names, weights = list(MIX), list(MIX.values())
+        for name in self.random.choices(names, weights, k=requests):
+            start = time.perf_counter()
+            response = await self.call(name)
+            self.samples[name].append((time.perf_counter() - start) * 1000)
+            # Errors are reported in the body's status_code as well as the HTTP status
+            if response.status_code >= 400 or response.json().get("status_code", 200) >= 400:
+                self.errors[name] += 1
+
+    async def run(self, requests, concurrency):
+        start = time.perf_counter()
+        await asyncio.gather(*(self.worker(requests // concurrency) for _ in range(concurrency)))
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        results = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            samples = sorted(samples)
+            results[name] = {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "rps": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50),
+                "p95_ms": percentile(samples, 95),
+                "p99_ms": percentile(samples, 99),
+            }
+        return results
+
+
+def percentile(samples, pct):
+    return samples[min(int(len(samples) * pct / 100), len(samples) - 1)]
+
+# Endpoints whose throughput fell or whose p95 latency rose by more than `threshold` (a fraction)
+def regressions(results, baseline, threshold):
+    found = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if stats["rps"] < base["rps"] * (1 - threshold):
+            found.append(f"{name}: {stats['rps']:.0f} rps vs {base['rps']:.0f} in the baseline")
+        if stats["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            found.append(f"{name}: p95 {stats['p95_ms']:.2f}ms vs {base['p95_ms']:.2f}ms in the baseline")
+    return found
+
+
+async def in_process_client():
+    from benchmarks.pull_card import connect
+    from main import app
+    from services.game_service import deck_pool
+
+    # ASGITransport does not run the lifespan, so do its startup work here
+    target = await connect()
+    deck_pool.refill()
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench"), f"in-process app ({target})"
+
+
+async def main(args):
+    if args.url:
+        client, target = httpx.AsyncClient(base_url=args.url, timeout=30), args.url
+    else:
+        client, target = await in_process_client()
+    async with client:
+        load = LoadTest(client, users=args.users, seed=args.seed)
+        await load.setup()
+        results = await load.run(args.requests, args.concurrency)
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent, against {target}")
+    print(f"  {'endpoint':<12} {'requests':>8} {'errors':>6} {'rps':>9} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}")
+    for name, stats in results.items():
+        print(f"  {name:<12} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>9,.0f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        return 1 if found else 0
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20, help="users created before the run")
+    parser.add_argument("--url", help="base URL of a running server (default: drive the app in-process)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="compare with this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression, as a fraction")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args(sys.argv[1:]))))
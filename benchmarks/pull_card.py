@@ -0,0 +1,79 @@
+"""
+Compare the /pull-card service path before and after collapsing its Redis round trips.
+
+- serial: the original endpoint flow - GET game, SET game, GET game, GET user (4 round trips)
+- pipelined: game_service.pull_card - atomic draw script + user GET in one pipeline (1 round trip)
+
+Runs against REDIS_URL if a server answers there, otherwise against fakeredis
+(which has no network latency, so only the CPU cost shows up).
+
+Usage: python -m benchmarks.pull_card [iterations]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from models import Game, User
+from services import redis_service
+from services.game_service import DeckCards, pull_card
+from services.redis_service import save_game_to_redis, get_game_from_redis, save_user_to_redis, get_user_from_redis
+
+
+async def serial_pull(userid, gameid):
+    game = await get_game_from_redis(gameid)
+    game.currRnd += 1
+    await save_game_to_redis(game)
+    game = await get_game_from_redis(gameid)
+    user = await get_user_from_redis(userid)
+    return game, user
+
+
+async def pipelined_pull(userid, gameid):
+    result = await pull_card(userid, gameid)
+    return result["game"], result["user"]
+
+
+async def timed(func, iterations, userid, gameid):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await func(userid, gameid)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": statistics.mean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[int(len(samples) * 0.95) - 1],
+    }
+
+
+async def connect():
+    client = redis_service.init_redis_pool()
+    try:
+        await client.ping()
+        return redis_service.REDIS_URL
+    except Exception:
+        import fakeredis
+        await redis_service.close_redis_pool()
+        redis_service.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        return "fakeredis"
+
+
+async def main(iterations):
+    target = await connect()
+    userid, gameid = "bench-user", "bench-game"
+    await save_user_to_redis(User(userid=userid, username="bench", email="bench@example.com", games=[gameid]))
+    await save_game_to_redis(Game(gameid=gameid, userid=userid, currRnd=0, card_deck=DeckCards().initialize_deck()))
+
+    print(f"pull-card round trips against {target}, {iterations} iterations")
+    for name, func in [("serial", serial_pull), ("pipelined", pipelined_pull)]:
+        stats = await timed(func, iterations, userid, gameid)
+        print(f"  {name:<10} " + "  ".join(f"{key}={value:.3f}" for key, value in stats.items()))
+
+    await redis_service.get_redis_client().delete(f"user:{userid}", f"game:{gameid}")
+    await redis_service.close_redis_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
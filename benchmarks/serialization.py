@@ -0,0 +1,70 @@
+"""
+Compare (de)serialization paths for Game, User and APIResponse: the pydantic v1-style
+calls the services used to make, the v2 compiled ones, and the trusted construct path
+used for documents read back from Redis.
+
+Usage: python -m benchmarks.serialization [iterations]
+"""
+import json
+import sys
+import time
+import warnings
+
+import orjson
+from pydantic import TypeAdapter
+
+from models import APIResponse, Game, User
+from services.game_service import DeckCards
+
+
+def calls_per_second(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - start)
+
+
+def main(count):
+    warnings.simplefilter("ignore")  # The v1-style calls are deprecated under pydantic v2
+    game = Game(gameid="game-id", userid="user-id", currRnd=3, card_deck=DeckCards().initialize_deck())
+    user = User(userid="user-id", username="testuser", email="test@example.com", full_name="Test User",
+                games_count=12)
+    response = APIResponse(status_code=200, message="Card pulled successfully", game=game, user=user)
+    game_json, user_json = game.model_dump_json(), user.model_dump_json()
+    response_adapter = TypeAdapter(APIResponse)
+
+    results = {
+        "Game": {
+            "v1 .json()": lambda: game.json(),
+            "v1 parse_raw": lambda: Game.parse_raw(game_json),
+            "model_dump_json": lambda: game.model_dump_json(),
+            "model_validate_json": lambda: Game.model_validate_json(game_json),
+            "trusted construct": lambda: Game.model_construct(**orjson.loads(game_json)),
+        },
+        "User": {
+            "v1 .json()": lambda: user.json(),
+            "v1 parse_raw": lambda: User.parse_raw(user_json),
+            "model_dump_json": lambda: user.model_dump_json(),
+            "model_validate_json": lambda: User.model_validate_json(user_json),
+            "trusted construct": lambda: User.model_construct(**orjson.loads(user_json)),
+        },
+        "APIResponse": {
+            # What a v1-era response_model did: dump to a dict, validate it again, then json.dumps
+            "revalidate + dumps": lambda: json.dumps(
+                APIResponse.model_validate(response.model_dump()).model_dump(mode="json")
+            ),
+            # What FastAPI now does with a response_model: pass the instance through, dump in Rust
+            "pass-through dump": lambda: response_adapter.dump_json(response_adapter.validate_python(response)),
+            "orjson dumps": lambda: orjson.dumps(response.model_dump(mode="json")),
+        },
+    }
+
+    print(f"calls per second over {count} calls")
+    for model, paths in results.items():
+        print(model)
+        for name, func in paths.items():
+            print(f"  {name:<20} {calls_per_second(func, count):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
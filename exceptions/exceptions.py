@@ -50,6 +50,22 @@ class GameNotFoundException(Exception):
             base_msg += f" (function: {self.function})"
         return base_msg
 
+class InvalidGameTokenException(Exception):
+    """Custom exception for when a game token is malformed or its signature does not match."""
+    def __init__(self, message: str, endpoint: str = None, function: str = None):
+        self.message = message
+        self.endpoint = endpoint
+        self.function = function
+        super().__init__(self.message)
+
+    def __str__(self):
+        base_msg = f"{self.message}"
+        if self.endpoint:
+            base_msg += f" (endpoint: {self.endpoint})"
+        if self.function:
+            base_msg += f" (function: {self.function})"
+        return base_msg
+
 class InvalidUserException(Exception):
     """Custom exception for when a user is invalid."""
     def __init__(self, message: str, endpoint: str = None, function: str = None):
@@ -117,6 +133,17 @@ def register_exception_handlers(app: FastAPI):
             }
         )
         
+    @app.exception_handler(InvalidGameTokenException)
+    async def invalid_game_token_exception_handler(request: Request, exc: InvalidGameTokenException):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "detail": str(exc),
+                "endpoint": exc.endpoint,
+                "function": exc.function
+            }
+        )
+        
     @app.exception_handler(InvalidUserException)
     async def invalid_user_exception_handler(request: Request, exc: InvalidUserException):
         return JSONResponse(
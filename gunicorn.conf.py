@@ -0,0 +1,45 @@
+"""
+Production server settings: gunicorn supervising uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is not preloaded, so every worker imports it and runs its own lifespan: each one
+opens (and on shutdown closes) its own Redis pool, and nothing is shared across the fork.
+uvicorn uses uvloop and httptools when they are installed (see uvicorn[standard]).
+"""
+import os
+
+# Worker count: WEB_CONCURRENCY when set, otherwise WORKERS_PER_CORE per available CPU,
+# at least 2 and at most MAX_WORKERS (0 = no cap). Each worker holds up to
+# REDIS_MAX_CONNECTIONS connections, so size the Redis maxclients for the total.
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))  # Respects the CPUs the container is pinned to
+    return os.cpu_count() or 1
+
+def _worker_count():
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.getenv("WEB_CONCURRENCY"))
+    workers = max(int(float(os.getenv("WORKERS_PER_CORE", "1")) * _available_cpus()), 2)
+    max_workers = int(os.getenv("MAX_WORKERS", "0"))
+    return min(workers, max_workers) if max_workers > 0 else workers
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = _worker_count()
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# On SIGTERM a worker stops accepting connections and finishes the requests it has, in-flight
+# draws included, before its lifespan closes the Redis pool; workers still busy after
+# GRACEFUL_TIMEOUT seconds are killed
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Recycle workers after this many requests (0 = never), with jitter so they do not restart together
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+# API calls are logged by the app itself (utils/logger.py)
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -1,15 +1,83 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import time
+
+import orjson
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import EmailStr
 from exceptions.exceptions import register_exception_handlers, UserNotFoundException
-from services.game_service import start_game, reset_game, pull_card
-from services.user_service import create_user, get_user, add_game_to_user
-from services.redis_service import get_all_users_from_redis, get_game_from_redis
-from models import APIResponse
-from utils import logger
+from services.game_service import (
+    start_game, start_games_in_chunks, reset_game, pull_card, get_versioned_game, get_game_version, get_game_view, deck_pool
+)
+from services.user_service import (
+    create_user, get_user_games, add_game_to_user, get_versioned_user, get_user_version
+)
+from services.redis_service import (
+    get_users_page_from_redis, scan_users_from_redis, init_redis_pool, close_redis_pool,
+    migrate_games_to_hash, migrate_user_games_to_sets, run_migration_once, get_redis_client, GAME_STORAGE,
+    MIGRATE_ON_STARTUP
+)
+from services.cache_service import listen_for_invalidations, CACHE_PUBSUB
+from services.event_service import (
+    game_events, event_for_subscriber, sse_message, GAME_EVENTS, GAME_EVENTS_KEEPALIVE
+)
+from services.session_service import GameSession
+from services.retention_service import run_sweeper, RETENTION_SWEEP_INTERVAL
+from services.locale_service import locale_catalog, card_key, DEFAULT_LOCALE, LOCALE_CACHE_CONTROL
+from models import APIResponse, BulkGamesRequest, DrawResult, PullCardResponse, UserResponse, UserView
+from utils import logger, metrics, profiling
+from utils.fields import parse_fields, pick_fields
+from utils.http_cache import (
+    cached_response, is_not_modified, version_etag, version_headers, QualityGZipMiddleware, GZIP_RESPONSES,
+    GZIP_MIN_BYTES, GZIP_LEVEL
+)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared Redis pool for this worker and close it on shutdown
+    init_redis_pool()
+    deck_pool.refill()
+    # Convert data written in older layouts in the background
+    migration = asyncio.create_task(_migrate_storage()) if MIGRATE_ON_STARTUP else None
+    # Keep this worker's User/Game cache coherent with writes made by other workers
+    invalidations = asyncio.create_task(listen_for_invalidations(get_redis_client())) if CACHE_PUBSUB else None
+    # Archive finished games and expire abandoned ones
+    sweeper = asyncio.create_task(run_sweeper()) if RETENTION_SWEEP_INTERVAL > 0 else None
+    # Fan game events out to this worker's WebSocket and SSE subscribers
+    events = asyncio.create_task(game_events.listen(get_redis_client())) if GAME_EVENTS else None
+    yield
+    tasks = [task for task in (migration, invalidations, sweeper, events) if task]
+    for task in tasks:
+        task.cancel()
+    # Let them finish unwinding before the pool they use is closed
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await close_redis_pool()
+
+async def _migrate_storage():
+    try:
+        migrated = await run_migration_once("user_games_sets", migrate_user_games_to_sets)
+        if migrated is not None:
+            logger.logger.info(f"Moved the game lists of {migrated} users to games sets")
+        # Legacy JSON games are converted once the compact layout is switched on
+        if GAME_STORAGE == "hash":
+            migrated = await run_migration_once("games_hash", migrate_games_to_hash)
+            if migrated is not None:
+                logger.logger.info(f"Migrated {migrated} games to the hash layout")
+    except Exception as e:
+        logger.logger.error(f"Storage migration failed: {str(e)}")
+
+app = FastAPI(lifespan=lifespan)
 
 register_exception_handlers(app)
+# Compress responses above GZIP_MIN_BYTES; prepared bodies that are already gzipped and SSE streams pass through
+if GZIP_RESPONSES:
+    app.add_middleware(QualityGZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
 
 # Routes
 
@@ -20,6 +88,7 @@ async def create_user_endpoint(username: str, email: EmailStr, full_name: str):
     msg = None
     status = None
     res = None
+    started = time.perf_counter()
     try:
         # Attempt to create the user
         usr = await create_user(username, email, full_name)
@@ -42,48 +111,105 @@ async def create_user_endpoint(username: str, email: EmailStr, full_name: str):
         logger.log_api_call(
             endpoint="/users",
             method="create_user",
-            request_data=f"username: {username}, email: {email}, full_name: {full_name}",
+            request_data={"username": username, "email": email, "full_name": full_name},
             response_data=res,
             user=usr,
             game=None,
-            message=msg
+            message=msg,
+            duration_ms=(time.perf_counter() - started) * 1000
         )
         return res
 
 
 # Endpoint to fetch a user by ID
-@app.get("/users/{userid}", response_model=APIResponse)
-async def get_user_endpoint(userid: str):
+@app.get("/users/{userid}", response_model=UserResponse, response_model_exclude_none=True)
+async def get_user_endpoint(userid: str, request: Request, response: Response, include_games: bool = False,
+                            fields: str = None):
+    """
+    Fetch a user by ID.
+    
+    Parameters:
+    - userid: User ID
+    - include_games: Also return every game ID (by default only games_count; page through /users/{userid}/games)
+    - fields: Comma-separated user fields to return (e.g. username,games_count); all of them by default
+    
+    Responses carry an ETag; send it back in If-None-Match to get a 304 while the user is unchanged.
+    """
+    selected = parse_fields(fields, UserView)
+    # Every representation of a version gets its own tag
+    variant = "-".join((["games"] if include_games else []) + sorted(selected or ()))
     usr = None
     msg = None
     status = None
     res = None
+    not_modified = None
+    started = time.perf_counter()
     try:
-        usr = await get_user(userid)
-        res = APIResponse(
+        # A client whose copy is current is answered from the user's version alone
+        if request.headers.get("if-none-match"):
+            version = await get_user_version(userid)
+            etag = version_etag(version, variant)
+            if version is not None and is_not_modified(request, etag):
+                res = UserResponse(status_code=304, message="User not modified")
+                not_modified = Response(status_code=304, headers=version_headers(etag))
+                return
+        version, usr = await get_versioned_user(userid, include_games)
+        if version is not None:
+            response.headers.update(version_headers(version_etag(version, variant)))
+        res = UserResponse(
                 status_code=200,
                 message="User retrieved successfully",
-                user=usr
+                user=_user_view(usr, include_games, selected) if usr else None
             )
     except HTTPException as e:
         message = msg + e.detail
-        response = APIResponse(
+        response = UserResponse(
             status_code=500,
-            message=f"{msg} {e.detail}",
-            user=usr
+            message=f"{msg} {e.detail}"
         )
     finally:
         # Log the API call
         logger.log_api_call(
             endpoint=f"/users/{userid}",
             method="get_user",
-            request_data=f"userid: {userid}",
+            request_data={"userid": userid},
             response_data=res,
             user=usr,
             game=None,
-            message=msg
+            message=msg,
+            duration_ms=(time.perf_counter() - started) * 1000
         )
-        return res
+        return not_modified if not_modified is not None else res
+
+# A user as GET /users/{userid} returns it. Without include_games only games_count was read, so the
+# (empty) games list is left out rather than sent as [].
+def _user_view(user, include_games: bool, fields):
+    data = user.model_dump(include=fields, exclude=None if include_games else {"games"})
+    return UserView.model_construct(**data)
+
+# Endpoint to page through a user's games
+@app.get("/users/{userid}/games", response_model=APIResponse)
+async def list_user_games_endpoint(userid: str, before: float = None, limit: int = Query(20, ge=1, le=200),
+                                   summary: bool = False):
+    """
+    List a user's games, newest first.
+    
+    Parameters:
+    - userid: User ID
+    - before: next_before from the previous page (omit for the newest games)
+    - limit: Number of games per page
+    - summary: Include each game's current round and remaining cards
+    
+    Returns:
+    - A page of games and the next_before cursor (None on the last page)
+    """
+    result = await get_user_games(userid, before, limit, summary,
+                                  endpoint="/users/{userid}/games", function="list_user_games_endpoint")
+    return APIResponse(
+        status_code=200,
+        message="Games retrieved successfully",
+        data=result
+    )
 
 # Endpoint to add a game to a user
 @app.post("/users/{userid}/games/", response_model=APIResponse)
@@ -92,6 +218,7 @@ async def add_game_to_user_endpoint(userid: str, gameid: str):
     msg = None
     status = None
     res = None
+    started = time.perf_counter()
     try:
         user = await add_game_to_user(userid, gameid, endpoint="/users/{userid}/games/", function="add_game_to_user_endpoint")
         res =  APIResponse(
@@ -111,28 +238,31 @@ async def add_game_to_user_endpoint(userid: str, gameid: str):
         logger.log_api_call(
             endpoint=f"/users/{userid}/games/",
             method="add game to user",
-            request_data=f"userid: {userid}",
+            request_data={"userid": userid},
             response_data=res,
             user=usr,
             game=None,
-            message=msg
+            message=msg,
+            duration_ms=(time.perf_counter() - started) * 1000
         )
         return res
 
-@app.get("/start-game", response_model=APIResponse)
-async def start_game_endpoint(userid: str = None):
+@app.get("/start-game", response_model=APIResponse, response_model_exclude_none=True)
+async def start_game_endpoint(userid: str = None, stateless: bool = False):
     """
     Start a new game and optionally associate it with a user.
     
     Parameters:
     - userid: Optional user ID to associate the game with (defaults to "guest" if None)
+    - stateless: Return the game as an encrypted token to pass to /pull-card instead of storing it
     """
     usr = None
     msg = None
     status = None
     res = None
+    started = time.perf_counter()
     try:
-        result = await start_game(userid)
+        result = await start_game(userid, stateless)
 
         # Check if there was an error
         if "error" in result:
@@ -141,7 +271,7 @@ async def start_game_endpoint(userid: str = None):
                     message=result["error"],
                     data=result
                 )
-
+        else:
             res =  APIResponse(
                     status_code=200,
                     message=result["message"],
@@ -159,15 +289,48 @@ async def start_game_endpoint(userid: str = None):
         logger.log_api_call(
             endpoint=f"/start-game",
             method="start-game",
-            request_data=f"userid: {userid}",
+            request_data={"userid": userid, "stateless": stateless},
             response_data=res,
             user=usr,
             game=None,
-            message=msg
+            message=msg,
+            duration_ms=(time.perf_counter() - started) * 1000
         )
         return res
 
 
+@app.post("/games/bulk")
+async def bulk_start_games_endpoint(request: BulkGamesRequest):
+    """
+    Start many games at once, e.g. for a tournament or a load test.
+    
+    Parameters:
+    - userids: Users to create games for (defaults to ["guest"])
+    - count: Number of games per user
+    
+    Returns:
+    - The new game and user IDs, streamed as newline-delimited JSON as each chunk of games is saved
+    """
+    started = time.perf_counter()
+    chunks = start_games_in_chunks(request.userids, request.count, endpoint="/games/bulk",
+                                   function="bulk_start_games_endpoint")
+    # The first chunk is saved before answering, so unknown users still get a 404 rather than a cut-off stream
+    first = await anext(chunks)
+    logger.log_api_call(
+        endpoint="/games/bulk",
+        method="bulk-start-games",
+        request_data={"users": len(request.userids), "count": request.count},
+        response_data=None,
+        duration_ms=(time.perf_counter() - started) * 1000
+    )
+    return StreamingResponse(_stream_ndjson(first, chunks), media_type="application/x-ndjson")
+
+async def _stream_ndjson(first, chunks):
+    yield b"".join(orjson.dumps(item) + b"\n" for item in first)
+    async for chunk in chunks:
+        yield b"".join(orjson.dumps(item) + b"\n" for item in chunk)
+
+
 @app.post("/reset-game", response_model=APIResponse)
 async def reset_game_endpoint(gameid: str = None, userid: str = None):
     """
@@ -197,62 +360,274 @@ async def reset_game_endpoint(gameid: str = None, userid: str = None):
         data=result
     )
 
+# Endpoint to fetch a game as its owner sees it
+@app.get("/games/{gameid}", response_model=APIResponse)
+async def get_game_endpoint(gameid: str, request: Request, response: Response, userid: str = None):
+    """
+    Fetch a game's current round and the cards drawn so far (the rest of the deck stays hidden).
+    
+    Parameters:
+    - gameid: Game ID
+    - userid: Owner of the game (defaults to "guest")
+    
+    Responses carry an ETag; send it back in If-None-Match to get a 304 while the game is unchanged.
+    """
+    # Only the game's stored owner gets a 304; anyone else falls through to the ownership error below
+    owner = userid or "guest"
+    if request.headers.get("if-none-match"):
+        version = await get_game_version(gameid, owner)
+        if version is not None and is_not_modified(request, version_etag(version, owner)):
+            return Response(status_code=304, headers=version_headers(version_etag(version, owner)))
+
+    version, result = await get_versioned_game(gameid, userid)
+    if "error" in result:
+        return APIResponse(
+            status_code=400,
+            message=result["error"],
+            data=result
+        )
+    if version is not None:
+        response.headers.update(version_headers(version_etag(version, owner)))
+    return APIResponse(
+        status_code=200,
+        message=result["message"],
+        data=result
+    )
+
+# WebSocket session on a game, replacing a /pull-card request per draw and polling by spectators
+@app.websocket("/games/{gameid}/ws")
+async def game_session_endpoint(websocket: WebSocket, gameid: str, userid: str = None, lang: str = None):
+    """
+    Open a session on a game.
+    
+    Parameters:
+    - userid: Owner of the game; the owner's session may send {"action": "draw"} and {"action": "reset"}
+      (one player session per game). Leave out to spectate.
+    - lang: Locale for the meanings of drawn cards
+    
+    The first message is the game's state, then every draw and reset of the game arrives as an
+    event, whichever worker or endpoint it came from.
+    """
+    await websocket.accept()
+    session = GameSession(gameid, userid, lang)
+    queue = game_events.subscribe(gameid)
+    tasks = []
+    started = time.perf_counter()
+    # Commands' replies and forwarded events share the socket, so every send goes through one lock
+    lock = asyncio.Lock()
+
+    async def send(message):
+        async with lock:
+            await websocket.send_text(orjson.dumps(message).decode())
+
+    try:
+        state = await session.open()
+        await send(state)
+        if state["type"] == "error":
+            await websocket.close(code=state["code"])
+            return
+        tasks = [asyncio.create_task(_receive_game_commands(websocket, session, send)),
+                 asyncio.create_task(_forward_game_events(session, queue, send))]
+        # The session ends with whichever stops first: the client leaving, or a failed send or Redis call
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        game_events.unsubscribe(gameid, queue)
+        for task in tasks:
+            task.cancel()
+        # Release the claim before waiting on the tasks, so another session can take over sooner
+        try:
+            await session.close()
+        except Exception as e:
+            logger.logger.error(f"Could not release the player session of {gameid}: {str(e)}")
+        failures = [result for result in await asyncio.gather(*tasks, return_exceptions=True)
+                    if isinstance(result, Exception) and not isinstance(result, WebSocketDisconnect)]
+        for failure in failures:
+            logger.logger.error(f"Game session on {gameid} failed: {str(failure)}")
+        if failures:
+            with suppress(Exception):
+                await websocket.close(code=1011)
+        # One log line per session rather than per draw
+        logger.log_api_call(
+            endpoint=f"/games/{gameid}/ws",
+            method="game_session",
+            request_data={"gameid": gameid, "userid": userid},
+            response_data=APIResponse(status_code=500 if failures else 200, message="Game session closed",
+                                      data={"draws": session.draws, "resets": session.resets}),
+            user=None,
+            game=None,
+            message=None,
+            duration_ms=(time.perf_counter() - started) * 1000
+        )
+
+# Run the commands a session sends until the client disconnects
+async def _receive_game_commands(websocket: WebSocket, session: GameSession, send):
+    while True:
+        await send(await session.handle(await websocket.receive_text()))
+
+# Send the session the game's events made by others, keeping its player claim alive meanwhile
+async def _forward_game_events(session: GameSession, queue: asyncio.Queue, send):
+    refreshed = time.monotonic()
+    while True:
+        try:
+            event = await asyncio.wait_for(queue.get(), GAME_EVENTS_KEEPALIVE)
+        except asyncio.TimeoutError:
+            event = None
+        if time.monotonic() - refreshed >= GAME_EVENTS_KEEPALIVE:
+            refreshed = time.monotonic()
+            if session.player and not await session.refresh():
+                await send({"type": "session", "player": False,
+                            "message": "Another session took over the game; now spectating"})
+        if event is not None and event.get("source") != session.id:
+            await send(event_for_subscriber(session.gameid, event, session.lang))
+
+# Server-sent events fallback for spectators that cannot open a WebSocket
+@app.get("/games/{gameid}/events")
+async def game_events_endpoint(gameid: str, lang: str = None):
+    """
+    Stream a game's state, then its draws and resets, as server-sent events.
+    
+    Parameters:
+    - lang: Locale for the meanings of drawn cards
+    """
+    if await get_game_view(gameid) is None:
+        raise HTTPException(status_code=404, detail=f"Game {gameid} not found")
+    return StreamingResponse(_stream_game_events(gameid, lang), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _stream_game_events(gameid: str, lang: str = None):
+    queue = game_events.subscribe(gameid)
+    try:
+        # Read the state only once subscribed, so no event falls between the two
+        state = await get_game_view(gameid)
+        if state is None:
+            return
+        yield sse_message("game", state)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), GAME_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield sse_message(event["type"], event_for_subscriber(gameid, event, lang))
+    finally:
+        game_events.unsubscribe(gameid, queue)
+
 @app.get("/users", response_model=APIResponse)
-async def list_users_endpoint():
+async def list_users_endpoint(cursor: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000), stream: bool = False):
     """
-    List all users in the database.
+    List users in the database, one page at a time.
+    
+    Parameters:
+    - cursor: Cursor returned as next_cursor by the previous page (0 to start)
+    - limit: Approximate number of users per page
+    - stream: If true, stream every user as newline-delimited JSON instead of paging
     
     Returns:
-    - A list of all users
+    - A page of users and the cursor for the next page (None when there are no more)
     """
-    usr = None
-    msg = None
-    status = None
-    res = None
-    users = await get_all_users_from_redis()
+    if stream:
+        return StreamingResponse(_stream_users_ndjson(), media_type="application/x-ndjson")
+
+    users, next_cursor = await get_users_page_from_redis(cursor, limit)
     return APIResponse(
         status_code=200,
         message="Users retrieved successfully",
-        data={"users": users}
+        data={"users": users, "next_cursor": next_cursor}
     )
 
-@app.get("/pull-card", response_model=APIResponse)
-async def pull_card_endpoint(userid: str, gameid: str):
+async def _stream_users_ndjson():
+    # Each line is a user exactly as in a page of the listing, games_count included
+    async for users in scan_users_from_redis():
+        yield "".join(f"{user.model_dump_json()}\n" for user in users)
+
+@app.get("/pull-card", response_model=PullCardResponse, response_model_exclude_none=True)
+async def pull_card_endpoint(userid: str, gameid: str = None, token: str = None, lang: str = None,
+                             fields: str = None):
     """
     Pull a card from the game for the specified user.
     
     Parameters:
     - userid: User ID (required)
-    - gameid: Game ID (required)
+    - gameid: Game ID (required unless token is given)
+    - token: Token of a stateless game; the response carries the token for the next pull
+    - lang: Also return the drawn cards' reference_cards meanings in this locale
+    - fields: Comma-separated fields of data to return (e.g. round,cards); all of them by default
     
     Returns:
-    - The pulled card information or an error message
+    - The drawn cards (never the rest of the deck) or an error message
     """
+    selected = parse_fields(fields, DrawResult)
     usr = None
     msg = None
     status = None
     res = None
     try:
-        result = await pull_card(userid, gameid, endpoint="/pull-card", function="pull_card_endpoint")
-        
-        # Get the game after the card was pulled
-        game = await get_game_from_redis(gameid)
+        # Only the drawn cards are returned, so the owner's document is not read
+        result = await pull_card(userid, gameid, endpoint="/pull-card", function="pull_card_endpoint", token=token,
+                                 lang=lang, load_user=False)
         
-        # Get the user
-        from services.user_service import get_user
-        user = await get_user(userid) if userid != "guest" else None
+        # Check if there was an error
+        if "error" in result:
+            return PullCardResponse(
+                status_code=400,
+                message=result["error"],
+                data=DrawResult(**result)
+            )
         
-        return APIResponse(
+        data = pick_fields({name: result[name] for name in DrawResult.model_fields if name in result}, selected)
+        return PullCardResponse(
             status_code=200,
             message=result["message"],
-            game=game,
-            user=user,
-            data=result
+            data=DrawResult.model_construct(**data)
         )
     except Exception as e:
         # Handle any exceptions that occur during the pull_card operation
-        return APIResponse(
+        return PullCardResponse(
             status_code=400,
             message=str(e),
-            data={"error": str(e)}
+            data=DrawResult(error=str(e))
         )
+
+# Endpoint to fetch a whole locale catalog
+@app.get("/locales/{lang}", response_model=APIResponse)
+async def get_locale_endpoint(lang: str, request: Request):
+    """
+    Fetch every text of a locale (welcome, help, setup, reference_cards...).
+    
+    Responses carry a strong ETag and Cache-Control; send If-None-Match to get a 304 when unchanged.
+    """
+    bundle = locale_catalog.bundles.get(lang)
+    if bundle is None:
+        raise HTTPException(status_code=404, detail=f"Locale {lang} not found")
+    return cached_response(request, bundle, LOCALE_CACHE_CONTROL)
+
+# Endpoint to fetch one text of a locale
+@app.get("/locales/{lang}/{key}", response_model=APIResponse)
+async def get_locale_text_endpoint(lang: str, key: str, request: Request):
+    entry = locale_catalog.entries.get(lang, {}).get(key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Text {key} not found in locale {lang}")
+    return cached_response(request, entry, LOCALE_CACHE_CONTROL)
+
+# Endpoint to look up a card's meaning
+@app.get("/cards/{suit}/{value}", response_model=APIResponse)
+async def get_card_endpoint(suit: str, value: str, request: Request, lang: str = DEFAULT_LOCALE):
+    """
+    Look up what a card means in the reference_cards of a locale.
+    
+    Parameters:
+    - suit: Hearts, Diamonds, Clubs or Spades (any case)
+    - value: A, 2-10, J, Q, K or Joker (any case)
+    - lang: Locale (defaults to the server's default locale)
+    """
+    entry = locale_catalog.card_entries.get(lang, {}).get(card_key(value, suit))
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Card {value} of {suit} not found in locale {lang}")
+    return cached_response(request, entry, LOCALE_CACHE_CONTROL)
+
+# Metrics in the Prometheus text format, for scraping
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,17 +1,22 @@
-from pydantic import BaseModel, EmailStr
+import os
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
 from typing import Optional, Any, Dict, Union, List
 
+# Most games one /games/bulk request may create (len(userids) * count)
+BULK_GAMES_MAX = int(os.getenv("BULK_GAMES_MAX", "10000"))
+
 class Game(BaseModel):
     """
     Represents a game in the system.
     
     Attributes:
         gameid: Unique identifier for the game
-        userid: ID of the user who owns this game
+        userid: ID of the user who owns this game ("guest" for games stored before owners were recorded)
         currRnd: Current round number in the game
         card_deck: Dictionary containing the card deck organized by suits
     """
     gameid: str
+    userid: str = "guest"
     currRnd: int
     card_deck: Dict[str, List[str]]
 
@@ -24,13 +29,32 @@ class User(BaseModel):
         username: User's username
         email: User's email address
         full_name: User's full name (optional)
-        games: List of game IDs associated with this user
+        games: List of game IDs associated with this user (only when explicitly loaded)
+        games_count: Number of games associated with this user
     """
     userid: str
     username: str
     email: EmailStr
     full_name: Optional[str] = None
     games: List[str] = []
+    games_count: Optional[int] = None
+
+class BulkGamesRequest(BaseModel):
+    """
+    Request body for creating many games in one call.
+    
+    Attributes:
+        userids: Users to create games for ("guest" games are not attached to a user)
+        count: Number of games to create for each user (at most BULK_GAMES_MAX games in total)
+    """
+    userids: List[str] = Field(default=["guest"], min_length=1, max_length=1000)
+    count: int = Field(default=1, ge=1, le=1000)
+
+    @model_validator(mode="after")
+    def check_total(self):
+        if len(self.userids) * self.count > BULK_GAMES_MAX:
+            raise ValueError(f"At most {BULK_GAMES_MAX} games can be created per request")
+        return self
 
 class APIResponse(BaseModel):
     status_code: int
@@ -39,5 +63,49 @@ class APIResponse(BaseModel):
     user: Optional[User] = None
     data: Optional[Dict[str, Any]] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+# Slim per-endpoint schemas. Every field is optional and endpoints using them set
+# response_model_exclude_none, so fields left out by ?fields= (or never set) are not sent at all.
+
+class UserView(BaseModel):
+    """
+    A user as returned by GET /users/{userid}. The email is not re-validated on the way out.
+    """
+    userid: Optional[str] = None
+    username: Optional[str] = None
+    email: Optional[str] = None
+    full_name: Optional[str] = None
+    games: Optional[List[str]] = None
+    games_count: Optional[int] = None
+
+class UserResponse(BaseModel):
+    status_code: int
+    message: str
+    user: Optional[UserView] = None
+
+class DrawResult(BaseModel):
+    """
+    The outcome of a /pull-card draw: the drawn cards only, never the rest of the deck.
+    
+    Attributes:
+        game_id: Game drawn from
+        user_id: Owner of the game
+        round: Round the cards were drawn in
+        cards: Drawn card per suit
+        meanings: reference_cards meaning per suit (when lang is given)
+        token: Token for the next pull of a stateless game
+        error: Why the draw was refused
+    """
+    game_id: Optional[str] = None
+    user_id: Optional[str] = None
+    round: Optional[int] = None
+    cards: Optional[Dict[str, str]] = None
+    meanings: Optional[Dict[str, Optional[str]]] = None
+    token: Optional[str] = None
+    error: Optional[str] = None
+
+class PullCardResponse(BaseModel):
+    status_code: int
+    message: str
+    data: Optional[DrawResult] = None
@@ -0,0 +1,126 @@
+import os
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from utils.logger import logger
+from utils.metrics import register_collector
+
+# Seconds a cached User / Game stays fresh (0 disables that cache) and the per-cache entry bound
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+GAME_CACHE_TTL = float(os.getenv("GAME_CACHE_TTL", "10"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Broadcast invalidations over Redis pub/sub so every worker drops entries another worker changed
+CACHE_PUBSUB = os.getenv("CACHE_PUBSUB", "false").lower() == "true"
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Identifies this process on the invalidation channel, so it can skip its own messages
+WORKER_ID = uuid4().hex
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries also expire after a fixed TTL.
+
+    Cached models are shared, not copied: callers that modify one must save it
+    (which refreshes the cache) rather than leave the change in memory only.
+    Entries of `linked` caches hold other views of the same keys and are dropped whenever a key here changes.
+    """
+    def __init__(self, name: str, ttl: float, max_entries: int = CACHE_MAX_ENTRIES, linked=()):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.linked = list(linked)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        for cache in self.linked:
+            cache.invalidate(key)
+        if self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+        for cache in self.linked:
+            cache.invalidate(key)
+
+    def clear(self):
+        self.entries.clear()
+        for cache in self.linked:
+            cache.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+# Users with their version, for responses tagged with an ETag; cached as a pair so the two always agree
+versioned_user_cache = TTLCache("versioned_user", USER_CACHE_TTL)
+user_cache = TTLCache("user", USER_CACHE_TTL, linked=[versioned_user_cache])
+game_cache = TTLCache("game", GAME_CACHE_TTL)
+caches = {"user": user_cache, "versioned_user": versioned_user_cache, "game": game_cache}
+
+
+# One stat of every cache, keyed by cache name, read when /metrics is scraped
+def _cache_stat(stat: str):
+    return lambda: {name: cache.stats()[stat] for name, cache in caches.items()}
+
+register_collector("cache_hits_total", "In-process cache hits", _cache_stat("hits"), kind="counter", label="cache")
+register_collector("cache_misses_total", "In-process cache misses", _cache_stat("misses"), kind="counter", label="cache")
+register_collector("cache_evictions_total", "In-process cache evictions", _cache_stat("evictions"), kind="counter",
+                   label="cache")
+register_collector("cache_entries", "In-process cache entries", _cache_stat("size"), label="cache")
+register_collector("cache_hit_ratio", "In-process cache hit ratio", _cache_stat("hit_ratio"), label="cache")
+
+
+# Message telling other workers to drop a key, e.g. "<worker> user:1234"
+def invalidation_message(key: str):
+    return f"{WORKER_ID} {key}"
+
+# Drop a "user:<id>" / "game:<id>" key from the matching local cache
+def invalidate_key(key: str):
+    kind, _, entity_id = key.partition(":")
+    if kind in caches:
+        caches[kind].invalidate(entity_id)
+
+# Apply invalidations published by other workers until cancelled (started from main.lifespan)
+async def listen_for_invalidations(client):
+    pubsub = client.pubsub()
+    await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            sender, _, key = message["data"].partition(" ")
+            if sender != WORKER_ID:
+                invalidate_key(key)
+    except Exception as e:
+        logger.error(f"Cache invalidation listener stopped: {str(e)}")
+        raise
+    finally:
+        await pubsub.aclose()
@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+import orjson
+
+from services.locale_service import locale_catalog
+from utils.logger import logger
+from utils.metrics import register_collector
+
+# Publish draws and resets on game_events:{gameid} for the WebSocket and SSE channels
+GAME_EVENTS = os.getenv("GAME_EVENTS", "true").lower() == "true"
+GAME_EVENTS_PREFIX = "game_events:"
+# Events buffered per subscriber; one that falls this far behind misses events instead of holding up the rest
+GAME_EVENTS_QUEUE = int(os.getenv("GAME_EVENTS_QUEUE", "100"))
+# Seconds between keepalives on idle channels (SSE comments, player session refreshes)
+GAME_EVENTS_KEEPALIVE = float(os.getenv("GAME_EVENTS_KEEPALIVE", "15"))
+# Seconds before resubscribing after the subscription to Redis failed, doubling up to the maximum
+GAME_EVENTS_RETRY = float(os.getenv("GAME_EVENTS_RETRY", "0.5"))
+GAME_EVENTS_RETRY_MAX = float(os.getenv("GAME_EVENTS_RETRY_MAX", "30"))
+
+
+def game_events_channel(gameid: str):
+    return f"{GAME_EVENTS_PREFIX}{gameid}"
+
+
+class GameEventHub:
+    """
+    This worker's WebSocket and SSE subscribers, by game. A single pattern subscription to
+    game_events:* feeds all of them, so a spectator costs a queue rather than a Redis connection.
+    """
+    def __init__(self, queue_size: int = GAME_EVENTS_QUEUE):
+        self.queue_size = queue_size
+        self.subscribers = {}  # gameid -> set of queues
+        self.dropped = 0
+
+    def subscribe(self, gameid: str) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(gameid, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, gameid: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(gameid)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[gameid]
+
+    def dispatch(self, gameid: str, event: dict):
+        for queue in self.subscribers.get(gameid, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    # Forward published events to this worker's subscribers (run as a task from main.lifespan). A lost
+    # connection to Redis is resubscribed with backoff; events published meanwhile are missed.
+    async def listen(self, client):
+        delay = GAME_EVENTS_RETRY
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{GAME_EVENTS_PREFIX}*")
+                delay = GAME_EVENTS_RETRY
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    gameid = message["channel"][len(GAME_EVENTS_PREFIX):]
+                    if gameid in self.subscribers:
+                        try:
+                            self.dispatch(gameid, orjson.loads(message["data"]))
+                        except orjson.JSONDecodeError:
+                            logger.warning(f"Skipped an unreadable event of game {gameid}")
+            except Exception as e:
+                logger.error(f"Game event listener lost its subscription, retrying in {delay}s: {str(e)}")
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, GAME_EVENTS_RETRY_MAX)
+
+
+game_events = GameEventHub()
+
+
+# An event as sent to a subscriber: tagged with its game, without the publishing session's ID,
+# and with the meanings of the drawn cards when the subscriber asked for a locale
+def event_for_subscriber(gameid: str, event: dict, lang: str = None):
+    message = {key: value for key, value in event.items() if key != "source"}
+    message["game_id"] = gameid
+    if message["type"] == "draw":
+        message["cards"] = message.get("cards") or {}  # Lua's cjson encodes an empty table as []
+        if lang:
+            message["meanings"] = locale_catalog.card_meanings(lang, message["cards"])
+    return message
+
+# One server-sent event
+def sse_message(event_type: str, data) -> bytes:
+    return b"event: " + event_type.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+register_collector("game_event_subscribers", "WebSocket and SSE subscribers to game events in this worker",
+                   lambda: sum(len(queues) for queues in game_events.subscribers.values()))
+register_collector("game_events_dropped_total", "Game events dropped because a subscriber fell behind",
+                   lambda: game_events.dropped, kind="counter")
@@ -1,35 +1,123 @@
+import asyncio
+import os
 import random
-from fastapi.exceptions import HTTPException
+import time
+from collections import deque
+from typing import List
 from uuid import uuid4
+from exceptions.exceptions import InvalidGameTokenException, UserNotFoundException
 from models import Game
-from services.redis_service import save_game_to_redis, get_game_from_redis
-from services.user_service import add_game_to_user
+from services.redis_service import (
+    save_game_to_redis, save_games_to_redis, get_game_from_redis, pull_card_from_redis,
+    track_game_token_in_redis, spend_game_token_in_redis, get_versioned_game_from_redis, get_game_version_from_redis,
+    publish_game_event_to_redis, get_missing_users_from_redis
+)
+from services.locale_service import locale_catalog
+from services.token_service import encode_game_token, decode_game_token, tokens_enabled
+from services.user_service import record_game_for_user
 from utils.logger import logger
+from utils.metrics import Histogram, register_collector
+
+CARD_VALUES = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
+# Number of pre-shuffled single-suit permutations kept ready (a standard deck uses 4)
+DECK_POOL_SIZE = int(os.getenv("DECK_POOL_SIZE", "1024"))
+# Set to make the sequence of shuffled decks reproducible
+DECK_SEED = os.getenv("DECK_SEED")
+# Games written per transaction by start_games_in_chunks
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+
+
+class DeckPool:
+    """
+    Pre-shuffled single-suit permutations, generated in batches so that
+    start_game and reset_game only pop ready-made decks.
+
+    Each permutation is 13 bytes of indexes into CARD_VALUES. The pool is topped up
+    on the event loop after the request that drained it below half, or inline if it
+    runs dry.
+    """
+    def __init__(self, size: int = DECK_POOL_SIZE, seed=None):
+        self.size = size
+        self.generated = 0
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        # Unseeded, use the random module's generator, which is reseeded in every forked worker
+        self.rng = random.Random(seed) if seed is not None else random
+        self.ready = deque()
+        self.refill_scheduled = False
+
+    def generate(self, count: int):
+        # Sorting by random keys is a uniform shuffle that runs mostly in C
+        start = time.perf_counter()
+        rand = self.rng.random
+        indexes = range(len(CARD_VALUES))
+        permutations = [bytes(sorted(indexes, key=lambda _: rand())) for _ in range(count)]
+        deck_generate_latency.observe(time.perf_counter() - start)
+        self.generated += count
+        return permutations
+
+    def refill(self):
+        self.refill_scheduled = False
+        missing = self.size - len(self.ready)
+        if missing > 0:
+            self.ready.extend(self.generate(missing))
+
+    def take(self, count: int):
+        if len(self.ready) < count:
+            self.refill()
+            if len(self.ready) < count:
+                self.ready.extend(self.generate(count - len(self.ready)))
+        permutations = [self.ready.popleft() for _ in range(count)]
+        if len(self.ready) < self.size // 2:
+            self._schedule_refill()
+        return permutations
+
+    def _schedule_refill(self):
+        if self.refill_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.refill_scheduled = True
+        loop.call_soon(self.refill)
+
+
+deck_generate_latency = Histogram("deck_generate_duration_seconds", "Duration of each batch of deck shuffles",
+                                  stage="deck")
+deck_pool = DeckPool(seed=DECK_SEED)
+register_collector("deck_pool_ready", "Shuffled suit permutations ready in the pool", lambda: len(deck_pool.ready))
+register_collector("deck_permutations_generated_total", "Suit permutations shuffled by the pool",
+                   lambda: deck_pool.generated, kind="counter")
 
 
 class DeckCards:
-    def __init__(self, suits=None):
+    def __init__(self, suits=None, pool: DeckPool = None):
         self.suits = suits or ['Hearts', 'Diamonds', 'Clubs', 'Spades']
+        self.pool = pool or deck_pool
 
     def shuffle(self, array):
-        for i in range(len(array) - 1, 0, -1):
-            j = random.randint(0, i)
-            array[i], array[j] = array[j], array[i]
+        rand = self.pool.rng.random
+        array[:] = sorted(array, key=lambda _: rand())
         return array
 
     def initialize_deck(self):
-        values = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
-        deck = {}
-        for suit in self.suits:
-            shuffled = self.shuffle(values[:])
-            deck[suit] = shuffled
-        return deck
-
-# Function to start a new game
-async def start_game(userid: str = None):
+        permutations = self.pool.take(len(self.suits))
+        return {
+            suit: [CARD_VALUES[i] for i in permutation]
+            for suit, permutation in zip(self.suits, permutations)
+        }
+
+# Function to start a new game.
+# With stateless=True the game is not stored: it is returned as an encrypted token that
+# pull_card accepts in place of the game ID.
+async def start_game(userid: str = None, stateless: bool = False):
     # If userid is None, set it to "guest"
     if userid is None:
         userid = "guest"
+    if stateless and not tokens_enabled():
+        return {"error": "Stateless games are not enabled"}
         
     # Create a new deck and initialize it
     deck = DeckCards()
@@ -43,19 +131,71 @@ async def start_game(userid: str = None):
         card_deck=card_deck
     )
     
+    if stateless:
+        return await _start_stateless_game(new_game)
+    
     # Associate the game with the user (now always has a value)
     try:
         # Save the game to Redis
         await save_game_to_redis(new_game)
-        await add_game_to_user(userid, new_game.gameid)
+        # Guest games are not tracked per user, so starting one never touches the user store
+        if userid != "guest":
+            await record_game_for_user(userid, new_game.gameid)
     except Exception as e:
         # Log the error but continue - the game was created successfully
         logger.error(f"Failed to add game {new_game.gameid} to user {userid}: {str(e)}")
 
     return {"message": "Game started", "game_id": new_game.gameid, "user_id": userid}
 
-# Function to reset a game
-async def reset_game(gameid: str = None, userid: str = None):
+async def _start_stateless_game(game: Game):
+    try:
+        token = encode_game_token(game)
+    except InvalidGameTokenException as e:
+        return {"error": e.message, "user_id": game.userid}
+    # Guest tokens need nothing server-side; registered users' games get a replay counter and history entry
+    if game.userid != "guest":
+        await track_game_token_in_redis(game)
+        try:
+            await record_game_for_user(game.userid, game.gameid)
+        except Exception as e:
+            logger.error(f"Failed to add game {game.gameid} to user {game.userid}: {str(e)}")
+    return {"message": "Game started", "game_id": game.gameid, "user_id": game.userid, "token": token}
+
+# Function to start many games at once, `count` for each user. Games are created and saved
+# BULK_CHUNK_SIZE at a time, each chunk in one transaction, and each chunk's IDs are yielded as
+# soon as it is saved, so a large batch never holds the event loop or Redis for long.
+async def start_games_in_chunks(userids: List[str], count: int, endpoint: str = None, function: str = None,
+                                chunk_size: int = None):
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+    # Every owner is checked before the first chunk, so a missing one fails the request rather than a later
+    # chunk (each chunk's transaction still guards against users deleted meanwhile)
+    missing = await get_missing_users_from_redis(userids)
+    if missing:
+        raise UserNotFoundException(f"Users not found: {', '.join(missing)}", endpoint, function)
+    suits = DeckCards().suits
+    owners = [userid for userid in userids for _ in range(count)]
+    for start in range(0, len(owners), chunk_size):
+        chunk = owners[start:start + chunk_size]
+        permutations = iter(deck_pool.take(len(suits) * len(chunk)))
+        games = [
+            Game(
+                gameid=str(uuid4()),
+                userid=userid,
+                currRnd=1,
+                card_deck={suit: [CARD_VALUES[i] for i in next(permutations)] for suit in suits}
+            )
+            for userid in chunk
+        ]
+        await save_games_to_redis(games, endpoint, function)
+        yield [{"game_id": game.gameid, "user_id": game.userid} for game in games]
+
+# Function to start many games at once and return all their IDs
+async def start_games(userids: List[str], count: int, endpoint: str = None, function: str = None):
+    return [entry async for chunk in start_games_in_chunks(userids, count, endpoint, function) for entry in chunk]
+
+# Function to reset a game. Resetting an existing game publishes a reset event, tagged with
+# `source` when it comes from a game session.
+async def reset_game(gameid: str = None, userid: str = None, source: str = None):
     # If userid is None, set it to "guest"
     if userid is None:
         userid = "guest"
@@ -82,47 +222,112 @@ async def reset_game(gameid: str = None, userid: str = None):
     
     # Save the updated game to Redis
     await save_game_to_redis(game)
+    await publish_game_event_to_redis(game.gameid, {"type": "reset", "source": source or ""})
     
     return {"message": "Game reset", "game_id": game.gameid, "user_id": userid}
 
-# Function to pull a card from the game
-async def pull_card(userid: str, gameid: str, endpoint: str = None, function: str = None):
+# What a game's owner may see of it: the cards drawn so far, not the rest of the deck
+def _game_view(game: Game):
+    return {
+        "game_id": game.gameid,
+        "user_id": game.userid,
+        "currRnd": game.currRnd,
+        "drawn": {suit: values[:game.currRnd] for suit, values in game.card_deck.items()}
+    }
+
+# Function to get a game along with its version, for responses tagged with an ETag.
+# Returns (version, result); result is an error dict if the game does not exist or is not the user's.
+async def get_versioned_game(gameid: str, userid: str = None):
+    if userid is None:
+        userid = "guest"
+    version, game = await get_versioned_game_from_redis(gameid)
+    if not game:
+        return None, {"error": "Game not found", "game_id": gameid}
+    if game.userid != userid:
+        return None, {"error": "User ID does not match the game owner", "game_id": gameid, "user_id": userid}
+    return version, {"message": "Game retrieved successfully", **_game_view(game)}
+
+# Function to get what anyone may see of a game (used by spectators), or None if it does not exist
+async def get_game_view(gameid: str):
+    _, game = await get_versioned_game_from_redis(gameid)
+    return _game_view(game) if game else None
+
+# Function to get only a game's version, to answer conditional requests. None if it has none, or if
+# userid (default "guest") does not own the game, which then gets the same answer as without If-None-Match.
+async def get_game_version(gameid: str, userid: str = None):
+    version, owner = await get_game_version_from_redis(gameid)
+    return version if owner == (userid or "guest") else None
+
+# Function to pull a card from the game, identified by its ID or by a stateless game token.
+# With lang set, the result also carries the meanings of the drawn cards in that locale.
+# Game sessions pass their ID as `source` and skip the user lookup (load_user=False).
+async def pull_card(userid: str, gameid: str, endpoint: str = None, function: str = None, token: str = None,
+                    lang: str = None, source: str = None, load_user: bool = True):
     # Validate input parameters
     if not userid:
-        raise HTTPException("User ID is required")
+        return {"error": "User ID is required"}
+    if token:
+        result = await _pull_card_from_token(userid, token, endpoint, function)
+        if lang and "error" not in result:
+            result["meanings"] = locale_catalog.card_meanings(lang, result["cards"])
+        return result
     if not gameid:
-        raise HTTPException("Game ID is required")
+        return {"error": "Game ID is required"}
     
-    # Get the existing game
-    from services.redis_service import get_game_from_redis, save_game_to_redis
-    game = await get_game_from_redis(gameid, endpoint, function)
+    # Draw the cards and advance the round atomically in Redis, fetching the user in the same round trip
+    result = await pull_card_from_redis(gameid, userid, load_user, source)
     
-    if not game:
-        raise HTTPException(f"Game with ID {gameid} not found")
+    if not result:
+        return {"error": f"Game with ID {gameid} not found", "game_id": gameid}
     
-    # Check if the user ID matches
-    if game.userid != userid and userid != "guest":
-        raise HTTPException(f"User ID {userid} does not match the game owner {game.userid}")
+    # The draw is refused when the user ID does not match the game owner
+    if "round" not in result:
+        return {"error": "User ID does not match the game owner", "game_id": gameid, "user_id": userid}
     
-    # Get the current round
-    current_round = game.currRnd
+    # Report the cards in deck order (Lua tables are unordered)
+    game = result["game"]
+    cards = result["cards"] or {}  # Lua's cjson encodes an empty table as []
+    cards = {suit: cards[suit] for suit in game.card_deck if suit in cards}
     
-    # Prepare the response with cards from the current round
-    pulled_cards = {}
-    for suit, cards in game.card_deck.items():
-        if current_round < len(cards):
-            pulled_cards[suit] = cards[current_round]
+    pulled = {
+        "message": "Card pulled successfully",
+        "game_id": gameid,
+        "user_id": result["owner"],
+        "round": result["round"],
+        "cards": cards,
+        "game": game,
+        "user": result["user"]
+    }
+    if lang:
+        pulled["meanings"] = locale_catalog.card_meanings(lang, cards)
+    return pulled
+
+# Draw from a stateless game: the cards come straight from the token and the caller gets the
+# next round's token back. Only registered users' games touch Redis, to refuse replayed tokens.
+async def _pull_card_from_token(userid: str, token: str, endpoint: str = None, function: str = None):
+    if not tokens_enabled():
+        return {"error": "Stateless games are not enabled"}
+    try:
+        game = decode_game_token(token, endpoint, function)
+    except InvalidGameTokenException as e:
+        return {"error": e.message}
     
-    # Increment the round counter
-    game.currRnd += 1
+    if game.userid != userid and userid != "guest":
+        return {"error": "User ID does not match the game owner", "game_id": game.gameid, "user_id": userid}
+    if game.userid != "guest" and not await spend_game_token_in_redis(game.gameid, game.currRnd):
+        return {"error": "Game token has already been used", "game_id": game.gameid, "user_id": userid}
     
-    # Save the updated game back to Redis
-    await save_game_to_redis(game)
+    round = game.currRnd
+    cards = {suit: values[round] for suit, values in game.card_deck.items() if round < len(values)}
+    game.currRnd = round + 1
     
     return {
         "message": "Card pulled successfully",
         "game_id": game.gameid,
         "user_id": game.userid,
-        "round": current_round,
-        "cards": pulled_cards
+        "round": round,
+        "cards": cards,
+        "token": encode_game_token(game),
+        "game": game,
+        "user": None
     }
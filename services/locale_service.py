@@ -0,0 +1,102 @@
+import glob
+import json
+import os
+import sys
+from types import MappingProxyType
+
+from models import APIResponse
+from utils.http_cache import CachedBody, prepare_body
+
+# Directory holding one <lang>.json catalog per language, and the language used when none is given
+LOCALES_DIR = os.getenv("LOCALES_DIR", "locales")
+DEFAULT_LOCALE = os.getenv("DEFAULT_LOCALE", "en")
+# How long clients and proxies may reuse a catalog response without revalidating it
+LOCALE_MAX_AGE = int(os.getenv("LOCALE_MAX_AGE", "3600"))
+LOCALE_CACHE_CONTROL = f"public, max-age={LOCALE_MAX_AGE}"
+
+
+# Read-only copy of a parsed catalog: dicts become mapping proxies and strings are interned,
+# so the same text (suit names, card values...) is stored once across every language
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({sys.intern(key): _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+# Plain JSON-serializable copy of a frozen value
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+# Key of a card in the reference_cards index. Catalogs differ in how they capitalize suits
+# ("hearts" / "Hearts"), so suits are lowercased and values ("a", "joker") uppercased.
+def card_key(value: str, suit: str):
+    return value.upper(), suit.lower()
+
+def _response_body(message: str, data) -> CachedBody:
+    response = APIResponse(status_code=200, message=message, data=data)
+    return prepare_body(response.model_dump_json().encode())
+
+
+class LocaleCatalog:
+    """
+    Every locales/*.json catalog, loaded once. Besides the frozen text, the API response for
+    each language and for each of its keys is serialized, gzipped and hashed up front, so
+    serving one is a dictionary lookup.
+    """
+    def __init__(self, directory: str = LOCALES_DIR):
+        catalogs = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            with open(path, encoding="utf-8") as f:
+                catalogs[os.path.splitext(os.path.basename(path))[0]] = _freeze(json.load(f))
+        self.catalogs = MappingProxyType(catalogs)
+        self.languages = tuple(catalogs)
+        self.bundles = MappingProxyType({
+            lang: _response_body("Locale retrieved successfully", {"lang": lang, "catalog": _thaw(catalog)})
+            for lang, catalog in catalogs.items()
+        })
+        self.entries = MappingProxyType({
+            lang: MappingProxyType({
+                key: _response_body("Locale text retrieved successfully",
+                                    {"lang": lang, "key": key, "value": _thaw(value)})
+                for key, value in catalog.items()
+            })
+            for lang, catalog in catalogs.items()
+        })
+        # reference_cards meanings per language, keyed by card_key, and their API responses
+        self.cards = MappingProxyType({
+            lang: MappingProxyType({
+                card_key(value, suit): meaning
+                for suit, meanings in catalog.get("reference_cards", {}).items()
+                for value, meaning in meanings.items()
+            })
+            for lang, catalog in catalogs.items()
+        })
+        self.card_entries = MappingProxyType({
+            lang: MappingProxyType({
+                (value, suit): _response_body("Card retrieved successfully",
+                                              {"lang": lang, "suit": suit, "value": value, "meaning": meaning})
+                for (value, suit), meaning in cards.items()
+            })
+            for lang, cards in self.cards.items()
+        })
+
+    def get(self, lang: str, key: str, default=None):
+        return self.catalogs.get(lang, {}).get(key, default)
+
+    # Meaning of a card in a language, or None if either is unknown
+    def card_meaning(self, lang: str, value: str, suit: str):
+        return self.cards.get(lang, {}).get(card_key(value, suit))
+
+    # Meanings of drawn cards ({suit: value}) in a language, by suit
+    def card_meanings(self, lang: str, cards):
+        return {suit: self.card_meaning(lang, value, suit) for suit, value in cards.items()}
+
+
+locale_catalog = LocaleCatalog()
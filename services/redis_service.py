@@ -1,72 +1,1003 @@
 from fastapi import HTTPException
 
-import redis
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+import orjson
 import os
+import time
+from typing import List
+from exceptions.exceptions import UserNotFoundException
 from models import Game, User
+from services.cache_service import (
+    user_cache, versioned_user_cache, game_cache, invalidation_message, CACHE_PUBSUB, CACHE_INVALIDATION_CHANNEL,
+    WORKER_ID
+)
+from services.event_service import game_events_channel, GAME_EVENTS
+from utils.logger import logger
+from utils.metrics import Histogram, timed
 
 # Get Redis URL from environment variables
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")  # Fallback to localhost if not set
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+# Upper bound on open connections per worker; callers wait up to REDIS_POOL_TIMEOUT seconds for a free one
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+# COUNT hint passed to SCAN when walking user:* / game:* keys
+REDIS_SCAN_BATCH = int(os.getenv("REDIS_SCAN_BATCH", "500"))
+# Layout used when writing games: "json" (one JSON string per game) or "hash" (compact hash, see pack_deck).
+# Reads understand both, so existing game:* JSON keys keep working after switching to "hash".
+# Guest games always use the compact layout, since nothing outside the API reads them.
+GAME_STORAGE = os.getenv("GAME_STORAGE", "json")
+# Run the background migrations from older storage layouts when a worker starts. Each runs once per
+# Redis: a marker key records it as done, and a lock keeps the other workers from running it meanwhile.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+MIGRATION_LOCK_KEY = "migration:lock"
+# Seconds a migration may hold the lock; a worker that dies mid-migration leaves it to a later start
+MIGRATION_LOCK_TTL = int(os.getenv("MIGRATION_LOCK_TTL", "3600"))
+# Seconds an untouched game is kept before Redis expires it (0 keeps it forever).
+# The TTL is set when a game is saved and refreshed on every card pull.
+GUEST_GAME_TTL = int(os.getenv("GUEST_GAME_TTL", "3600"))
+USER_GAME_TTL = int(os.getenv("USER_GAME_TTL", str(30 * 24 * 3600)))
 
+# One-character codes for card values in the packed "hash" layout ("10" is the only two-character value)
+CARD_CODES = {value: value for value in ['A', '2', '3', '4', '5', '6', '7', '8', '9', 'J', 'Q', 'K']}
+CARD_CODES['10'] = 'T'
+CARD_VALUES = {code: value for value, code in CARD_CODES.items()}
+
+# Time spent in each operation below, Redis round trips included (cache hits are fast samples)
+redis_latency = Histogram("redis_operation_duration_seconds", "Duration of redis_service operations", label="operation",
+                          stage="redis")
+
+# Shared pool and client, opened on app startup and closed on shutdown (see main.lifespan)
+redis_pool = None
+redis_client = None
+
+
+# Open the shared connection pool
+def init_redis_pool(url: str = REDIS_URL, max_connections: int = REDIS_MAX_CONNECTIONS):
+    global redis_pool, redis_client
+    if redis_client is None:
+        redis_pool = redis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            decode_responses=True
+        )
+        redis_client = redis.Redis(connection_pool=redis_pool)
+    return redis_client
+
+# Close the shared connection pool
+async def close_redis_pool():
+    global redis_pool, redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+    if redis_pool is not None:
+        await redis_pool.disconnect()
+    redis_client = None
+    redis_pool = None
+
+# Get the shared client, opening the pool if the app lifespan has not done so yet (scripts, tests)
+def get_redis_client():
+    if redis_client is None:
+        return init_redis_pool()
+    return redis_client
+
+
+# Queue a cache invalidation for other workers on a pipeline, when pub/sub invalidation is on
+def _publish_invalidation(pipe, key: str):
+    if CACHE_PUBSUB:
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidation_message(key))
+
+
+# Version counter of a user or game, bumped after every write that changes what reading it returns,
+# so a conditional GET is answered from this key alone. It lives outside the user:*/game:* namespaces
+# the listings SCAN. Readers get it before the document: a version can lag the document it tags
+# (the next poll refetches) but never run ahead of it.
+def _version_key(key: str):
+    return f"version:{key}"
+
+# Queue a version bump on a pipeline, after the writes it covers; games' versions expire with them
+def _queue_bump_version(pipe, key: str, ttl: int = 0):
+    pipe.incr(_version_key(key))
+    if ttl > 0:
+        pipe.expire(_version_key(key), ttl)
+
+def _int_or_none(value):
+    return int(value) if value is not None else None
+
+# Current version of a user or game key ("user:{id}", "game:{id}"), or None if it has none yet
+@timed(redis_latency, "get_version")
+async def get_version_from_redis(key: str):
+    return _int_or_none(await get_redis_client().get(_version_key(key)))
+
+# Read a game's version together with its owner, so a conditional GET can check who asks before a 304.
+# KEYS[1] = game key, KEYS[2] = game version key.
+# Returns nil if the game does not exist or does not decode, otherwise [version (nil if none yet), owner].
+GAME_VERSION_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+local owner
+if kind == 'hash' then
+    owner = redis.call('HGET', KEYS[1], 'userid')
+elseif kind == 'string' then
+    local ok, game = pcall(cjson.decode, redis.call('GET', KEYS[1]))
+    if not ok or type(game) ~= 'table' then
+        return nil
+    end
+    owner = game.userid
+else
+    return nil
+end
+-- Games saved before owners were recorded belong to guests (see models.Game)
+return {redis.call('GET', KEYS[2]), owner or 'guest'}
+"""
+
+# Current version of a game and its owner's ID. Returns (version, owner); version is None for a game
+# that has none yet, and both are None if the game does not exist.
+@timed(redis_latency, "get_game_version")
+async def get_game_version_from_redis(gameid: str):
+    client = get_redis_client()
+    key = f"game:{gameid}"
+    reply = await client.register_script(GAME_VERSION_SCRIPT)(keys=[key, _version_key(key)])
+    if not reply:
+        return None, None
+    version, owner = reply
+    return _int_or_none(version), owner
+
+# Give a document written before versions existed its first one. The caller's read is not
+# tagged with it, since a write may have landed in between.
+async def _start_version(key: str, ttl: int = 0):
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        _queue_bump_version(pipe, key, ttl)
+        await pipe.execute()
+
+
+# A user's game IDs live in a sorted set scored by creation time, next to the user document
+def _user_games_key(userid: str):
+    return f"user:{userid}:games"
+
+# Documents in Redis were validated before we wrote them, so reads skip re-validation
+# (mostly the EmailStr check, which costs far more than decoding the JSON)
+def _trusted_user(value) -> User:
+    return User.model_construct(**orjson.loads(value))
+
+# Build a User from its stored JSON plus either the IDs or just the size of its games set.
+# Documents written before the move to user:{id}:games may still carry their own list.
+def _user_from_stored(value, games=None, games_count=None) -> User:
+    user = _trusted_user(value)
+    if games is not None:
+        known = set(user.games)
+        user.games = user.games + [gameid for gameid in games if gameid not in known]
+        user.games_count = len(user.games)
+    else:
+        # Only the count was read; the IDs are paged through get_user_games_page_from_redis
+        user.games_count = len(user.games) + (games_count or 0)
+        user.games = []
+    return user
+
+# Stored JSON for a user; game IDs are kept in the user's games set instead
+def _user_document(user: User):
+    return user.model_dump_json(exclude={"games", "games_count"})  # Convert the Pydantic model to JSON
 
 # Save a user to Redis
+@timed(redis_latency, "save_user")
 async def save_user_to_redis(user: User):
     key = f"user:{user.userid}"  # Use the user ID as the Redis key
-    value = user.json()          # Convert the Pydantic model to JSON
-    redis_client.set(key, value)
+    value = _user_document(user)
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.set(key, value)
+        if user.games:
+            _queue_add_games(pipe, user.userid, user.games)
+        _queue_bump_version(pipe, key)
+        _publish_invalidation(pipe, key)
+        await pipe.execute()
+    user_cache.invalidate(user.userid)
+    return user
+
+# Queue ZADDs of game IDs to a user's games set, keeping the first-seen time of existing ones
+def _queue_add_games(pipe, userid: str, gameids: List[str]):
+    now = time.time()
+    pipe.zadd(_user_games_key(userid), {gameid: now + i * 1e-6 for i, gameid in enumerate(gameids)}, nx=True)
+
+# Get a user, from the in-process cache when fresh, otherwise from Redis.
+# By default only the number of games is read (games_count); load_games=True also reads
+# every game ID, bypassing the cache. Either way it is one pipelined round trip.
+@timed(redis_latency, "get_user")
+async def get_user_from_redis(userid: str, endpoint: str = None, function: str = None,
+                              load_games: bool = False) -> User:
+    if not load_games:
+        user = user_cache.get(userid)
+        if user is not None:
+            return user
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.get(f"user:{userid}")  # Fetch the JSON string from Redis
+        if load_games:
+            pipe.zrange(_user_games_key(userid), 0, -1)
+        else:
+            pipe.zcard(_user_games_key(userid))
+        value, games = await pipe.execute()
+    if not value:
+        return None  # Return None if the user doesn't exist
+    if load_games:
+        return _user_from_stored(value, games=games)
+    user = _user_from_stored(value, games_count=games)
+    user_cache.set(userid, user)
     return user
 
-# Get a user from Redis
-async def get_user_from_redis(userid: str, endpoint: str = None, function: str = None) -> User:
+# Get a user and its version together, read in one round trip and cached as a pair so the two cannot
+# disagree (every change to the user drops the pair along with its user_cache entry).
+# Returns (version, user); version is None for a user that has none yet, user is None if it does not exist.
+@timed(redis_latency, "get_versioned_user")
+async def get_versioned_user_from_redis(userid: str, load_games: bool = False):
+    if not load_games:
+        cached = versioned_user_cache.get(userid)
+        if cached is not None:
+            return cached
     key = f"user:{userid}"
-    value = redis_client.get(key)  # Fetch the JSON string from Redis
-    if value:
-        return User.parse_raw(value)  # Convert the JSON string back to a Pydantic model
-    return None  # Return None if the user doesn't exist
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.get(_version_key(key))
+        pipe.get(key)
+        if load_games:
+            pipe.zrange(_user_games_key(userid), 0, -1)
+        else:
+            pipe.zcard(_user_games_key(userid))
+        version, value, games = await pipe.execute()
+    if not value:
+        return None, None
+    if version is None:
+        await _start_version(key)
+    if load_games:
+        return _int_or_none(version), _user_from_stored(value, games=games)
+    versioned = _int_or_none(version), _user_from_stored(value, games_count=games)
+    if version is not None:
+        versioned_user_cache.set(userid, versioned)
+    return versioned
 
-# Get all users from Redis
-async def get_all_users_from_redis():
-    # Get all keys that match the pattern "user:*"
-    user_keys = redis_client.keys("user:*")
+# Add a game to an existing user's games set, bumping the user's version if it was not there yet.
+# KEYS[1] = user key, KEYS[2] = user games key, KEYS[3] = user version key,
+# ARGV[1] = score (creation time), ARGV[2] = game ID.
+# Returns 0 if the user does not exist.
+ADD_GAME_TO_USER_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if redis.call('ZADD', KEYS[2], 'NX', ARGV[1], ARGV[2]) > 0 then
+    redis.call('INCR', KEYS[3])
+end
+return 1
+"""
+
+# Add a game to a user in O(log n) without reading or rewriting the user document.
+# Returns False if the user does not exist.
+@timed(redis_latency, "add_game_to_user")
+async def add_game_to_user_in_redis(userid: str, gameid: str, endpoint: str = None, function: str = None):
+    client = get_redis_client()
+    key = f"user:{userid}"
+    user_cache.invalidate(userid)
+    async with client.pipeline(transaction=False) as pipe:
+        await client.register_script(ADD_GAME_TO_USER_SCRIPT)(
+            keys=[key, _user_games_key(userid), _version_key(key)], args=[time.time(), gameid], client=pipe
+        )
+        _publish_invalidation(pipe, key)
+        added, *_ = await pipe.execute()
+    return bool(added)
+
+# Summarize a game in either layout as {currRnd, cards per suit}, or nil if it does not exist
+GAME_SUMMARY_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+if kind == 'hash' then
+    local fields = redis.call('HMGET', KEYS[1], 'currRnd', 'suits', 'deck')
+    local _, commas = string.gsub(fields[2], ',', '')
+    return {tonumber(fields[1]), #fields[3] / (commas + 1)}
+elseif kind == 'string' then
+    local game = cjson.decode(redis.call('GET', KEYS[1]))
+    for _, cards in pairs(game.card_deck) do
+        return {game.currRnd, #cards}
+    end
+    return {game.currRnd, 0}
+end
+return nil
+"""
+
+# Get one page of a user's games, newest first.
+# `before` is the created timestamp of the last game on the previous page (None to start).
+# Returns (games, next_before); next_before is None on the last page. With summary=True each
+# entry also carries its round and remaining cards per suit, fetched in one pipelined round trip.
+@timed(redis_latency, "get_user_games_page")
+async def get_user_games_page_from_redis(userid: str, before: float = None, limit: int = 20,
+                                         summary: bool = False, endpoint: str = None, function: str = None):
+    client = get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.exists(f"user:{userid}")
+        pipe.zrevrangebyscore(_user_games_key(userid), f"({before}" if before is not None else "+inf", "-inf",
+                              start=0, num=limit + 1, withscores=True)
+        exists, entries = await pipe.execute()
+    if not exists:
+        raise UserNotFoundException(f"User with ID {userid} not found", endpoint, function)
+
+    next_before = entries[limit - 1][1] if len(entries) > limit else None
+    games = [{"game_id": gameid, "created": created} for gameid, created in entries[:limit]]
+    if summary and games:
+        script = client.register_script(GAME_SUMMARY_SCRIPT)
+        async with client.pipeline(transaction=False) as pipe:
+            for game in games:
+                await script(keys=[f"game:{game['game_id']}"], client=pipe)
+            summaries = await pipe.execute()
+        for game, game_summary in zip(games, summaries):
+            if game_summary:
+                current_round, cards_per_suit = game_summary
+                game["round"] = current_round
+                game["remaining_cards"] = max(cards_per_suit - current_round, 0)
+            else:
+                game["round"] = None  # The game has been deleted
+                game["remaining_cards"] = None
+    return games, next_before
+
+async def _scan_key_batches(client, pattern: str, batch_size: int, key_type: str = None):
+    cursor = 0
+    while True:
+        cursor, keys = await client.scan(cursor=cursor, match=pattern, count=batch_size, _type=key_type)
+        if keys:
+            yield keys
+        if cursor == 0:
+            break
+
+# Fetch users and their game counts for a batch of user keys in one pipelined round trip
+async def _get_users_for_keys(client, keys):
+    async with client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.get(key)
+            pipe.zcard(f"{key}:games")
+        replies = await pipe.execute()
+    return [
+        _user_from_stored(value, games_count=games_count)
+        for value, games_count in zip(replies[::2], replies[1::2]) if value
+    ]
+
+# Get one page of users from Redis.
+# Returns (users, next_cursor); next_cursor is None once the keyspace has been fully walked.
+# A page holds roughly `limit` users, since SCAN batches cannot be split without losing keys.
+@timed(redis_latency, "get_users_page")
+async def get_users_page_from_redis(cursor: int = 0, limit: int = 100):
+    client = get_redis_client()
     users = []
+    while True:
+        cursor, keys = await client.scan(cursor=cursor, match="user:*", count=limit, _type="string")
+        if keys:
+            users.extend(await _get_users_for_keys(client, keys))
+        if cursor == 0 or len(users) >= limit:
+            break
+    return users, (cursor or None)
 
-    # Fetch each user's data
-    for key in user_keys:
-        value = redis_client.get(key)
-        if value:
-            users.append(User.parse_raw(value))
+# Yield every user, with its games_count as in the paged listing, one SCAN batch at a time.
+# SCAN walks the keyspace incrementally (unlike KEYS, which blocks the server) and each
+# batch is fetched in a single pipelined round trip.
+async def scan_users_from_redis(batch_size: int = REDIS_SCAN_BATCH):
+    client = get_redis_client()
+    async for keys in _scan_key_batches(client, "user:*", batch_size, key_type="string"):
+        users = await _get_users_for_keys(client, keys)
+        if users:
+            yield users
 
+# Get all users from Redis
+async def get_all_users_from_redis():
+    client = get_redis_client()
+    users = []
+    async for keys in _scan_key_batches(client, "user:*", REDIS_SCAN_BATCH, key_type="string"):
+        users.extend(await _get_users_for_keys(client, keys))
     return users
 
 # Delete a user from Redis
+@timed(redis_latency, "delete_user")
 async def delete_user_from_redis(userid: str, endpoint: str = None, function: str = None):
+    client = get_redis_client()
     key = f"user:{userid}"
     # Check if user exists before deleting
-    if not redis_client.exists(key):
+    if not await client.exists(key):
         raise HTTPException(status_code=404,
-                            detail="delete_user_from_db: Cannot delete user with ID {userid} as it does not exist")
-    return redis_client.delete(key)
+                            detail=f"delete_user_from_db: Cannot delete user with ID {userid} as it does not exist")
+    user_cache.invalidate(userid)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.delete(key)
+        pipe.delete(_user_games_key(userid), _version_key(key))
+        _publish_invalidation(pipe, key)
+        deleted, *_ = await pipe.execute()
+    return deleted
+
+# Run a migration unless it is done or another worker is running it.
+# Returns the migration's result, or None if it was skipped.
+async def run_migration_once(name: str, migration):
+    client = get_redis_client()
+    done_key = f"migration:done:{name}"
+    if await client.exists(done_key):
+        return None
+    if not await client.set(MIGRATION_LOCK_KEY, WORKER_ID, nx=True, ex=MIGRATION_LOCK_TTL):
+        return None
+    try:
+        # The previous holder may have finished it since the first check
+        if await client.exists(done_key):
+            return None
+        result = await migration()
+        await client.set(done_key, int(time.time()))
+        return result
+    finally:
+        if await client.get(MIGRATION_LOCK_KEY) == WORKER_ID:
+            await client.delete(MIGRATION_LOCK_KEY)
+
+# Move game lists embedded in user documents into user:{id}:games sets.
+# Each document is rewritten only if unchanged since it was read; the old list keeps its order
+# and sorts before anything added since (scores are list positions, not timestamps).
+# KEYS[1] = user key, KEYS[2] = user games key, ARGV[1] = JSON that was read,
+# ARGV[2] = JSON without games, ARGV[3..] = game IDs in order.
+MIGRATE_USER_GAMES_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+for i = 3, #ARGV do
+    redis.call('ZADD', KEYS[2], 'NX', i - 3, ARGV[i])
+end
+redis.call('SET', KEYS[1], ARGV[2])
+return 1
+"""
+
+async def migrate_user_games_to_sets(batch_size: int = REDIS_SCAN_BATCH):
+    client = get_redis_client()
+    script = client.register_script(MIGRATE_USER_GAMES_SCRIPT)
+    migrated = 0
+    async for keys in _scan_key_batches(client, "user:*", batch_size, key_type="string"):
+        for key, value in zip(keys, await client.mget(keys)):
+            if not value:
+                continue
+            user = _trusted_user(value)
+            if not user.games:
+                continue
+            args = [value, _user_document(user)] + user.games
+            migrated += await script(keys=[key, _user_games_key(user.userid)], args=args)
+            user_cache.invalidate(user.userid)
+    return migrated
+
+# Pack a card deck into (suits, deck) strings for the "hash" layout:
+# suits are comma-separated and deck holds one character per card, suit after suit
+# (52 bytes for a standard deck). Returns None for decks the layout cannot represent.
+def pack_deck(card_deck):
+    suits = list(card_deck)
+    if not suits or any("," in suit for suit in suits):
+        return None
+    run = len(card_deck[suits[0]])
+    packed = []
+    for suit in suits:
+        cards = card_deck[suit]
+        if len(cards) != run or any(card not in CARD_CODES for card in cards):
+            return None
+        packed.extend(CARD_CODES[card] for card in cards)
+    return ",".join(suits), "".join(packed)
+
+# Unpack the (suits, deck) strings written by pack_deck back into a card deck
+def unpack_deck(suits, deck):
+    suits = suits.split(",")
+    run = len(deck) // len(suits)
+    return {
+        suit: [CARD_VALUES[code] for code in deck[i * run:(i + 1) * run]]
+        for i, suit in enumerate(suits)
+    }
+
+# Hash fields for a game in the "hash" layout, or None if its deck cannot be packed
+def _game_to_hash(game: Game):
+    packed = pack_deck(game.card_deck)
+    if packed is None:
+        return None
+    suits, deck = packed
+    return {"userid": game.userid, "currRnd": game.currRnd, "suits": suits, "deck": deck}
+
+# Build a Game from either stored layout: a JSON string, or the flat HGETALL reply of a hash
+def _game_from_stored(gameid: str, value) -> Game:
+    if isinstance(value, str):
+        # pydantic-core's JSON validator is already faster than decoding and constructing
+        return Game.model_validate_json(value)
+    fields = dict(zip(value[::2], value[1::2]))
+    return Game.model_construct(
+        gameid=gameid,
+        userid=fields["userid"],
+        currRnd=int(fields["currRnd"]),
+        card_deck=unpack_deck(fields["suits"], fields["deck"])
+    )
+
+# Retention TTL for a game owned by userid
+def _game_ttl(userid: str):
+    return GUEST_GAME_TTL if userid == "guest" else USER_GAME_TTL
+
+# Queue the commands that write a game in the configured layout
+def _queue_save_game(pipe, game: Game):
+    key = f"game:{game.gameid}"  # Use the game ID as the Redis key
+    fields = _game_to_hash(game) if GAME_STORAGE == "hash" or game.userid == "guest" else None
+    if fields is None:
+        pipe.set(key, game.model_dump_json())  # Convert the Pydantic model to JSON
+    else:
+        # Replace whatever layout the key had before
+        pipe.delete(key)
+        pipe.hset(key, mapping=fields)
+    ttl = _game_ttl(game.userid)
+    if ttl > 0:
+        pipe.expire(key, ttl)
+    _queue_bump_version(pipe, key, ttl)
+    _publish_invalidation(pipe, key)
 
 # Save a game to Redis
+@timed(redis_latency, "save_game")
 async def save_game_to_redis(game: Game):
-    key = f"game:{game.gameid}"  # Use the game ID as the Redis key
-    value = game.json()  # Convert the Pydantic model to JSON
-    redis_client.set(key, value)
+    async with get_redis_client().pipeline(transaction=True) as pipe:
+        _queue_save_game(pipe, game)
+        await pipe.execute()
+    game_cache.set(game.gameid, game)
     return game
 
-# Get a game from Redis
+# Save many games and add them to their owners' games sets in one MULTI/EXEC transaction.
+# Owners other than "guest" must exist. Their documents are WATCHed, so a user deleted
+# mid-batch makes the whole batch retry instead of leaving orphaned games sets.
+@timed(redis_latency, "save_games")
+async def save_games_to_redis(games: List[Game], endpoint: str = None, function: str = None):
+    owners = sorted({game.userid for game in games if game.userid != "guest"})
+    user_keys = [f"user:{userid}" for userid in owners]
+    async with get_redis_client().pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                values = []
+                if user_keys:
+                    await pipe.watch(*user_keys)
+                    values = await pipe.mget(user_keys)
+                missing = [userid for userid, value in zip(owners, values) if not value]
+                if missing:
+                    await pipe.reset()
+                    raise UserNotFoundException(f"Users not found: {', '.join(missing)}", endpoint, function)
+
+                pipe.multi()
+                for game in games:
+                    _queue_save_game(pipe, game)
+                for userid, key in zip(owners, user_keys):
+                    _queue_add_games(pipe, userid, [game.gameid for game in games if game.userid == userid])
+                    _queue_bump_version(pipe, key)
+                    _publish_invalidation(pipe, key)
+                await pipe.execute()
+                break
+            except WatchError:
+                continue
+    for userid in owners:
+        user_cache.invalidate(userid)
+    return games
+
+# IDs among `userids` ("guest" aside) that have no user document, checked in one round trip
+async def get_missing_users_from_redis(userids: List[str]):
+    owners = sorted({userid for userid in userids if userid != "guest"})
+    if not owners:
+        return []
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for userid in owners:
+            pipe.exists(f"user:{userid}")
+        found = await pipe.execute()
+    return [userid for userid, exists in zip(owners, found) if not exists]
+
+# Fetch a game in whichever layout it is stored, in a single round trip.
+# Returns the JSON string, the flat HGETALL reply, or nil.
+GET_GAME_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+if kind == 'string' then
+    return redis.call('GET', KEYS[1])
+elseif kind == 'hash' then
+    return redis.call('HGETALL', KEYS[1])
+end
+return nil
+"""
+
+# Get a game, from the in-process cache when fresh, otherwise from Redis
+@timed(redis_latency, "get_game")
 async def get_game_from_redis(gameid: str, endpoint: str = None, function: str = None) -> Game:
-    key = f"game:{gameid}"
-    value = redis_client.get(key)
+    game = game_cache.get(gameid)
+    if game is not None:
+        return game
+    client = get_redis_client()
+    value = await client.register_script(GET_GAME_SCRIPT)(keys=[f"game:{gameid}"])
     if value:
-        return Game.parse_raw(value)  # Convert the JSON string back to a Pydantic model
+        game = _game_from_stored(gameid, value)
+        game_cache.set(gameid, game)
+        return game
     return None
 
+# Get a game and its version together, bypassing the cache so the two cannot disagree.
+# Returns (version, game); version is None for a game that has none yet, game is None if it does not exist.
+@timed(redis_latency, "get_versioned_game")
+async def get_versioned_game_from_redis(gameid: str):
+    client = get_redis_client()
+    key = f"game:{gameid}"
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.get(_version_key(key))
+        await client.register_script(GET_GAME_SCRIPT)(keys=[key], client=pipe)
+        version, value = await pipe.execute()
+    if not value:
+        return None, None
+    game = _game_from_stored(gameid, value)
+    if version is None:
+        await _start_version(key, _game_ttl(game.userid))
+    return _int_or_none(version), game
+
+# Get all games from Redis
+async def get_all_games_from_redis():
+    client = get_redis_client()
+    script = client.register_script(GET_GAME_SCRIPT)
+    games = []
+    async for keys in _scan_key_batches(client, "game:*", REDIS_SCAN_BATCH):
+        # One pipelined round trip per SCAN batch, whatever mix of layouts it holds
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                await script(keys=[key], client=pipe)
+            values = await pipe.execute()
+        games.extend(
+            _game_from_stored(key.split(":", 1)[1], value)
+            for key, value in zip(keys, values) if value
+        )
+    return games
+
+# Replace a JSON game with its hash layout, only if the JSON is unchanged since it was read.
+# The key keeps its remaining TTL. KEYS[1] = game key, ARGV[1] = JSON that was read, ARGV[2..] = field/value pairs.
+MIGRATE_GAME_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+# Convert existing game:* JSON strings to the "hash" layout in the background.
+# Safe to run while the API is serving: a game changed mid-migration is left in the JSON layout,
+# which stays readable.
+# A value that does not decode as a game is logged and left as it is; the rest carry on.
+async def migrate_games_to_hash(batch_size: int = REDIS_SCAN_BATCH):
+    client = get_redis_client()
+    script = client.register_script(MIGRATE_GAME_SCRIPT)
+    migrated = 0
+    failed = 0
+    cursor = 0
+    while True:
+        cursor, keys = await client.scan(cursor=cursor, match="game:*", count=batch_size, _type="string")
+        if keys:
+            for key, value in zip(keys, await client.mget(keys)):
+                if not value:
+                    continue
+                try:
+                    fields = _game_to_hash(Game.model_validate_json(value))
+                except ValueError as e:
+                    failed += 1
+                    logger.warning(f"Cannot migrate {key} to the hash layout: {str(e)}")
+                    continue
+                if fields is None:
+                    continue
+                args = [value]
+                for field, field_value in fields.items():
+                    args.extend([field, field_value])
+                migrated += await script(keys=[key], args=args)
+        if cursor == 0:
+            break
+    if failed:
+        logger.warning(f"Left {failed} unreadable games in the JSON layout")
+    return migrated
+
+# Draw the current round's cards and advance currRnd in one atomic server-side step.
+# Handles both the "hash" layout (a single HINCRBY) and legacy JSON games, bumps the game's version,
+# restarts the TTL of both and publishes the draw to the game's event channel.
+# KEYS[1] = game key, KEYS[2] = game version key, ARGV[1] = requesting user ID, ARGV[2] / ARGV[3] = guest / user game TTL (0 = none),
+# ARGV[4] = event channel ('' to not publish), ARGV[5] = ID of the session drawing ('' outside sessions).
+# Returns nil if the game does not exist, [{"owner"}] alone if the user does not own it,
+# otherwise [{"owner", "round", "cards"}, updated game in its stored layout].
+PULL_CARD_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+local userid = ARGV[1]
+local function publish(round, cards)
+    if ARGV[4] ~= '' then
+        redis.call('PUBLISH', ARGV[4], cjson.encode({type = 'draw', round = round, cards = cards, source = ARGV[5]}))
+    end
+end
+local function refresh_ttl(owner)
+    redis.call('INCR', KEYS[2])
+    local ttl = tonumber(owner == 'guest' and ARGV[2] or ARGV[3])
+    if ttl > 0 then
+        redis.call('EXPIRE', KEYS[1], ttl)
+        redis.call('EXPIRE', KEYS[2], ttl)
+    end
+end
+if kind == 'hash' then
+    local fields = redis.call('HMGET', KEYS[1], 'userid', 'currRnd', 'suits', 'deck')
+    local owner, round, deck = fields[1], tonumber(fields[2]), fields[4]
+    if owner ~= userid and userid ~= 'guest' then
+        return {cjson.encode({owner = owner})}
+    end
+    local suits = {}
+    for suit in string.gmatch(fields[3], '[^,]+') do
+        suits[#suits + 1] = suit
+    end
+    local run = #deck / #suits
+    local cards = {}
+    if round < run then
+        for i, suit in ipairs(suits) do
+            local code = string.sub(deck, (i - 1) * run + round + 1, (i - 1) * run + round + 1)
+            cards[suit] = (code == 'T') and '10' or code
+        end
+    end
+    redis.call('HINCRBY', KEYS[1], 'currRnd', 1)
+    refresh_ttl(owner)
+    publish(round, cards)
+    return {cjson.encode({owner = owner, round = round, cards = cards}), redis.call('HGETALL', KEYS[1])}
+elseif kind ~= 'string' then
+    return nil
+end
+local game = cjson.decode(redis.call('GET', KEYS[1]))
+-- Games saved before owners were recorded belong to guests (see models.Game)
+local owner = game.userid or 'guest'
+if owner ~= userid and userid ~= 'guest' then
+    return {cjson.encode({owner = owner})}
+end
+local round = game.currRnd
+local cards = {}
+for suit, values in pairs(game.card_deck) do
+    if round < #values then
+        cards[suit] = values[round + 1]
+    end
+end
+game.currRnd = round + 1
+local stored = cjson.encode(game)
+redis.call('SET', KEYS[1], stored)
+refresh_ttl(owner)
+publish(round, cards)
+return {cjson.encode({owner = owner, round = round, cards = cards}), stored}
+"""
+
+# Pull the current round's cards from a game in Redis (no lost rounds under concurrency).
+# The draw and the requesting user's lookup are pipelined, so this costs a single round trip;
+# load_user=False skips the lookup. `source` tags the published draw event with the session
+# that made it, so that session can skip its own event.
+# Returns None if the game does not exist; otherwise the draw result, which carries the
+# updated "game" and the "user" (None for guests) unless the user does not own the game.
+@timed(redis_latency, "pull_card")
+async def pull_card_from_redis(gameid: str, userid: str, load_user: bool = True, source: str = None):
+    client = get_redis_client()
+    script = client.register_script(PULL_CARD_SCRIPT)  # EVALSHA, falling back to EVAL on NOSCRIPT
+    key = f"game:{gameid}"
+    load_user = load_user and userid != "guest"
+    channel = game_events_channel(gameid) if GAME_EVENTS else ""
+    game_cache.invalidate(gameid)
+    async with client.pipeline(transaction=False) as pipe:
+        await script(keys=[key, _version_key(key)],
+                     args=[userid, GUEST_GAME_TTL, USER_GAME_TTL, channel, source or ""], client=pipe)
+        _publish_invalidation(pipe, key)
+        if load_user:
+            pipe.get(f"user:{userid}")
+            pipe.zcard(_user_games_key(userid))
+        replies = await pipe.execute()
+    value = replies[0]
+    if not value:
+        return None
+    result = orjson.loads(value[0])
+    if len(value) > 1:
+        result["game"] = _game_from_stored(gameid, value[1])
+        game_cache.set(gameid, result["game"])
+        user, games_count = replies[-2:] if load_user else (None, None)
+        result["user"] = _user_from_stored(user, games_count=games_count) if user else None
+        if result["user"]:
+            user_cache.set(userid, result["user"])
+    return result
+
+# Publish an event (e.g. a reset) on a game's event channel. Draws are published by PULL_CARD_SCRIPT.
+async def publish_game_event_to_redis(gameid: str, event: dict):
+    if GAME_EVENTS:
+        await get_redis_client().publish(game_events_channel(gameid), orjson.dumps(event))
+
+# A game's player session (the one WebSocket allowed to send commands) is held under
+# game_session:{id} while it lives, and lapses after its TTL if its worker goes away.
+def _game_session_key(gameid: str):
+    return f"game_session:{gameid}"
+
+# Take or extend a player session. KEYS[1] = session key, ARGV[1] = session ID, ARGV[2] = TTL.
+# Returns 0 if another session holds the game.
+CLAIM_GAME_SESSION_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Release a player session, unless it already lapsed and another session took the game
+RELEASE_GAME_SESSION_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Claim (or refresh) a game's player session for `session`; False if another session holds it
+async def claim_game_session_in_redis(gameid: str, session: str, ttl: int) -> bool:
+    client = get_redis_client()
+    return bool(await client.register_script(CLAIM_GAME_SESSION_SCRIPT)(
+        keys=[_game_session_key(gameid)], args=[session, ttl]
+    ))
+
+async def release_game_session_in_redis(gameid: str, session: str):
+    client = get_redis_client()
+    await client.register_script(RELEASE_GAME_SESSION_SCRIPT)(keys=[_game_session_key(gameid)], args=[session])
+
+# Stateless (encrypted token) games of registered users keep only the next round their token
+# may be spent on, so a token cannot be replayed once it has been used
+def _game_token_key(gameid: str):
+    return f"game_token:{gameid}"
+
+# Start tracking a stateless game's rounds, with the same retention TTL as a stored game
+@timed(redis_latency, "track_game_token")
+async def track_game_token_in_redis(game: Game):
+    ttl = _game_ttl(game.userid)
+    await get_redis_client().set(_game_token_key(game.gameid), game.currRnd, ex=ttl if ttl > 0 else None)
+
+# Spend a token for round ARGV[1] if it is the next round of the game, restarting the TTL (ARGV[2], 0 = none).
+# Returns 1 if the token was spent, 0 if it was already used or the game is unknown.
+SPEND_GAME_TOKEN_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1])) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], tonumber(ARGV[1]) + 1)
+if tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+@timed(redis_latency, "spend_game_token")
+async def spend_game_token_in_redis(gameid: str, round: int):
+    client = get_redis_client()
+    script = client.register_script(SPEND_GAME_TOKEN_SCRIPT)
+    return bool(await script(keys=[_game_token_key(gameid)], args=[round, USER_GAME_TTL]))
+
 # Delete a game from Redis
+@timed(redis_latency, "delete_game")
 async def delete_game_from_redis(gameid: str, endpoint: str = None, function: str = None):
+    client = get_redis_client()
     key = f"game:{gameid}"
     # Check if game exists before deleting
-    if not redis_client.exists(key):
+    if not await client.exists(key):
         raise HTTPException(status_code=404,
                             detail=f"delete game from db: Cannot delete game with ID {gameid} as it does not exist")
-    return redis_client.delete(key)
+    game_cache.invalidate(gameid)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.delete(key)
+        pipe.delete(_version_key(key))
+        _publish_invalidation(pipe, key)
+        deleted, *_ = await pipe.execute()
+    return deleted
+
+# Walk every game in SCAN batches, yielding (games, unreadable) per batch: a list of (game, ttl)
+# and a list of (key, ttl) for values that do not decode as a game, so one bad document cannot
+# stop the walk. ttl is the key's remaining seconds, or -1 for a key that never expires.
+async def scan_games_from_redis(batch_size: int = REDIS_SCAN_BATCH):
+    client = get_redis_client()
+    script = client.register_script(GET_GAME_SCRIPT)
+    async for keys in _scan_key_batches(client, "game:*", batch_size):
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                await script(keys=[key], client=pipe)
+                pipe.ttl(key)
+            replies = await pipe.execute()
+        games, unreadable = [], []
+        for key, value, ttl in zip(keys, replies[::2], replies[1::2]):
+            if not value:
+                continue
+            try:
+                games.append((_game_from_stored(key.split(":", 1)[1], value), ttl))
+            except Exception:
+                unreadable.append((key, ttl))
+        yield games, unreadable
+
+# Expire keys after `ttl` seconds, e.g. unreadable games left behind by older code
+async def expire_keys_in_redis(keys: List[str], ttl: int):
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.expire(key, ttl)
+        replies = await pipe.execute()
+    return sum(1 for reply in replies if reply)
+
+# Give games their owner's retention TTL, e.g. games saved before TTLs were introduced
+async def expire_games_in_redis(games: List[Game]):
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for game in games:
+            ttl = _game_ttl(game.userid)
+            if ttl > 0:
+                pipe.expire(f"game:{game.gameid}", ttl)
+                pipe.expire(_version_key(f"game:{game.gameid}"), ttl)
+        replies = await pipe.execute()
+    return sum(1 for reply in replies[::2] if reply)
+
+# Delete a finished game unless it changed since it was read (a reset or a draw moves its round),
+# dropping it from its owner's games set and bumping the owner's version in the same step.
+# KEYS[1] = game key, KEYS[2] = game version key, KEYS[3] / KEYS[4] = owner's games set / version key (users only),
+# ARGV[1] = round the game was read at, ARGV[2] = game ID. Returns 1 if the game was removed, else 0.
+REMOVE_GAME_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+local round
+if kind == 'hash' then
+    round = redis.call('HGET', KEYS[1], 'currRnd')
+elseif kind == 'string' then
+    local ok, game = pcall(cjson.decode, redis.call('GET', KEYS[1]))
+    if not ok or type(game) ~= 'table' then
+        return 0
+    end
+    round = game.currRnd
+else
+    return 0
+end
+if tonumber(round) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+if KEYS[3] then
+    redis.call('ZREM', KEYS[3], ARGV[2])
+    redis.call('INCR', KEYS[4])
+end
+return 1
+"""
+
+# Delete games as they were read and drop them from their owners' games sets in one round trip.
+# A game written to since it was read is kept. Returns how many were removed.
+async def remove_games_from_redis(games: List[Game]):
+    client = get_redis_client()
+    script = client.register_script(REMOVE_GAME_SCRIPT)
+    async with client.pipeline(transaction=False) as pipe:
+        for game in games:
+            key = f"game:{game.gameid}"
+            keys = [key, _version_key(key)]
+            if game.userid != "guest":
+                keys += [_user_games_key(game.userid), _version_key(f"user:{game.userid}")]
+            await script(keys=keys, args=[game.currRnd, game.gameid], client=pipe)
+        for game in games:
+            _publish_invalidation(pipe, f"game:{game.gameid}")
+            if game.userid != "guest":
+                _publish_invalidation(pipe, f"user:{game.userid}")
+        replies = await pipe.execute()
+    for game in games:
+        game_cache.invalidate(game.gameid)
+        user_cache.invalidate(game.userid)
+    return sum(replies[:len(games)])
+
+# Remove IDs of games that no longer exist (expired, archived or never saved) from every user's games set
+async def prune_user_games_in_redis(batch_size: int = REDIS_SCAN_BATCH):
+    client = get_redis_client()
+    pruned = 0
+    async for keys in _scan_key_batches(client, "user:*:games", batch_size, key_type="zset"):
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.zrange(key, 0, -1)
+            members = await pipe.execute()
+        candidates = [(key, gameid) for key, gameids in zip(keys, members) for gameid in gameids]
+        if not candidates:
+            continue
+        async with client.pipeline(transaction=False) as pipe:
+            for _, gameid in candidates:
+                # Stateless games only have their replay counter in Redis
+                pipe.exists(f"game:{gameid}", _game_token_key(gameid))
+            exists = await pipe.execute()
+        dangling = {}
+        for (key, gameid), found in zip(candidates, exists):
+            if not found:
+                dangling.setdefault(key, []).append(gameid)
+        if not dangling:
+            continue
+        async with client.pipeline(transaction=False) as pipe:
+            for key, gameids in dangling.items():
+                pipe.zrem(key, *gameids)
+                _queue_bump_version(pipe, key[:-len(":games")])
+                _publish_invalidation(pipe, key[:-len(":games")])
+            await pipe.execute()
+        for key, gameids in dangling.items():
+            user_cache.invalidate(key[len("user:"):-len(":games")])
+            pruned += len(gameids)
+    return pruned
@@ -0,0 +1,82 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import List
+
+from models import Game
+from services.cache_service import WORKER_ID
+from services.redis_service import (
+    get_redis_client, scan_games_from_redis, expire_games_in_redis, expire_keys_in_redis, remove_games_from_redis,
+    prune_user_games_in_redis, REDIS_SCAN_BATCH, USER_GAME_TTL
+)
+from utils.logger import logger
+
+# Finished games are appended to <GAME_ARCHIVE_DIR>/games_YYYYMMDD.jsonl.gz before they leave Redis.
+# This is the only copy once they are gone, so in a container it must be on a volume (see docker-compose.yml).
+GAME_ARCHIVE_DIR = os.getenv("GAME_ARCHIVE_DIR", "archive")
+# Seconds between retention sweeps (0 disables the sweeper). Only one worker sweeps per interval.
+RETENTION_SWEEP_INTERVAL = float(os.getenv("RETENTION_SWEEP_INTERVAL", "300"))
+RETENTION_LOCK_KEY = "retention:sweep"
+
+
+# A game is finished once every card has been dealt, i.e. its round is past the 13 of a full deck
+def is_finished(game: Game) -> bool:
+    return game.currRnd >= max((len(cards) for cards in game.card_deck.values()), default=0)
+
+def _archive_path(directory: str):
+    return os.path.join(directory, f"games_{datetime.now().strftime('%Y%m%d')}.jsonl.gz")
+
+def _write_archive(path: str, lines: List[str]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Each append adds a gzip member; gzip readers return the members as one stream
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        archive.write("".join(f"{line}\n" for line in lines))
+
+# Append games to today's compressed archive file, off the event loop
+async def archive_games(games: List[Game], directory: str = None):
+    path = _archive_path(directory or GAME_ARCHIVE_DIR)
+    await asyncio.to_thread(_write_archive, path, [game.model_dump_json() for game in games])
+    return path
+
+# Read the games stored in an archive file
+def load_archived_games(path: str) -> List[Game]:
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        return [Game.model_validate_json(line) for line in archive if line.strip()]
+
+# One pass over Redis: archive and remove finished games, give games without a TTL their
+# retention TTL (unreadable ones get the longest), and prune dangling game IDs from users' games sets
+async def sweep_games(batch_size: int = REDIS_SCAN_BATCH, directory: str = None):
+    stats = {"archived": 0, "expiring": 0, "unreadable": 0, "pruned": 0}
+    async for batch, unreadable in scan_games_from_redis(batch_size):
+        finished = [game for game, _ in batch if is_finished(game)]
+        if finished:
+            # Written to disk before deleting, so a failed write never loses a game. A game changed in
+            # between (e.g. reset) is not deleted: it stays live and its archived copy is a past state.
+            await archive_games(finished, directory)
+            stats["archived"] += await remove_games_from_redis(finished)
+        untimed = [game for game, ttl in batch if ttl == -1 and not is_finished(game)]
+        if untimed:
+            stats["expiring"] += await expire_games_in_redis(untimed)
+        if unreadable:
+            # Kept for inspection, but given the longest retention so they do not linger forever
+            logger.warning(f"Retention sweep skipped unreadable games: {', '.join(key for key, _ in unreadable)}")
+            stats["unreadable"] += len(unreadable)
+            untimed_keys = [key for key, ttl in unreadable if ttl == -1]
+            if untimed_keys and USER_GAME_TTL > 0:
+                stats["expiring"] += await expire_keys_in_redis(untimed_keys, USER_GAME_TTL)
+    stats["pruned"] = await prune_user_games_in_redis(batch_size)
+    return stats
+
+# Sweep every `interval` seconds for as long as the worker runs.
+# A short-lived Redis lock makes the workers take turns instead of sweeping in parallel.
+async def run_sweeper(interval: float = RETENTION_SWEEP_INTERVAL):
+    while True:
+        try:
+            if await get_redis_client().set(RETENTION_LOCK_KEY, WORKER_ID, nx=True, ex=max(int(interval), 1)):
+                stats = await sweep_games()
+                logger.info(f"Retention sweep: {json.dumps(stats)}")
+        except Exception as e:
+            logger.error(f"Retention sweep failed: {str(e)}")
+        await asyncio.sleep(interval)
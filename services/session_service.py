@@ -0,0 +1,89 @@
+import os
+from uuid import uuid4
+
+import orjson
+
+from services.event_service import GAME_EVENTS_KEEPALIVE
+from services.game_service import pull_card, reset_game, get_game_view
+from services.redis_service import claim_game_session_in_redis, release_game_session_in_redis
+from utils.logger import logger
+
+# Seconds a player session outlives its last refresh (sessions refresh every GAME_EVENTS_KEEPALIVE),
+# i.e. how long a game stays locked after its player's worker died without releasing it
+GAME_SESSION_TTL = int(os.getenv("GAME_SESSION_TTL", str(int(GAME_EVENTS_KEEPALIVE * 2))))
+
+# Close codes of refused sessions
+SESSION_GAME_NOT_FOUND = 4404
+SESSION_NOT_OWNER = 4403
+SESSION_TAKEN = 4409
+
+
+class GameSession:
+    """
+    One WebSocket connection to a game. A connection made with the owner's userid becomes the
+    game's player session (one at a time, across workers) and may send commands; any other
+    connection spectates. Commands are JSON messages: {"action": "draw"} or {"action": "reset"}.
+    """
+    def __init__(self, gameid: str, userid: str = None, lang: str = None):
+        self.id = uuid4().hex
+        self.gameid = gameid
+        self.userid = userid
+        self.lang = lang
+        self.player = False
+        self.draws = 0
+        self.resets = 0
+
+    # The game's current state as the first message, or an error with the code to close with
+    async def open(self):
+        game = await get_game_view(self.gameid)
+        if game is None:
+            return {"type": "error", "message": "Game not found", "code": SESSION_GAME_NOT_FOUND}
+        if self.userid is not None:
+            if self.userid != game["user_id"]:
+                return {"type": "error", "message": "User ID does not match the game owner", "code": SESSION_NOT_OWNER}
+            if not await claim_game_session_in_redis(self.gameid, self.id, GAME_SESSION_TTL):
+                return {"type": "error", "message": "Game already has a player session", "code": SESSION_TAKEN}
+            self.player = True
+        return {"type": "game", "player": self.player, **game}
+
+    # Keep the player session's claim alive and return whether it is still held. A session whose claim
+    # went to another session is demoted to spectator. A failed refresh is retried on the next keepalive:
+    # the claim outlives one missed refresh, and a lapsed one is taken back if nobody else took it.
+    async def refresh(self):
+        if self.player:
+            try:
+                self.player = await claim_game_session_in_redis(self.gameid, self.id, GAME_SESSION_TTL)
+            except Exception as e:
+                logger.warning(f"Could not refresh the player session of {self.gameid}: {str(e)}")
+        return self.player
+
+    async def close(self):
+        if self.player:
+            await release_game_session_in_redis(self.gameid, self.id)
+            self.player = False
+
+    # Run one command and return the reply for this connection (events go to the others)
+    async def handle(self, message: str):
+        if not self.player:
+            return {"type": "error", "message": "Spectators cannot send commands"}
+        try:
+            action = orjson.loads(message).get("action")
+        except (orjson.JSONDecodeError, AttributeError):
+            return {"type": "error", "message": "Commands must be JSON objects"}
+
+        if action == "draw":
+            result = await pull_card(self.userid, self.gameid, lang=self.lang, source=self.id, load_user=False)
+            if "error" in result:
+                return {"type": "error", "message": result["error"]}
+            self.draws += 1
+            reply = {"type": "draw", "game_id": self.gameid, "round": result["round"], "cards": result["cards"]}
+            if "meanings" in result:
+                reply["meanings"] = result["meanings"]
+            return reply
+        if action == "reset":
+            result = await reset_game(self.gameid, self.userid, source=self.id)
+            if "error" in result:
+                return {"type": "error", "message": result["error"]}
+            self.resets += 1
+            return {"type": "reset", "game_id": result["game_id"]}
+        return {"type": "error", "message": f"Unknown action: {action}"}
@@ -0,0 +1,79 @@
+import base64
+import os
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from exceptions.exceptions import InvalidGameTokenException
+from models import Game
+from services.redis_service import pack_deck, unpack_deck
+
+# Key material for stateless game tokens; the mode is off while it is unset.
+# Every worker must share it, and changing it invalidates the tokens already handed out.
+GAME_TOKEN_SECRET = os.getenv("GAME_TOKEN_SECRET", "")
+# Version 2 tokens are encrypted; version 1 only signed the payload and showed the deck to anyone
+TOKEN_VERSION = "2"
+NONCE_BYTES = 12
+TAG_BYTES = 16
+
+
+def tokens_enabled() -> bool:
+    return bool(GAME_TOKEN_SECRET)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+# AES-256-GCM keyed from the secret, derived once per secret
+@lru_cache(maxsize=4)
+def _cipher(secret: str) -> AESGCM:
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"game-token").derive(secret.encode())
+    return AESGCM(key)
+
+def _seal(payload: bytes) -> str:
+    nonce = os.urandom(NONCE_BYTES)
+    return _b64encode(nonce + _cipher(GAME_TOKEN_SECRET).encrypt(nonce, payload, None))
+
+def _open(token: str) -> bytes:
+    data = _b64decode(token)
+    if len(data) < NONCE_BYTES + TAG_BYTES:
+        raise ValueError("Token too short")
+    return _cipher(GAME_TOKEN_SECRET).decrypt(data[:NONCE_BYTES], data[NONCE_BYTES:], None)
+
+# Encode a game as an encrypted, authenticated token: clients can neither read the deck nor change it.
+# The payload carries the IDs, the round and the deck in the compact layout of the "hash" storage
+# (one character per card), about 210 characters in all once encrypted.
+# The fields are separated by "|", so IDs containing one cannot be encoded.
+def encode_game_token(game: Game, endpoint: str = None, function: str = None) -> str:
+    if "|" in game.gameid or "|" in game.userid:
+        raise InvalidGameTokenException("Game and user IDs in a game token cannot contain '|'", endpoint, function)
+    suits, deck = pack_deck(game.card_deck)
+    payload = "|".join([TOKEN_VERSION, game.gameid, game.userid, str(game.currRnd), suits, deck]).encode()
+    return _seal(payload)
+
+# Decode a token back into its game, refusing anything this server did not encrypt
+def decode_game_token(token: str, endpoint: str = None, function: str = None) -> Game:
+    try:
+        payload = _open(token)
+    except ValueError:
+        raise InvalidGameTokenException("Malformed game token", endpoint, function)
+    except InvalidTag:
+        raise InvalidGameTokenException("Invalid game token", endpoint, function)
+    try:
+        version, *fields = payload.decode().split("|")
+    except UnicodeDecodeError:
+        raise InvalidGameTokenException("Malformed game token", endpoint, function)
+    if version != TOKEN_VERSION:
+        raise InvalidGameTokenException(f"Unsupported game token version {version}", endpoint, function)
+    # Encrypted by us, so the fields are trusted as-is once they parse
+    try:
+        gameid, userid, current_round, suits, deck = fields
+        return Game.model_construct(gameid=gameid, userid=userid, currRnd=int(current_round),
+                                    card_deck=unpack_deck(suits, deck))
+    except (ValueError, KeyError, IndexError):
+        raise InvalidGameTokenException("Malformed game token", endpoint, function)
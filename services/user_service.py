@@ -2,7 +2,10 @@ from uuid import uuid4
 from pydantic import EmailStr
 
 from models import User
-from services.redis_service import save_user_to_redis, get_user_from_redis
+from services.redis_service import (
+    save_user_to_redis, get_user_from_redis, add_game_to_user_in_redis, get_user_games_page_from_redis,
+    get_versioned_user_from_redis, get_version_from_redis
+)
 
 
 # Function to create a new user
@@ -27,37 +30,46 @@ async def create_user(username: str, email: EmailStr, full_name: str = None) ->
         return None
 
 async def add_game_to_user(userid, gameid, endpoint: str = None, function: str = None) -> User:
-    # If userid is "guest", create a temporary user object
+    # If userid is "guest", create a temporary user object (nothing to validate, so it is constructed directly)
     if userid == "guest":
-        return User(
+        return User.model_construct(
             userid="guest",
             username="Guest User",
             email="guest@example.com",
             games=[gameid]
         )
     
-    # Find user
-    user = await get_user_from_redis(userid, endpoint, function)
-    # If user exists, add game to user
-    if user:
-        # Only add the game if it's not already in the list
-        if gameid not in user.games:
-            user.games.append(gameid)
-            db_user = await save_user_to_redis(user)
-            if db_user:
-                return db_user
-            else:
-                return None
-    # If user does not exist, return error
-    else:
+    if not await record_game_for_user(userid, gameid, endpoint, function):
+        # If user does not exist, return error
         return None
-    return user
+    return await get_user_from_redis(userid, endpoint, function)
+
+# Function to add a game to a user's history without reading the user back (for starting games).
+# Returns whether the user exists; guests have no history, so there is nothing to record for them.
+async def record_game_for_user(userid, gameid, endpoint: str = None, function: str = None) -> bool:
+    if userid == "guest":
+        return True
+    # Add the game to the user's games set; adding one that is already there is a no-op
+    return await add_game_to_user_in_redis(userid, gameid, endpoint, function)
 
-# Function to get a user by ID
-async def get_user(userid: str) -> User:
-    user = await get_user_from_redis(userid)
+# Function to get a user by ID; the full game list is only read when include_games is set
+async def get_user(userid: str, include_games: bool = False) -> User:
+    user = await get_user_from_redis(userid, load_games=include_games)
     if user:
         return user
     else:
         return None
 
+# Function to get a user along with its version, for responses tagged with an ETag
+async def get_versioned_user(userid: str, include_games: bool = False):
+    return await get_versioned_user_from_redis(userid, load_games=include_games)
+
+# Function to get only a user's version (None if it has none), to answer conditional requests
+async def get_user_version(userid: str):
+    return await get_version_from_redis(f"user:{userid}")
+
+# Function to page through a user's games, newest first
+async def get_user_games(userid: str, before: float = None, limit: int = 20, summary: bool = False,
+                         endpoint: str = None, function: str = None):
+    games, next_before = await get_user_games_page_from_redis(userid, before, limit, summary, endpoint, function)
+    return {"games": games, "next_before": next_before}
@@ -0,0 +1,18 @@
+import pytest
+import fakeredis
+
+from services import redis_service
+from services.cache_service import caches
+
+
+# Swap the shared Redis client for an in-memory fakeredis one, so nothing dials a real server
+@pytest.fixture(autouse=True)
+async def fake_redis(monkeypatch):
+    # Roomy pool so concurrency tests are not capped by fakeredis' default of 100 connections
+    client = fakeredis.FakeAsyncRedis(decode_responses=True, max_connections=500)
+    monkeypatch.setattr(redis_service, "redis_client", client)
+    for cache in caches.values():
+        cache.clear()
+    yield client
+    await client.flushall()
+    await client.aclose()
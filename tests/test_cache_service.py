@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from services.cache_service import (
+    TTLCache, user_cache, invalidation_message, listen_for_invalidations, CACHE_INVALIDATION_CHANNEL
+)
+
+# Test the TTLCache class
+def test_ttl_cache_hit_and_miss():
+    cache = TTLCache("test", ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 0.5
+
+def test_ttl_cache_expiry():
+    cache = TTLCache("test", ttl=10)
+    with patch('services.cache_service.time.monotonic', return_value=100.0):
+        cache.set("a", 1)
+    with patch('services.cache_service.time.monotonic', return_value=111.0):
+        assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache("test", ttl=60, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_cache_disabled():
+    cache = TTLCache("test", ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+def test_ttl_cache_invalidate():
+    cache = TTLCache("test", ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+
+def test_ttl_cache_invalidates_linked_caches():
+    linked = TTLCache("linked", ttl=60)
+    cache = TTLCache("test", ttl=60, linked=[linked])
+    for key in ["a", "b", "c"]:
+        linked.set(key, (1, key))
+    
+    cache.invalidate("a")
+    cache.set("b", 2)
+    
+    assert linked.get("a") is None
+    assert linked.get("b") is None
+    assert linked.get("c") == (1, "c")
+
+# Test cross-worker invalidation over pub/sub
+@pytest.mark.asyncio
+async def test_listen_for_invalidations(fake_redis):
+    user_cache.set("from-other-worker", "stale")
+    user_cache.set("from-this-worker", "fresh")
+    listener = asyncio.create_task(listen_for_invalidations(fake_redis))
+    await asyncio.sleep(0.05)
+
+    await fake_redis.publish(CACHE_INVALIDATION_CHANNEL, "other-worker user:from-other-worker")
+    await fake_redis.publish(CACHE_INVALIDATION_CHANNEL, invalidation_message("user:from-this-worker"))
+    await asyncio.sleep(0.05)
+    listener.cancel()
+
+    # Only the entry changed by another worker is dropped
+    assert user_cache.get("from-other-worker") is None
+    assert user_cache.get("from-this-worker") == "fresh"
@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from models import Game
+from services.event_service import GameEventHub, event_for_subscriber, sse_message, game_events_channel
+from services.game_service import reset_game
+from services.redis_service import save_game_to_redis, pull_card_from_redis
+
+
+async def save_test_game(userid="test-user"):
+    game = Game(gameid="test-game-id", userid=userid, currRnd=0,
+                card_deck={"Hearts": ["A", "2"], "Spades": ["K", "Q"]})
+    await save_game_to_redis(game)
+    return game
+
+# Test GameEventHub fan-out
+@pytest.mark.asyncio
+async def test_hub_dispatches_to_each_subscriber_of_the_game():
+    hub = GameEventHub(queue_size=1)
+    first, second, other = hub.subscribe("game-1"), hub.subscribe("game-1"), hub.subscribe("game-2")
+    
+    hub.dispatch("game-1", {"type": "reset"})
+    
+    assert first.get_nowait() == second.get_nowait() == {"type": "reset"}
+    assert other.empty()
+    
+    # Verify a full queue drops events instead of blocking the others
+    hub.dispatch("game-1", {"type": "reset"})
+    hub.unsubscribe("game-1", first)
+    hub.dispatch("game-1", {"type": "reset"})
+    assert hub.dropped == 1
+    hub.unsubscribe("game-1", second)
+    assert "game-1" not in hub.subscribers
+
+@pytest.mark.asyncio
+async def test_hub_receives_published_draws_and_resets(fake_redis):
+    await save_test_game()
+    hub = GameEventHub()
+    queue = hub.subscribe("test-game-id")
+    listener = asyncio.create_task(hub.listen(fake_redis))
+    while not (await fake_redis.pubsub_numpat()):
+        await asyncio.sleep(0.01)
+    
+    await pull_card_from_redis("test-game-id", "test-user", source="session-1")
+    await reset_game("test-game-id", "test-user")
+    
+    draw = await asyncio.wait_for(queue.get(), 1)
+    assert (draw["type"], draw["round"], draw["source"]) == ("draw", 0, "session-1")
+    assert draw["cards"] == {"Hearts": "A", "Spades": "K"}
+    assert (await asyncio.wait_for(queue.get(), 1))["type"] == "reset"
+    listener.cancel()
+
+@pytest.mark.asyncio
+@patch('services.event_service.GAME_EVENTS_RETRY', 0.01)
+async def test_hub_resubscribes_after_a_redis_error(fake_redis):
+    await save_test_game()
+    hub = GameEventHub()
+    queue = hub.subscribe("test-game-id")
+    # The first subscription fails as if Redis were down, the next one works
+    broken = MagicMock()
+    broken.psubscribe.side_effect = ConnectionError("Redis is down")
+    broken.aclose.side_effect = ConnectionError("Redis is down")
+    client = MagicMock()
+    client.pubsub.side_effect = [broken, fake_redis.pubsub()]
+    listener = asyncio.create_task(hub.listen(client))
+    while not (await fake_redis.pubsub_numpat()):
+        await asyncio.sleep(0.01)
+    
+    await reset_game("test-game-id", "test-user")
+    
+    assert (await asyncio.wait_for(queue.get(), 1))["type"] == "reset"
+    assert not listener.done()
+    listener.cancel()
+
+# Test event formatting
+def test_event_for_subscriber_adds_meanings():
+    event = {"type": "draw", "round": 0, "cards": {"Hearts": "A"}, "source": "session-1"}
+    
+    message = event_for_subscriber("test-game-id", event, "en")
+    
+    assert message == {"type": "draw", "round": 0, "cards": {"Hearts": "A"}, "game_id": "test-game-id",
+                       "meanings": {"Hearts": "Mouse"}}
+    assert event_for_subscriber("test-game-id", {"type": "draw", "round": 2, "cards": []})["cards"] == {}
+
+def test_sse_message():
+    assert sse_message("reset", {"game_id": "g"}) == b'event: reset\ndata: {"game_id":"g"}\n\n'
+    assert game_events_channel("g") == "game_events:g"
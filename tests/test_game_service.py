@@ -1,6 +1,15 @@
+import asyncio
 import pytest
 from unittest.mock import patch, MagicMock
-from services.game_service import DeckCards, start_game, reset_game, pull_card
+from models import Game, User
+from exceptions.exceptions import UserNotFoundException
+from services import token_service
+from services.game_service import (
+    DeckCards, DeckPool, start_game, start_games, start_games_in_chunks, reset_game, pull_card, get_versioned_game, get_game_version
+)
+from services.redis_service import (
+    save_game_to_redis, get_game_from_redis, save_user_to_redis, get_user_from_redis, GUEST_GAME_TTL
+)
 
 # Test the DeckCards class
 def test_deck_cards_init():
@@ -43,6 +52,37 @@ def test_deck_cards_initialize_deck():
     assert set(card_deck['Hearts']) == expected_cards
     assert set(card_deck['Diamonds']) == expected_cards
 
+# Test the DeckPool class
+def test_deck_pool_seeded_is_reproducible():
+    first = DeckCards(pool=DeckPool(size=8, seed=7)).initialize_deck()
+    second = DeckCards(pool=DeckPool(size=64, seed=7)).initialize_deck()
+    
+    # Same seed, same decks, whatever the pool size
+    assert first == second
+    assert first != DeckCards(pool=DeckPool(size=8, seed=8)).initialize_deck()
+
+def test_deck_pool_permutations():
+    pool = DeckPool(size=16, seed=1)
+    permutations = pool.take(40)  # more than the pool holds
+    
+    assert len(permutations) == 40
+    for permutation in permutations:
+        assert sorted(permutation) == list(range(13))
+    # Not every permutation is the same
+    assert len(set(permutations)) > 1
+
+@pytest.mark.asyncio
+async def test_deck_pool_refills_after_request():
+    pool = DeckPool(size=8, seed=1)
+    pool.refill()
+    
+    pool.take(6)
+    assert len(pool.ready) == 2
+    
+    # The top-up runs on the event loop, not inside take()
+    await asyncio.sleep(0)
+    assert len(pool.ready) == 8
+
 # Test the start_game function
 @pytest.mark.asyncio
 @patch('services.game_service.save_game_to_redis')
@@ -111,21 +151,34 @@ async def test_reset_game_nonexistent(mock_start_game, mock_get_game):
     # Verify the result
     assert result == {"message": "Game started", "game_id": "new-game-id", "user_id": "test-user"}
 
+@pytest.mark.asyncio
+async def test_pull_card_returns_owner():
+    await save_test_game()
+    await save_user_to_redis(User(userid="test-user", username="testuser", email="test@example.com", games=["test-game-id"]))
+    
+    result = await pull_card("test-user", "test-game-id")
+    
+    assert result["user"].userid == "test-user"
+    assert list(result["cards"]) == ['Hearts', 'Diamonds']
+
 # Test the pull_card function
+async def save_test_game(currRnd=1, userid="test-user"):
+    game = Game(
+        gameid="test-game-id",
+        userid=userid,
+        currRnd=currRnd,
+        card_deck={
+            'Hearts': ['A', '2', '3'],
+            'Diamonds': ['K', 'Q', 'J']
+        }
+    )
+    await save_game_to_redis(game)
+    return game
+
 @pytest.mark.asyncio
-@patch('services.game_service.get_game_from_redis')
-@patch('services.game_service.save_game_to_redis')
-async def test_pull_card_success(mock_save_game, mock_get_game):
-    # Setup mock for existing game
-    mock_game = MagicMock()
-    mock_game.gameid = "test-game-id"
-    mock_game.userid = "test-user"
-    mock_game.currRnd = 1
-    mock_game.card_deck = {
-        'Hearts': ['A', '2', '3'],
-        'Diamonds': ['K', 'Q', 'J']
-    }
-    mock_get_game.return_value = mock_game
+async def test_pull_card_success():
+    # Setup an existing game
+    await save_test_game(currRnd=1)
     
     # Call the function
     result = await pull_card("test-user", "test-game-id")
@@ -142,37 +195,40 @@ async def test_pull_card_success(mock_save_game, mock_get_game):
     assert result["cards"]["Hearts"] == "2"
     assert result["cards"]["Diamonds"] == "Q"
     
-    # Verify the game was updated
-    assert mock_game.currRnd == 2
+    # Verify the updated game came back with the draw
+    assert result["game"].currRnd == 2
+    assert result["user"] is None  # test-user was never saved
     
-    # Verify the mocks were called
-    mock_get_game.assert_called_once_with("test-game-id")
-    mock_save_game.assert_called_once_with(mock_game)
+    # Verify the game was updated
+    game = await get_game_from_redis("test-game-id")
+    assert game.currRnd == 2
+    assert game.userid == "test-user"
+    assert game.card_deck['Hearts'] == ['A', '2', '3']
 
 @pytest.mark.asyncio
-@patch('services.game_service.get_game_from_redis')
-async def test_pull_card_game_not_found(mock_get_game):
-    # Setup mock for non-existent game
-    mock_get_game.return_value = None
+async def test_pull_card_past_last_round():
+    await save_test_game(currRnd=3)
+    
+    result = await pull_card("test-user", "test-game-id")
     
+    # No cards are left, but the round still advances
+    assert result["round"] == 3
+    assert result["cards"] == {}
+    assert (await get_game_from_redis("test-game-id")).currRnd == 4
+
+@pytest.mark.asyncio
+async def test_pull_card_game_not_found():
     # Call the function
     result = await pull_card("test-user", "nonexistent-id")
     
     # Verify the result
     assert "error" in result
     assert "Game with ID nonexistent-id not found" in result["error"]
-    
-    # Verify the mock was called
-    mock_get_game.assert_called_once_with("nonexistent-id")
 
 @pytest.mark.asyncio
-@patch('services.game_service.get_game_from_redis')
-async def test_pull_card_wrong_user(mock_get_game):
-    # Setup mock for game with different user
-    mock_game = MagicMock()
-    mock_game.gameid = "test-game-id"
-    mock_game.userid = "other-user"
-    mock_get_game.return_value = mock_game
+async def test_pull_card_wrong_user():
+    # Setup a game with a different user
+    await save_test_game(userid="other-user")
     
     # Call the function
     result = await pull_card("test-user", "test-game-id")
@@ -181,5 +237,189 @@ async def test_pull_card_wrong_user(mock_get_game):
     assert "error" in result
     assert "User ID does not match" in result["error"]
     
-    # Verify the mock was called
-    mock_get_game.assert_called_once_with("test-game-id")
+    # Verify the round was not advanced
+    assert (await get_game_from_redis("test-game-id")).currRnd == 1
+
+@pytest.mark.asyncio
+async def test_pull_card_concurrent_draws_are_atomic():
+    # Many concurrent pulls on one game must each get a distinct round, with no lost increments
+    await save_test_game(currRnd=0)
+    draws = 200
+    
+    results = await asyncio.gather(*(pull_card("test-user", "test-game-id") for _ in range(draws)))
+    
+    rounds = sorted(result["round"] for result in results)
+    assert rounds == list(range(draws))
+    assert (await get_game_from_redis("test-game-id")).currRnd == draws
+
+# Test the start_games_in_chunks function
+@pytest.mark.asyncio
+async def test_start_games_in_chunks_saves_each_chunk_before_yielding(fake_redis):
+    await save_user_to_redis(User(userid="user-1", username="user-1", email="user-1@example.com"))
+    
+    chunks = start_games_in_chunks(["user-1", "guest"], 3, chunk_size=4)
+    first = await anext(chunks)
+    
+    # Verify the first chunk is in Redis before the rest is created
+    assert len(first) == 4
+    assert len(await fake_redis.keys("game:*")) == 4
+    assert [len(chunk) async for chunk in chunks] == [2]
+
+@pytest.mark.asyncio
+async def test_start_games_in_chunks_checks_every_owner_first(fake_redis):
+    await save_user_to_redis(User(userid="user-1", username="user-1", email="user-1@example.com"))
+    
+    with pytest.raises(UserNotFoundException):
+        await anext(start_games_in_chunks(["user-1", "missing-user"], 3, chunk_size=2))
+    assert await fake_redis.keys("game:*") == []
+
+# Test the start_games function
+@pytest.mark.asyncio
+async def test_start_games_for_many_users():
+    for userid in ["user-1", "user-2"]:
+        await save_user_to_redis(User(userid=userid, username=userid, email=f"{userid}@example.com"))
+    
+    result = await start_games(["user-1", "user-2", "guest"], 3)
+    
+    # Verify every game was saved and attached to its owner
+    assert len(result) == 9
+    assert len({entry["game_id"] for entry in result}) == 9
+    for entry in result:
+        game = await get_game_from_redis(entry["game_id"])
+        assert game.userid == entry["user_id"]
+        assert sorted(map(len, game.card_deck.values())) == [13] * 4
+    for userid in ["user-1", "user-2"]:
+        user = await get_user_from_redis(userid, load_games=True)
+        assert user.games == [entry["game_id"] for entry in result if entry["user_id"] == userid]
+
+@pytest.mark.asyncio
+async def test_start_games_unknown_user(fake_redis):
+    with pytest.raises(UserNotFoundException):
+        await start_games(["missing-user"], 2)
+    
+    # Nothing was written
+    assert await fake_redis.keys("game:*") == []
+
+# Test the guest fast path
+@pytest.mark.asyncio
+async def test_start_guest_game_skips_user_store(fake_redis):
+    result = await start_game()
+    
+    # Verify only the game (and its version) was written, in the compact layout with the guest TTL
+    key = f"game:{result['game_id']}"
+    assert result["user_id"] == "guest"
+    assert sorted(await fake_redis.keys("*")) == [key, f"version:{key}"]
+    assert await fake_redis.type(key) == "hash"
+    assert 0 < await fake_redis.ttl(key) <= GUEST_GAME_TTL
+    
+    # Verify the game plays like any other
+    pulled = await pull_card("guest", result["game_id"])
+    assert pulled["round"] == 1
+    assert pulled["user"] is None
+    assert len(pulled["cards"]) == 4
+
+# Test stateless (token) games
+@pytest.fixture
+def game_tokens(monkeypatch):
+    monkeypatch.setattr(token_service, "GAME_TOKEN_SECRET", "test-secret")
+
+@pytest.mark.asyncio
+async def test_stateless_guest_game_never_touches_redis(fake_redis, game_tokens):
+    started = await start_game(stateless=True)
+    
+    first = await pull_card("guest", None, token=started["token"])
+    second = await pull_card("guest", None, token=first["token"])
+    
+    # Verify consecutive rounds are dealt from the token alone
+    assert (first["round"], second["round"]) == (1, 2)
+    deck = first["game"].card_deck
+    assert second["cards"] == {suit: cards[2] for suit, cards in deck.items()}
+    assert await fake_redis.keys("*") == []
+
+@pytest.mark.asyncio
+async def test_stateless_user_game_refuses_replayed_token(game_tokens):
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    started = await start_game("test-user-id", stateless=True)
+    
+    pulled = await pull_card("test-user-id", None, token=started["token"])
+    replayed = await pull_card("test-user-id", None, token=started["token"])
+    
+    assert pulled["round"] == 1
+    assert replayed["error"] == "Game token has already been used"
+    assert (await pull_card("test-user-id", None, token=pulled["token"]))["round"] == 2
+    assert (await get_user_from_redis("test-user-id", load_games=True)).games == [started["game_id"]]
+
+@pytest.mark.asyncio
+async def test_stateless_game_rejects_bad_tokens(game_tokens):
+    started = await start_game("test-user-id", stateless=True)
+    
+    assert (await pull_card("other-user", None, token=started["token"]))["error"] == \
+        "User ID does not match the game owner"
+    assert (await pull_card("test-user-id", None, token="not-a-token"))["error"] == "Malformed game token"
+
+@pytest.mark.asyncio
+async def test_stateless_game_refuses_separator_in_user_id(fake_redis, game_tokens):
+    started = await start_game("test|user", stateless=True)
+    
+    # Verify nothing was tracked for a game that could not be handed out
+    assert started["error"] == "Game and user IDs in a game token cannot contain '|'"
+    assert await fake_redis.keys("*") == []
+
+@pytest.mark.asyncio
+async def test_stateless_games_disabled_without_secret(monkeypatch):
+    monkeypatch.setattr(token_service, "GAME_TOKEN_SECRET", "")
+    assert (await start_game(stateless=True))["error"] == "Stateless games are not enabled"
+
+# Test pull_card with localized meanings
+@pytest.mark.asyncio
+async def test_pull_card_with_meanings():
+    game = Game(gameid="test-game-id", userid="guest", currRnd=0,
+                card_deck={"Hearts": ["A", "2"], "Spades": ["K", "Q"]})
+    await save_game_to_redis(game)
+    
+    result = await pull_card("guest", "test-game-id", lang="en")
+    
+    assert result["meanings"]["Hearts"] == "Mouse"
+    assert result["meanings"]["Spades"]
+    assert "meanings" not in await pull_card("guest", "test-game-id")
+
+# Test get_versioned_game
+@pytest.mark.asyncio
+async def test_get_versioned_game_hides_undrawn_cards():
+    await save_test_game(currRnd=1)
+    
+    version, result = await get_versioned_game("test-game-id", "test-user")
+    
+    assert version == await get_game_version("test-game-id", "test-user")
+    assert result["drawn"] == {"Hearts": ["A"], "Diamonds": ["K"]}
+    await pull_card("test-user", "test-game-id")
+    assert await get_game_version("test-game-id", "test-user") > version
+    
+    # Verify only the owner learns the version
+    assert await get_game_version("test-game-id", "attacker") is None
+    assert await get_game_version("test-game-id") is None
+    assert await get_game_version("missing-game", "test-user") is None
+
+@pytest.mark.asyncio
+async def test_get_versioned_game_errors():
+    await save_test_game()
+    
+    assert (await get_versioned_game("missing-game-id"))[1]["error"] == "Game not found"
+    assert (await get_versioned_game("test-game-id", "other-user"))[1]["error"] == "User ID does not match the game owner"
+
+# Test games stored before owners were recorded
+@pytest.mark.asyncio
+async def test_games_without_owner_belong_to_guests(fake_redis):
+    # Shape written by the original Game model: no userid
+    await fake_redis.set("game:legacy-game-id",
+                         '{"gameid": "legacy-game-id", "currRnd": 0, "card_deck": {"Hearts": ["A", "2"]}}')
+    
+    assert (await get_game_from_redis("legacy-game-id")).userid == "guest"
+    
+    # Verify a registered user is refused without spending the round, and a guest can draw
+    assert "error" in await pull_card("test-user", "legacy-game-id")
+    pulled = await pull_card("guest", "legacy-game-id")
+    assert (pulled["round"], pulled["user_id"], pulled["cards"]) == (0, "guest", {"Hearts": "A"})
+    assert 0 < await fake_redis.ttl("game:legacy-game-id") <= GUEST_GAME_TTL
+    
+    assert (await reset_game("legacy-game-id", "guest"))["message"] == "Game reset"
@@ -0,0 +1,40 @@
+import pytest
+from starlette.datastructures import Headers
+from utils.http_cache import accepts_gzip, QualityGZipMiddleware
+
+
+# Test accepts_gzip function
+@pytest.mark.parametrize("accept_encoding, accepted", [
+    ("gzip", True),
+    ("br, gzip;q=0.5", True),
+    ("GZIP; Q=1", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("gzip;q=0.000, *", False),
+    ("*;q=0", False),
+    ("br, *;q=0", False),
+    ("gzip;q=bad", False),
+    ("identity", False),
+    ("", False),
+])
+def test_accepts_gzip(accept_encoding, accepted):
+    assert accepts_gzip(Headers({"accept-encoding": accept_encoding})) is accepted
+
+# Test QualityGZipMiddleware
+@pytest.mark.asyncio
+@pytest.mark.parametrize("accept_encoding, seen", [("gzip;q=0, br", "identity"), ("br, *", "gzip")])
+async def test_quality_gzip_middleware_rewrites_accept_encoding(accept_encoding, seen):
+    received = {}
+    
+    async def app(scope, receive, send):
+        received.update(Headers(scope=scope))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    
+    async def send(message):
+        pass
+    
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    await QualityGZipMiddleware(app)(scope, None, send)
+    
+    assert received["accept-encoding"] == seen
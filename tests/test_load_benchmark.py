@@ -0,0 +1,33 @@
+import httpx
+import pytest
+from benchmarks.load import LoadTest, regressions
+from main import app
+
+
+# Test the load test against the in-process app
+@pytest.mark.asyncio
+async def test_load_test_reports_every_endpoint():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        load = LoadTest(client, users=2, seed=1)
+        await load.setup()
+        results = await load.run(requests=100, concurrency=4)
+    
+    assert set(results) == {"pull-card", "start-game", "users", "reset-game"}
+    assert sum(stats["requests"] for stats in results.values()) == 100
+    for stats in results.values():
+        assert stats["errors"] == 0
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+
+# Test regressions function
+def test_regressions():
+    baseline = {"pull-card": {"rps": 1000, "p95_ms": 10.0}, "users": {"rps": 100, "p95_ms": 50.0}}
+    results = {
+        "pull-card": {"rps": 850, "p95_ms": 11.5},
+        "users": {"rps": 70, "p95_ms": 65.0},
+        "start-game": {"rps": 10, "p95_ms": 500.0},  # Not in the baseline
+    }
+    
+    found = regressions(results, baseline, threshold=0.2)
+    
+    assert len(found) == 2
+    assert all(regression.startswith("users:") for regression in found)
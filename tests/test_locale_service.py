@@ -0,0 +1,37 @@
+import json
+from types import MappingProxyType
+import pytest
+from services.locale_service import LocaleCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    (tmp_path / "en.json").write_text(json.dumps({"help": "Commands", "reference_cards": {"hearts": {"A": "Mouse"}}}))
+    (tmp_path / "fr.json").write_text(json.dumps({"help": "Commandes", "reference_cards": {"hearts": {"A": "Souris"}}}))
+    return LocaleCatalog(str(tmp_path))
+
+# Test LocaleCatalog
+def test_locale_catalog_is_read_only(catalog):
+    assert catalog.languages == ("en", "fr")
+    assert isinstance(catalog.catalogs["en"]["reference_cards"], MappingProxyType)
+    with pytest.raises(TypeError):
+        catalog.catalogs["en"]["reference_cards"]["hearts"]["A"] = "Rat"
+
+def test_locale_catalog_interns_shared_text(catalog):
+    en_keys = list(catalog.catalogs["en"]["reference_cards"])
+    fr_keys = list(catalog.catalogs["fr"]["reference_cards"])
+    assert en_keys[0] is fr_keys[0]
+
+def test_locale_catalog_precomputes_responses(catalog):
+    entry = catalog.entries["fr"]["help"]
+    
+    assert json.loads(entry.body)["data"] == {"lang": "fr", "key": "help", "value": "Commandes"}
+    assert entry.gzip_body is None  # Too short to be worth compressing
+    assert catalog.get("en", "missing", "fallback") == "fallback"
+
+# Test the reference_cards index
+def test_card_meaning(catalog):
+    assert catalog.card_meaning("en", "a", "Hearts") == "Mouse"
+    assert catalog.card_meaning("fr", "A", "hearts") == "Souris"
+    assert catalog.card_meaning("fr", "K", "hearts") is None
+    assert catalog.card_meaning("xx", "A", "hearts") is None
@@ -0,0 +1,110 @@
+import json
+import logging
+import queue
+import pytest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from utils import logger
+from utils.logger import BoundedQueueHandler, DailyFileHandler, JSONLinesFormatter, log_api_call
+
+
+def make_record(msg="hello", args=None, **extra):
+    record = logging.LogRecord("sweaters-api", logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+# Test the queue handler
+def test_queue_handler_does_not_format_on_caller():
+    log_queue = queue.Queue()
+    handler = BoundedQueueHandler(log_queue)
+    arg = MagicMock()
+
+    handler.handle(make_record("API Call: %s", (arg,)))
+
+    # The argument is still unformatted when it reaches the queue
+    arg.__str__.assert_not_called()
+    assert log_queue.get_nowait().args == (arg,)
+
+def test_queue_handler_drops_when_full():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=1))
+    dropped = logger.dropped_records
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+
+    assert logger.dropped_records == dropped + 1
+
+# Test the JSON lines formatter
+def test_json_lines_formatter_api_call():
+    record = make_record(api_call={"endpoint": "/users", "method": "get_user"})
+
+    line = JSONLinesFormatter().format(record)
+
+    data = json.loads(line)
+    assert data["endpoint"] == "/users"
+    assert data["level"] == "INFO"
+    assert "\n" not in line
+
+def test_json_lines_formatter_plain_message():
+    data = json.loads(JSONLinesFormatter().format(make_record("hello %s", ("world",))))
+    assert data["message"] == "hello world"
+
+# Test daily rotation
+def test_daily_file_handler_switches_file(tmp_path):
+    handler = DailyFileHandler(str(tmp_path))
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    handler.emit(make_record("today"))
+    record = make_record("tomorrow")
+    record.created = datetime(2099, 1, 2).timestamp()
+    handler.emit(record)
+    handler.close()
+
+    assert (tmp_path / "api_20990102.log").read_text() == "tomorrow\n"
+    assert (tmp_path / f"api_{datetime.now().strftime('%Y%m%d')}.log").read_text() == "today\n"
+
+# Test log_api_call
+def test_log_api_call_defers_serialization():
+    with patch.object(logging.getLogger("sweaters-api"), "info") as mock_info:
+        log_data = log_api_call(endpoint="/users", method="get_user", request_data="userid: 1")
+
+    args, kwargs = mock_info.call_args
+    assert kwargs["extra"]["api_call"] is log_data
+    assert json.loads(str(args[1])) == json.loads(json.dumps(log_data, default=str))
+
+# Test the sampling policy
+def make_response(status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.message = "ok"
+    return response
+
+def test_log_api_call_sampled_out(monkeypatch):
+    monkeypatch.setattr(logger, "LOG_SAMPLE_RATES", {"get_user": 0.0})
+    sampled = logger.sampled_out.get("get_user", 0)
+
+    with patch.object(logging.getLogger("sweaters-api"), "info") as mock_info:
+        result = log_api_call(endpoint="/users/1", method="get_user", response_data=make_response(), duration_ms=1)
+
+    assert result is None
+    mock_info.assert_not_called()
+    assert logger.sampled_out["get_user"] == sampled + 1
+
+@pytest.mark.parametrize("status_code, message, duration_ms", [
+    (500, None, 1),        # errors are always logged
+    (200, "failed", 1),    # so are calls that carry a message
+    (200, None, 10000),    # and slow calls
+])
+def test_log_api_call_always_logged(monkeypatch, status_code, message, duration_ms):
+    monkeypatch.setattr(logger, "LOG_SAMPLE_RATE", 0.0)
+
+    with patch.object(logging.getLogger("sweaters-api"), "info") as mock_info:
+        result = log_api_call(endpoint="/users/1", method="get_user", response_data=make_response(status_code),
+                              message=message, duration_ms=duration_ms)
+
+    assert result["duration_ms"] == duration_ms
+    mock_info.assert_called_once()
+
+def test_parse_sample_rates():
+    assert logger._parse_sample_rates("get_user=0.05, start-game=1") == {"get_user": 0.05, "start-game": 1.0}
+    assert logger._parse_sample_rates("") == {}
@@ -1,7 +1,9 @@
+import asyncio
+import json
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
-from models import User
+from unittest.mock import patch, MagicMock, AsyncMock
+from models import Game, User
 from main import app
 
 client = TestClient(app)
@@ -64,6 +66,32 @@ def test_get_user_endpoint_not_found(mock_get_user):
     # Verify the mock was called
     mock_get_user.assert_called_once_with("nonexistent-id")
 
+# Test list_user_games_endpoint
+@patch('main.get_user_games')
+def test_list_user_games_endpoint(mock_get_user_games):
+    # Setup mock
+    mock_get_user_games.return_value = {
+        "games": [{"game_id": "test-game-id", "created": 1.5}],
+        "next_before": 1.5
+    }
+    
+    # Make the request
+    response = client.get("/users/test-id/games?before=2.5&limit=1&summary=true")
+    
+    # Verify the response
+    assert response.status_code == 200
+    json_response = response.json()
+    assert json_response["message"] == "Games retrieved successfully"
+    assert json_response["data"]["games"][0]["game_id"] == "test-game-id"
+    assert json_response["data"]["next_before"] == 1.5
+    
+    # Verify the mock was called
+    assert mock_get_user_games.call_args[0] == ("test-id", 2.5, 1, True)
+
+def test_list_user_games_endpoint_unknown_user():
+    response = client.get("/users/missing-user/games")
+    assert response.status_code == 404
+
 # Test add_game_to_user_endpoint
 @patch('main.add_game_to_user')
 def test_add_game_to_user_endpoint_success(mock_add_game):
@@ -117,7 +145,43 @@ def test_start_game_endpoint(mock_start_game):
     assert json_response["data"]["user_id"] == "test-user-id"
     
     # Verify the mock was called
-    mock_start_game.assert_called_once_with("test-user-id")
+    mock_start_game.assert_called_once_with("test-user-id", False)
+
+# Test bulk_start_games_endpoint
+@patch('main.start_games_in_chunks')
+def test_bulk_start_games_endpoint(mock_start_games_in_chunks):
+    # Setup mock: two chunks of saved games
+    async def chunks(*args, **kwargs):
+        yield [{"game_id": f"game-{i}", "user_id": "test-user-id"} for i in range(2)]
+        yield [{"game_id": "game-2", "user_id": "test-user-id"}]
+    mock_start_games_in_chunks.side_effect = chunks
+    
+    # Make the request
+    response = client.post("/games/bulk", json={"userids": ["test-user-id"], "count": 3})
+    
+    # Verify the response is one JSON object per line
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["game_id"] for line in lines] == ["game-0", "game-1", "game-2"]
+    
+    # Verify the mock was called
+    mock_start_games_in_chunks.assert_called_once()
+    assert mock_start_games_in_chunks.call_args[0] == (["test-user-id"], 3)
+
+def test_bulk_start_games_endpoint_unknown_user():
+    response = client.post("/games/bulk", json={"userids": ["missing-user"], "count": 2})
+    assert response.status_code == 404
+    assert "missing-user" in response.json()["detail"]
+
+def test_bulk_start_games_endpoint_rejects_bad_count():
+    response = client.post("/games/bulk", json={"count": 0})
+    assert response.status_code == 422
+
+def test_bulk_start_games_endpoint_caps_total_games():
+    response = client.post("/games/bulk", json={"userids": ["guest"] * 1000, "count": 1000})
+    assert response.status_code == 422
+    assert "At most 10000 games" in response.text
 
 # Test reset_game_endpoint
 @patch('main.reset_game')
@@ -140,15 +204,15 @@ def test_reset_game_endpoint(mock_reset_game):
     mock_reset_game.assert_called_once_with("test-game-id", "test-user-id")
 
 # Test list_users_endpoint
-@patch('main.get_all_users_from_redis')
-def test_list_users_endpoint(mock_get_all_users):
+@patch('main.get_users_page_from_redis')
+def test_list_users_endpoint(mock_get_users_page):
     # Setup mock
     mock_user1 = MagicMock()
     mock_user2 = MagicMock()
-    mock_get_all_users.return_value = [mock_user1, mock_user2]
+    mock_get_users_page.return_value = ([mock_user1, mock_user2], 42)
     
     # Make the request
-    response = client.get("/users")
+    response = client.get("/users?cursor=7&limit=2")
     
     # Verify the response
     assert response.status_code == 200
@@ -156,9 +220,31 @@ def test_list_users_endpoint(mock_get_all_users):
     assert json_response["status_code"] == 200
     assert json_response["message"] == "Users retrieved successfully"
     assert "users" in json_response["data"]
+    assert json_response["data"]["next_cursor"] == 42
     
     # Verify the mock was called
-    mock_get_all_users.assert_called_once()
+    mock_get_users_page.assert_called_once_with(7, 2)
+
+def test_list_users_endpoint_stream():
+    # Seed a few users in the fake Redis and stream them back as NDJSON
+    import asyncio
+    from services.redis_service import save_user_to_redis, add_game_to_user_in_redis
+    for i in range(3):
+        asyncio.run(save_user_to_redis(User(userid=str(i), username=f"user{i}", email=f"user{i}@example.com")))
+    
+    response = client.get("/users?stream=true")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert sorted(User.model_validate_json(line).userid for line in lines) == ["0", "1", "2"]
+    
+    # Verify each line has the paged listing's schema
+    asyncio.run(add_game_to_user_in_redis("0", "test-game-id"))
+    page = client.get("/users").json()["data"]["users"]
+    streamed = [json.loads(line) for line in client.get("/users?stream=true").text.splitlines()]
+    assert sorted(streamed, key=lambda user: user["userid"]) == sorted(page, key=lambda user: user["userid"])
+    assert {user["userid"]: user["games_count"] for user in streamed}["0"] == 1
 
 # Test list_games_endpoint
 @patch('main.get_all_games_from_redis')
@@ -183,21 +269,29 @@ def test_list_games_endpoint(mock_get_all_games):
 
 # Test pull_card_endpoint success
 @patch('main.pull_card')
-@patch('main.get_game_from_redis')
-@patch('main.get_user')
-def test_pull_card_endpoint_success(mock_get_user, mock_get_game, mock_pull_card):
+def test_pull_card_endpoint_success(mock_pull_card):
     # Setup mocks
+    mock_game = Game(
+        gameid="test-game-id",
+        userid="test-user-id",
+        currRnd=2,
+        card_deck={"Hearts": ["2", "A"], "Diamonds": ["Q", "K"]}
+    )
+    mock_user = User(
+        userid="test-user-id",
+        username="testuser",
+        email="test@example.com",
+        games=["test-game-id"]
+    )
     mock_pull_card.return_value = {
         "message": "Card pulled successfully",
         "game_id": "test-game-id",
         "user_id": "test-user-id",
         "round": 1,
-        "cards": {"Hearts": "A", "Diamonds": "K"}
+        "cards": {"Hearts": "A", "Diamonds": "K"},
+        "game": mock_game,
+        "user": mock_user
     }
-    mock_game = MagicMock()
-    mock_get_game.return_value = mock_game
-    mock_user = MagicMock()
-    mock_get_user.return_value = mock_user
     
     # Make the request
     response = client.get("/pull-card?userid=test-user-id&gameid=test-game-id")
@@ -207,15 +301,14 @@ def test_pull_card_endpoint_success(mock_get_user, mock_get_game, mock_pull_card
     json_response = response.json()
     assert json_response["status_code"] == 200
     assert json_response["message"] == "Card pulled successfully"
-    assert json_response["game"] is not None
-    assert json_response["user"] is not None
     assert json_response["data"]["cards"]["Hearts"] == "A"
     assert json_response["data"]["cards"]["Diamonds"] == "K"
+    # Verify neither the deck nor the owner is sent back
+    assert "game" not in json_response and "user" not in json_response
+    assert "game" not in json_response["data"] and "token" not in json_response["data"]
     
-    # Verify the mocks were called
-    mock_pull_card.assert_called_once_with("test-user-id", "test-game-id")
-    mock_get_game.assert_called_once_with("test-game-id")
-    mock_get_user.assert_called_once_with("test-user-id")
+    # Verify the draw was the only service call
+    mock_pull_card.assert_called_once()
 
 # Test pull_card_endpoint error
 @patch('main.pull_card')
@@ -238,3 +331,289 @@ def test_pull_card_endpoint_error(mock_pull_card):
     
     # Verify the mock was called
     mock_pull_card.assert_called_once_with("test-user-id", "nonexistent-id")
+
+# Test metrics_endpoint
+def test_metrics_endpoint():
+    client.get("/users/missing-user/games")
+    
+    response = client.get("/metrics")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    # Requests are grouped by route template, not by path
+    assert 'http_request_duration_seconds_count{route="/users/{userid}/games"}' in response.text
+    assert 'http_request_errors_total{route="/users/{userid}/games"}' in response.text
+    assert 'redis_operation_duration_seconds_count{operation="get_user_games_page"}' in response.text
+    for name in ["cache_hit_ratio", "log_queue_depth", "deck_pool_ready"]:
+        assert f"# TYPE {name} gauge" in response.text
+
+# Test get_locale_endpoint
+def test_get_locale_endpoint():
+    response = client.get("/locales/en")
+    
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    catalog = response.json()["data"]["catalog"]
+    assert catalog["reference_cards"]["hearts"]["A"] == "Mouse"
+    
+    # Verify a current ETag gets a 304 with no body
+    cached = client.get("/locales/en", headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+def test_get_locale_endpoint_gzip():
+    response = client.get("/locales/fr", headers={"Accept-Encoding": "gzip"})
+    
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["data"]["lang"] == "fr"
+    assert "content-encoding" not in client.get("/locales/fr", headers={"Accept-Encoding": "gzip;q=0"}).headers
+
+# Test get_locale_text_endpoint
+def test_get_locale_text_endpoint():
+    response = client.get("/locales/es/help")
+    
+    assert response.status_code == 200
+    assert response.json()["data"]["key"] == "help"
+    assert response.headers["etag"] != client.get("/locales/en/help").headers["etag"]
+
+def test_get_locale_text_endpoint_not_found():
+    assert client.get("/locales/xx/help").status_code == 404
+    assert client.get("/locales/en/missing").status_code == 404
+
+# Test get_card_endpoint
+def test_get_card_endpoint():
+    response = client.get("/cards/hearts/a?lang=fr")
+    
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert (data["lang"], data["suit"], data["value"]) == ("fr", "hearts", "A")
+    assert data["meaning"]
+    assert client.get("/cards/Hearts/A").json()["data"]["meaning"] == "Mouse"
+
+def test_get_card_endpoint_not_found():
+    assert client.get("/cards/hearts/Z").status_code == 404
+    assert client.get("/cards/hearts/A?lang=xx").status_code == 404
+
+# Test conditional GETs of users and games
+@patch('main.get_versioned_user')
+@patch('main.get_user_version')
+def test_get_user_endpoint_etag(mock_get_version, mock_get_versioned_user):
+    user = User(userid="test-id", username="testuser", email="test@example.com", games_count=0)
+    mock_get_versioned_user.return_value = (3, user)
+    mock_get_version.return_value = 3
+    
+    response = client.get("/users/test-id")
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"v3"'
+    
+    # Verify a current copy gets a 304 from the version alone
+    response = client.get("/users/test-id", headers={"If-None-Match": '"v3"'})
+    assert response.status_code == 304
+    assert response.content == b""
+    mock_get_versioned_user.assert_called_once_with("test-id", False)
+    
+    # Verify each representation has its own tag and a stale one is refetched
+    assert client.get("/users/test-id?include_games=true", headers={"If-None-Match": '"v3"'}).status_code == 200
+    mock_get_version.return_value = 4
+    assert client.get("/users/test-id", headers={"If-None-Match": '"v3"'}).status_code == 200
+
+@patch('main.get_versioned_game')
+@patch('main.get_game_version')
+def test_get_game_endpoint_etag(mock_get_version, mock_get_versioned_game):
+    mock_get_versioned_game.return_value = (2, {"message": "Game retrieved successfully", "game_id": "test-game-id",
+                                                "user_id": "test-user", "currRnd": 1, "drawn": {"Hearts": ["A"]}})
+    mock_get_version.return_value = 2
+    
+    response = client.get("/games/test-game-id?userid=test-user")
+    assert response.status_code == 200
+    assert response.json()["data"]["drawn"] == {"Hearts": ["A"]}
+    etag = response.headers["etag"]
+    
+    assert client.get("/games/test-game-id?userid=test-user", headers={"If-None-Match": etag}).status_code == 304
+    mock_get_version.assert_called_with("test-game-id", "test-user")
+    assert client.get("/games/test-game-id", headers={"If-None-Match": etag}).status_code == 200
+
+# Test that a caller other than the owner cannot probe a game's version
+@pytest.mark.asyncio
+async def test_get_game_endpoint_etag_requires_owner(fake_redis):
+    await fake_redis.set("game:test-game-id", '{"gameid": "test-game-id", "userid": "test-user", "currRnd": 0, '
+                                              '"card_deck": {"Hearts": ["A"]}}')
+    await fake_redis.set("version:game:test-game-id", 1)
+    
+    response = client.get("/games/test-game-id?userid=attacker", headers={"If-None-Match": '"v1-attacker"'})
+    
+    assert response.status_code == 200
+    assert response.json()["message"] == "User ID does not match the game owner"
+
+@patch('main.get_versioned_game')
+def test_get_game_endpoint_not_found(mock_get_versioned_game):
+    mock_get_versioned_game.return_value = (None, {"error": "Game not found", "game_id": "missing"})
+    
+    response = client.get("/games/missing")
+    assert response.json()["status_code"] == 400
+    assert "etag" not in response.headers
+
+# Test the game session WebSocket
+@patch('services.session_service.release_game_session_in_redis', new_callable=AsyncMock)
+@patch('services.session_service.claim_game_session_in_redis', new_callable=AsyncMock)
+@patch('services.session_service.pull_card', new_callable=AsyncMock)
+@patch('services.session_service.get_game_view', new_callable=AsyncMock)
+def test_game_session_endpoint(mock_get_game_view, mock_pull_card, mock_claim, mock_release):
+    mock_get_game_view.return_value = {"game_id": "test-game-id", "user_id": "test-user", "currRnd": 0, "drawn": {}}
+    mock_claim.return_value = True
+    mock_pull_card.return_value = {"message": "Card pulled successfully", "round": 0, "cards": {"Hearts": "A"}}
+    
+    with client.websocket_connect("/games/test-game-id/ws?userid=test-user") as websocket:
+        assert websocket.receive_json()["player"] is True
+        websocket.send_text('{"action": "draw"}')
+        assert websocket.receive_json() == {"type": "draw", "game_id": "test-game-id", "round": 0,
+                                            "cards": {"Hearts": "A"}}
+    
+    # Verify the draw skipped the user lookup and the session was released
+    assert mock_pull_card.call_args.kwargs["load_user"] is False
+    mock_release.assert_called_once()
+
+@patch('services.session_service.get_game_view', new_callable=AsyncMock)
+def test_game_session_endpoint_game_not_found(mock_get_game_view):
+    mock_get_game_view.return_value = None
+    
+    with client.websocket_connect("/games/missing/ws") as websocket:
+        assert websocket.receive_json()["message"] == "Game not found"
+        assert websocket.receive()["code"] == 4404
+
+@patch('main.get_game_view', new_callable=AsyncMock)
+def test_game_events_endpoint_not_found(mock_get_game_view):
+    mock_get_game_view.return_value = None
+    
+    assert client.get("/games/missing/events").status_code == 404
+
+# Test forwarding events to a session
+@pytest.mark.asyncio
+async def test_forward_game_events_skips_own_events():
+    from main import _forward_game_events
+    from services.session_service import GameSession
+    send = AsyncMock()
+    session = GameSession("test-game-id", lang="en")
+    queue = asyncio.Queue()
+    queue.put_nowait({"type": "draw", "round": 0, "cards": {"Hearts": "A"}, "source": session.id})
+    queue.put_nowait({"type": "reset", "source": "another-session"})
+    
+    forward = asyncio.create_task(_forward_game_events(session, queue, send))
+    await asyncio.sleep(0.05)
+    forward.cancel()
+    
+    send.assert_called_once_with({"type": "reset", "game_id": "test-game-id"})
+
+@pytest.mark.asyncio
+@patch('main.GAME_EVENTS_KEEPALIVE', 0.01)
+@patch('services.session_service.claim_game_session_in_redis', new_callable=AsyncMock)
+async def test_forward_game_events_tells_a_demoted_player(mock_claim):
+    from main import _forward_game_events
+    from services.session_service import GameSession
+    send = AsyncMock()
+    session = GameSession("test-game-id", "test-user")
+    session.player = True
+    # One failed refresh keeps the claim; losing it to another session demotes the player once
+    mock_claim.side_effect = [ConnectionError("Redis is down"), False]
+    
+    forward = asyncio.create_task(_forward_game_events(session, asyncio.Queue(), send))
+    await asyncio.sleep(0.1)
+    forward.cancel()
+    
+    assert session.player is False
+    assert mock_claim.call_count == 2
+    send.assert_called_once()
+    assert send.call_args.args[0]["type"] == "session"
+
+@patch('main._forward_game_events', new_callable=AsyncMock)
+@patch('services.session_service.release_game_session_in_redis', new_callable=AsyncMock)
+@patch('services.session_service.claim_game_session_in_redis', new_callable=AsyncMock)
+@patch('services.session_service.get_game_view', new_callable=AsyncMock)
+def test_game_session_endpoint_closes_on_a_failed_forwarder(mock_get_game_view, mock_claim, mock_release,
+                                                            mock_forward):
+    mock_get_game_view.return_value = {"game_id": "test-game-id", "user_id": "test-user", "currRnd": 0, "drawn": {}}
+    mock_claim.return_value = True
+    mock_forward.side_effect = ConnectionError("Redis is down")
+    
+    with patch('main.logger.logger.error') as mock_error:
+        with client.websocket_connect("/games/test-game-id/ws?userid=test-user") as websocket:
+            assert websocket.receive_json()["player"] is True
+            assert websocket.receive()["code"] == 1011
+    
+    # Verify the failure was logged and the session still released
+    assert "Redis is down" in mock_error.call_args.args[0]
+    mock_release.assert_called_once()
+
+# Test slim responses and field selection
+@patch('main.pull_card')
+def test_pull_card_endpoint_fields(mock_pull_card):
+    mock_pull_card.return_value = {"message": "Card pulled successfully", "game_id": "test-game-id",
+                                   "user_id": "test-user-id", "round": 1, "cards": {"Hearts": "A"}, "game": None,
+                                   "user": None}
+    
+    response = client.get("/pull-card?userid=test-user-id&gameid=test-game-id&fields=round,cards")
+    
+    assert response.json() == {"status_code": 200, "message": "Card pulled successfully",
+                               "data": {"round": 1, "cards": {"Hearts": "A"}}}
+    assert mock_pull_card.call_args.kwargs["load_user"] is False
+
+def test_pull_card_endpoint_unknown_fields():
+    response = client.get("/pull-card?userid=test-user-id&gameid=test-game-id&fields=round,card_deck")
+    
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: card_deck"
+
+@patch('main.get_versioned_user')
+def test_get_user_endpoint_fields(mock_get_versioned_user):
+    user = User(userid="test-id", username="testuser", email="test@example.com", games_count=2)
+    mock_get_versioned_user.return_value = (3, user)
+    
+    response = client.get("/users/test-id")
+    assert response.json()["user"] == {"userid": "test-id", "username": "testuser", "email": "test@example.com",
+                                       "games_count": 2}
+    
+    response = client.get("/users/test-id?fields=username,games_count")
+    assert response.json()["user"] == {"username": "testuser", "games_count": 2}
+    assert response.headers["etag"] == '"v3-games_count-username"'
+
+# Test response compression
+@patch('main.get_users_page_from_redis')
+def test_large_responses_are_gzipped(mock_get_users_page):
+    users = [User(userid=f"user-{i}", username=f"user{i}", email=f"user{i}@example.com") for i in range(50)]
+    mock_get_users_page.return_value = (users, None)
+    
+    response = client.get("/users", headers={"Accept-Encoding": "gzip"})
+    
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()["data"]["users"]) == 50
+    assert "content-encoding" not in client.get("/cards/hearts/a", headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in client.get("/users", headers={"Accept-Encoding": "gzip;q=0, br"}).headers
+    assert client.get("/users", headers={"Accept-Encoding": "br, *"}).headers["content-encoding"] == "gzip"
+
+# Test that shutdown waits for the background tasks before closing the Redis pool
+@pytest.mark.asyncio
+async def test_lifespan_awaits_background_tasks_before_closing_pool():
+    from main import lifespan
+    unwound = []
+    
+    async def background(*args):
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            # Cleanup that still uses the pool, as pubsub.aclose() does
+            await asyncio.sleep(0)
+            unwound.append(True)
+    
+    async def close_pool():
+        assert len(unwound) == 4
+    
+    with patch('main.init_redis_pool'), patch('main.deck_pool'), patch('main.get_redis_client'), \
+            patch('main.close_redis_pool', side_effect=close_pool) as mock_close, \
+            patch('main.MIGRATE_ON_STARTUP', True), patch('main.CACHE_PUBSUB', True), \
+            patch('main.RETENTION_SWEEP_INTERVAL', 1), patch('main.GAME_EVENTS', True), \
+            patch('main._migrate_storage', background), patch('main.listen_for_invalidations', background), \
+            patch('main.run_sweeper', background), patch('main.game_events.listen', background):
+        async with lifespan(app):
+            await asyncio.sleep(0)
+    
+    mock_close.assert_called_once()
@@ -0,0 +1,45 @@
+import pytest
+from utils import metrics
+from utils.metrics import Histogram, timed
+
+
+@pytest.fixture
+def histogram():
+    histogram = Histogram("test_duration_seconds", "Test latency", label="operation", buckets=(0.1, 1.0))
+    yield histogram
+    del metrics.histograms["test_duration_seconds"]
+
+# Test Histogram rendering
+def test_histogram_render(histogram):
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value, "draw")
+    
+    lines = histogram.render()
+    
+    assert 'test_duration_seconds_bucket{operation="draw",le="0.1"} 2' in lines
+    assert 'test_duration_seconds_bucket{operation="draw",le="1.0"} 3' in lines
+    assert 'test_duration_seconds_bucket{operation="draw",le="+Inf"} 4' in lines
+    assert 'test_duration_seconds_count{operation="draw"} 4' in lines
+    assert 'test_duration_seconds_sum{operation="draw"} 2.65' in lines
+
+# Test timed decorator
+@pytest.mark.asyncio
+async def test_timed_records_failures_too(histogram):
+    @timed(histogram, "fails")
+    async def fails():
+        raise ValueError("boom")
+    
+    with pytest.raises(ValueError):
+        await fails()
+    
+    assert sum(histogram.series["fails"][0]) == 1
+
+# Test render with collectors
+def test_render_includes_collectors(monkeypatch):
+    monkeypatch.setitem(metrics.collectors, "test_queue_depth", ("Queue depth", "gauge", lambda: 3, None))
+    monkeypatch.setitem(metrics.collectors, "test_calls_total", ("Calls", "counter", lambda: {"a": 1}, "method"))
+    
+    text = metrics.render()
+    
+    assert "# TYPE test_queue_depth gauge\ntest_queue_depth 3\n" in text
+    assert 'test_calls_total{method="a"} 1' in text
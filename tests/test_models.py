@@ -18,7 +18,7 @@ def test_game_model():
     assert game.card_deck["Hearts"] == ["A", "2", "3"]
     
     # Test JSON serialization
-    game_json = game.json()
+    game_json = game.model_dump_json()
     assert "gameid" in game_json
     assert "userid" in game_json
     assert "currRnd" in game_json
@@ -42,7 +42,7 @@ def test_user_model():
     assert user.games == ["game1", "game2"]
     
     # Test JSON serialization
-    user_json = user.json()
+    user_json = user.model_dump_json()
     assert "userid" in user_json
     assert "username" in user_json
     assert "email" in user_json
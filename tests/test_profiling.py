@@ -0,0 +1,32 @@
+import pstats
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from utils import profiling
+from utils.profiling import ProfilingMiddleware
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return TestClient(ProfilingMiddleware(app))
+
+# Test ProfilingMiddleware
+def test_profiled_request_gets_timings_and_trace(client, tmp_path):
+    response = client.get("/users/missing-user/games", headers={"X-Profile": "1"})
+    
+    # Verify the Server-Timing breakdown
+    stages = dict(part.split(";dur=") for part in response.headers["server-timing"].split(", "))
+    assert {"redis", "app", "total"} <= set(stages)
+    assert float(stages["redis"]) <= float(stages["total"])
+    
+    # Verify the trace was written under the route's name
+    trace = tmp_path / response.headers["x-profile-trace"]
+    assert trace.name.endswith("_users-userid-games.prof")
+    assert pstats.Stats(str(trace)).total_calls > 0
+
+def test_unprofiled_request_is_untouched(client, tmp_path):
+    response = client.get("/users/missing-user/games")
+    
+    assert "server-timing" not in response.headers
+    assert list(tmp_path.iterdir()) == []
@@ -1,165 +1,552 @@
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import AsyncMock, patch
+from fastapi import HTTPException
+from models import Game, User
+from services import redis_service
+from services.cache_service import user_cache, invalidation_message, CACHE_INVALIDATION_CHANNEL
 from services.redis_service import (
     save_user_to_redis, get_user_from_redis, delete_user_from_redis,
     save_game_to_redis, get_game_from_redis, delete_game_from_redis,
-    get_all_users_from_redis, get_all_games_from_redis
+    get_all_users_from_redis, get_all_games_from_redis, get_users_page_from_redis,
+    pull_card_from_redis, migrate_games_to_hash, add_game_to_user_in_redis, migrate_user_games_to_sets,
+    get_version_from_redis, get_versioned_user_from_redis, get_versioned_game_from_redis, get_game_version_from_redis, remove_games_from_redis,
+    run_migration_once, MIGRATION_LOCK_KEY
 )
 
+
+def make_user(userid="test-user-id"):
+    return User(
+        userid=userid,
+        username="testuser",
+        email="test@example.com",
+        full_name="Test User",
+        games=[]
+    )
+
+def make_game(gameid="test-game-id"):
+    return Game(
+        gameid=gameid,
+        userid="test-user-id",
+        currRnd=1,
+        card_deck={"Hearts": ["A", "2", "3"]}
+    )
+
 # Test save_user_to_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-async def test_save_user_to_redis(mock_redis):
-    # Setup mock
-    mock_user = MagicMock()
-    mock_user.userid = "test-user-id"
-    mock_user.json.return_value = '{"userid": "test-user-id"}'
-    
+async def test_save_user_to_redis(fake_redis):
+    user = make_user()
+
     # Call the function
-    result = await save_user_to_redis(mock_user)
-    
+    result = await save_user_to_redis(user)
+
     # Verify the result
-    assert result == mock_user
-    
-    # Verify the redis client was called
-    mock_redis.set.assert_called_once_with("user:test-user-id", '{"userid": "test-user-id"}')
+    assert result == user
+
+    # Verify the user was written under its key
+    assert User.model_validate_json(await fake_redis.get("user:test-user-id")) == user
 
 # Test get_user_from_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-@patch('services.redis_service.User')
-async def test_get_user_from_redis(mock_user_class, mock_redis):
-    # Setup mocks
-    mock_redis.get.return_value = '{"userid": "test-user-id"}'
-    mock_user = MagicMock()
-    mock_user_class.parse_raw.return_value = mock_user
-    
+async def test_get_user_from_redis(fake_redis):
+    user = make_user()
+    await fake_redis.set("user:test-user-id", user.model_dump_json())
+
     # Call the function
     result = await get_user_from_redis("test-user-id")
-    
+
     # Verify the result
-    assert result == mock_user
-    
-    # Verify the redis client was called
-    mock_redis.get.assert_called_once_with("user:test-user-id")
-    mock_user_class.parse_raw.assert_called_once_with('{"userid": "test-user-id"}')
+    assert result == user.model_copy(update={"games_count": 0})
+
+@pytest.mark.asyncio
+async def test_get_user_from_redis_missing():
+    assert await get_user_from_redis("nonexistent-id") is None
 
 # Test delete_user_from_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-async def test_delete_user_from_redis(mock_redis):
-    # Setup mock
-    mock_redis.delete.return_value = 1
-    
+async def test_delete_user_from_redis(fake_redis):
+    await save_user_to_redis(make_user())
+
     # Call the function
     result = await delete_user_from_redis("test-user-id")
-    
+
     # Verify the result
     assert result == 1
-    
-    # Verify the redis client was called
-    mock_redis.delete.assert_called_once_with("user:test-user-id")
+    assert not await fake_redis.exists("user:test-user-id")
+
+@pytest.mark.asyncio
+async def test_delete_user_from_redis_missing():
+    with pytest.raises(HTTPException) as exc:
+        await delete_user_from_redis("nonexistent-id")
+    assert exc.value.status_code == 404
+    assert "nonexistent-id" in exc.value.detail
 
 # Test save_game_to_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-async def test_save_game_to_redis(mock_redis):
-    # Setup mock
-    mock_game = MagicMock()
-    mock_game.gameid = "test-game-id"
-    mock_game.json.return_value = '{"gameid": "test-game-id"}'
-    
+async def test_save_game_to_redis(fake_redis):
+    game = make_game()
+
     # Call the function
-    result = await save_game_to_redis(mock_game)
-    
+    result = await save_game_to_redis(game)
+
     # Verify the result
-    assert result == mock_game
-    
-    # Verify the redis client was called
-    mock_redis.set.assert_called_once_with("game:test-game-id", '{"gameid": "test-game-id"}')
+    assert result == game
+
+    # Verify the game was written under its key
+    assert Game.model_validate_json(await fake_redis.get("game:test-game-id")) == game
 
 # Test get_game_from_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-@patch('services.redis_service.Game')
-async def test_get_game_from_redis(mock_game_class, mock_redis):
-    # Setup mocks
-    mock_redis.get.return_value = '{"gameid": "test-game-id"}'
-    mock_game = MagicMock()
-    mock_game_class.parse_raw.return_value = mock_game
-    
+async def test_get_game_from_redis(fake_redis):
+    game = make_game()
+    await fake_redis.set("game:test-game-id", game.model_dump_json())
+
     # Call the function
     result = await get_game_from_redis("test-game-id")
-    
+
     # Verify the result
-    assert result == mock_game
-    
-    # Verify the redis client was called
-    mock_redis.get.assert_called_once_with("game:test-game-id")
-    mock_game_class.parse_raw.assert_called_once_with('{"gameid": "test-game-id"}')
+    assert result == game
 
 # Test delete_game_from_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-async def test_delete_game_from_redis(mock_redis):
-    # Setup mock
-    mock_redis.delete.return_value = 1
-    
+async def test_delete_game_from_redis(fake_redis):
+    await save_game_to_redis(make_game())
+
     # Call the function
     result = await delete_game_from_redis("test-game-id")
-    
+
     # Verify the result
     assert result == 1
-    
-    # Verify the redis client was called
-    mock_redis.delete.assert_called_once_with("game:test-game-id")
+    assert not await fake_redis.exists("game:test-game-id")
 
 # Test get_all_users_from_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-@patch('services.redis_service.User')
-async def test_get_all_users_from_redis(mock_user_class, mock_redis):
-    # Setup mocks
-    mock_redis.keys.return_value = ["user:1", "user:2"]
-    mock_redis.get.side_effect = ['{"userid": "1"}', '{"userid": "2"}']
-    mock_user1 = MagicMock()
-    mock_user2 = MagicMock()
-    mock_user_class.parse_raw.side_effect = [mock_user1, mock_user2]
-    
+async def test_get_all_users_from_redis():
+    user1 = await save_user_to_redis(make_user("1"))
+    user2 = await save_user_to_redis(make_user("2"))
+    await save_game_to_redis(make_game())
+
     # Call the function
     result = await get_all_users_from_redis()
-    
+
     # Verify the result
     assert len(result) == 2
-    assert mock_user1 in result
-    assert mock_user2 in result
-    
-    # Verify the redis client was called
-    mock_redis.keys.assert_called_once_with("user:*")
-    assert mock_redis.get.call_count == 2
-    assert mock_user_class.parse_raw.call_count == 2
+    assert user1.model_copy(update={"games_count": 0}) in result
+    assert user2.model_copy(update={"games_count": 0}) in result
+
+# Test get_users_page_from_redis function
+@pytest.mark.asyncio
+async def test_get_users_page_from_redis_walks_every_user():
+    for i in range(25):
+        await save_user_to_redis(make_user(str(i)))
+    await save_game_to_redis(make_game())
+
+    # Follow next_cursor until the scan completes
+    seen = []
+    cursor = 0
+    while True:
+        page, cursor = await get_users_page_from_redis(cursor, limit=10)
+        seen.extend(user.userid for user in page)
+        if cursor is None:
+            break
+
+    # Verify every user was returned exactly once
+    assert sorted(seen, key=int) == [str(i) for i in range(25)]
+
+@pytest.mark.asyncio
+async def test_get_users_page_from_redis_empty():
+    assert await get_users_page_from_redis() == ([], None)
 
 # Test get_all_games_from_redis function
 @pytest.mark.asyncio
-@patch('services.redis_service.redis_client')
-@patch('services.redis_service.Game')
-async def test_get_all_games_from_redis(mock_game_class, mock_redis):
-    # Setup mocks
-    mock_redis.keys.return_value = ["game:1", "game:2"]
-    mock_redis.get.side_effect = ['{"gameid": "1"}', '{"gameid": "2"}']
-    mock_game1 = MagicMock()
-    mock_game2 = MagicMock()
-    mock_game_class.parse_raw.side_effect = [mock_game1, mock_game2]
-    
+async def test_get_all_games_from_redis():
+    game1 = await save_game_to_redis(make_game("1"))
+    game2 = await save_game_to_redis(make_game("2"))
+    await save_user_to_redis(make_user())
+
     # Call the function
     result = await get_all_games_from_redis()
-    
+
     # Verify the result
     assert len(result) == 2
-    assert mock_game1 in result
-    assert mock_game2 in result
+    assert game1 in result
+    assert game2 in result
+
+# Tests for the compact "hash" game layout
+def make_full_game(gameid="test-game-id"):
+    from services.game_service import DeckCards
+    return Game(gameid=gameid, userid="test-user-id", currRnd=1, card_deck=DeckCards().initialize_deck())
+
+@pytest.mark.asyncio
+async def test_save_game_to_redis_hash_layout(fake_redis, monkeypatch):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", "hash")
+    game = make_full_game()
+
+    await save_game_to_redis(game)
+
+    # Verify the game is stored as a compact hash with a 52-character deck
+    assert await fake_redis.type("game:test-game-id") == "hash"
+    stored = await fake_redis.hgetall("game:test-game-id")
+    assert stored["currRnd"] == "1"
+    assert stored["suits"] == "Hearts,Diamonds,Clubs,Spades"
+    assert len(stored["deck"]) == 52
+
+    # Verify it reads back unchanged
+    assert await get_game_from_redis("test-game-id") == game
+
+@pytest.mark.asyncio
+async def test_save_game_to_redis_hash_layout_replaces_json(fake_redis, monkeypatch):
+    game = make_full_game()
+    await save_game_to_redis(game)
+    assert await fake_redis.type("game:test-game-id") == "string"
+
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", "hash")
+    game.currRnd = 5
+    await save_game_to_redis(game)
+
+    assert await fake_redis.type("game:test-game-id") == "hash"
+    assert (await get_game_from_redis("test-game-id")).currRnd == 5
+
+@pytest.mark.asyncio
+async def test_save_game_to_redis_hash_layout_falls_back_to_json(fake_redis, monkeypatch):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", "hash")
+    # Uneven suits cannot be packed, so the game is kept as JSON
+    game = Game(gameid="odd", userid="u", currRnd=0, card_deck={"Hearts": ["A"], "Clubs": ["A", "2"]})
+
+    await save_game_to_redis(game)
+
+    assert await fake_redis.type("game:odd") == "string"
+    assert await get_game_from_redis("odd") == game
+
+@pytest.mark.asyncio
+async def test_pull_card_from_redis_hash_layout(fake_redis, monkeypatch):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", "hash")
+    game = make_full_game()
+    await save_game_to_redis(game)
+
+    result = await pull_card_from_redis("test-game-id", "test-user-id")
+
+    # Verify the drawn cards match the deck and the round was bumped in place
+    assert result["round"] == 1
+    assert result["cards"] == {suit: cards[1] for suit, cards in game.card_deck.items()}
+    assert await fake_redis.hget("game:test-game-id", "currRnd") == "2"
+
+@pytest.mark.asyncio
+async def test_get_all_games_from_redis_mixed_layouts(monkeypatch):
+    json_game = await save_game_to_redis(make_full_game("1"))
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", "hash")
+    hash_game = await save_game_to_redis(make_full_game("2"))
+
+    result = await get_all_games_from_redis()
+
+    assert sorted(result, key=lambda game: game.gameid) == [json_game, hash_game]
+
+@pytest.mark.asyncio
+async def test_migrate_games_to_hash(fake_redis):
+    games = [await save_game_to_redis(make_full_game(str(i))) for i in range(5)]
+
+    # Call the function
+    migrated = await migrate_games_to_hash(batch_size=2)
+
+    # Verify every JSON game was converted and still reads back the same
+    assert migrated == 5
+    for game in games:
+        assert await fake_redis.type(f"game:{game.gameid}") == "hash"
+        assert await get_game_from_redis(game.gameid) == game
+
+    # A second pass has nothing left to do
+    assert await migrate_games_to_hash() == 0
+
+@pytest.mark.asyncio
+async def test_migrate_games_to_hash_skips_unreadable_games(fake_redis):
+    # A game in the original shape (no userid) and a value that is not a game at all
+    await fake_redis.set("game:legacy", make_full_game("legacy").model_dump_json(exclude={"userid"}))
+    await fake_redis.set("game:corrupt", "not json")
+    games = [await save_game_to_redis(make_full_game(str(i))) for i in range(3)]
+
+    migrated = await migrate_games_to_hash(batch_size=1)
+
+    # Verify the bad value is left alone and every other game is converted
+    assert migrated == 4
+    assert await fake_redis.get("game:corrupt") == "not json"
+    assert (await get_game_from_redis("legacy")).userid == "guest"
+    for game in games:
+        assert await fake_redis.type(f"game:{game.gameid}") == "hash"
+
+# Tests for the in-process read-through cache
+@pytest.mark.asyncio
+async def test_get_user_from_redis_is_cached(fake_redis):
+    await fake_redis.set("user:test-user-id", make_user().model_dump_json())
+
+    hits = user_cache.hits
+    first = await get_user_from_redis("test-user-id")
+    # A change made behind the cache's back is not seen while the entry is fresh
+    await fake_redis.delete("user:test-user-id")
+    second = await get_user_from_redis("test-user-id")
+
+    assert second is first
+    assert user_cache.hits == hits + 1
+
+@pytest.mark.asyncio
+async def test_save_user_to_redis_refreshes_cache():
+    user = await save_user_to_redis(make_user())
+    await get_user_from_redis("test-user-id")
+
+    updated = make_user()
+    updated.games = ["game1"]
+    await save_user_to_redis(updated)
+
+    assert (await get_user_from_redis("test-user-id", load_games=True)).games == ["game1"]
+
+@pytest.mark.asyncio
+async def test_delete_user_from_redis_invalidates_cache():
+    await save_user_to_redis(make_user())
+    await delete_user_from_redis("test-user-id")
+
+    assert await get_user_from_redis("test-user-id") is None
+
+@pytest.mark.asyncio
+async def test_pull_card_from_redis_refreshes_game_cache():
+    await save_game_to_redis(make_game())
+    await get_game_from_redis("test-game-id")
+
+    await pull_card_from_redis("test-game-id", "test-user-id")
+
+    assert (await get_game_from_redis("test-game-id")).currRnd == 2
+
+@pytest.mark.asyncio
+async def test_save_user_to_redis_publishes_invalidation(fake_redis, monkeypatch):
+    monkeypatch.setattr(redis_service, "CACHE_PUBSUB", True)
+    pubsub = fake_redis.pubsub()
+    await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+    await pubsub.get_message(timeout=1)  # subscribe confirmation
+
+    await save_user_to_redis(make_user())
+
+    message = await pubsub.get_message(timeout=1)
+    assert message["data"] == invalidation_message("user:test-user-id")
+    await pubsub.aclose()
+
+# Tests for user:{id}:games sets
+@pytest.mark.asyncio
+async def test_save_user_to_redis_moves_games_to_set(fake_redis):
+    user = make_user()
+    user.games = ["game1", "game2"]
+
+    await save_user_to_redis(user)
+
+    assert "games" not in await fake_redis.get("user:test-user-id")
+    assert await fake_redis.zrange("user:test-user-id:games", 0, -1) == ["game1", "game2"]
+    assert (await get_user_from_redis("test-user-id", load_games=True)).games == ["game1", "game2"]
+    assert (await get_user_from_redis("test-user-id")).games_count == 2
+
+@pytest.mark.asyncio
+async def test_get_user_from_redis_reads_legacy_games(fake_redis):
+    legacy = make_user()
+    legacy.games = ["old-game"]
+    await fake_redis.set("user:test-user-id", legacy.model_dump_json())
+    await add_game_to_user_in_redis("test-user-id", "new-game")
+
+    assert (await get_user_from_redis("test-user-id", load_games=True)).games == ["old-game", "new-game"]
+    assert (await get_user_from_redis("test-user-id")).games_count == 2
+
+@pytest.mark.asyncio
+async def test_migrate_user_games_to_sets(fake_redis):
+    for i in range(3):
+        legacy = make_user(str(i))
+        legacy.games = [f"{i}-a", f"{i}-b"]
+        await fake_redis.set(f"user:{i}", legacy.model_dump_json())
+    await add_game_to_user_in_redis("0", "0-c")
+
+    # Call the function
+    migrated = await migrate_user_games_to_sets(batch_size=2)
+
+    # Verify the lists moved to the sets, in order, ahead of newer games
+    assert migrated == 3
+    assert await fake_redis.zrange("user:0:games", 0, -1) == ["0-a", "0-b", "0-c"]
+    assert "games" not in await fake_redis.get("user:1")
+    assert (await get_user_from_redis("2", load_games=True)).games == ["2-a", "2-b"]
+    assert await migrate_user_games_to_sets() == 0
+
+@pytest.mark.asyncio
+async def test_get_all_users_from_redis_skips_games_sets():
+    user = make_user()
+    user.games = ["game1"]
+    await save_user_to_redis(user)
+
+    result = await get_all_users_from_redis()
+
+    assert [u.games_count for u in result] == [1]
+
+# Tests for game retention TTLs
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ["json", "hash"])
+async def test_game_ttl_set_on_save_and_refreshed_on_pull(fake_redis, monkeypatch, storage):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", storage)
+    guest_game = make_game("guest-game")
+    guest_game.userid = "guest"
+    await save_game_to_redis(guest_game)
+    await save_game_to_redis(make_game())
+
+    # Verify each owner gets its own TTL
+    assert 0 < await fake_redis.ttl("game:guest-game") <= redis_service.GUEST_GAME_TTL
+    assert redis_service.GUEST_GAME_TTL < await fake_redis.ttl("game:test-game-id") <= redis_service.USER_GAME_TTL
+
+    # Verify a pull restarts the TTL instead of clearing it
+    await fake_redis.expire("game:guest-game", 5)
+    await pull_card_from_redis("guest-game", "guest")
+    assert await fake_redis.ttl("game:guest-game") > 5
+
+@pytest.mark.asyncio
+async def test_game_ttl_disabled(fake_redis, monkeypatch):
+    monkeypatch.setattr(redis_service, "USER_GAME_TTL", 0)
+    await save_game_to_redis(make_game())
+    await pull_card_from_redis("test-game-id", "test-user-id")
+
+    assert await fake_redis.ttl("game:test-game-id") == -1
+
+@pytest.mark.asyncio
+async def test_migrate_games_to_hash_keeps_ttl(fake_redis):
+    await save_game_to_redis(make_full_game())
+
+    await migrate_games_to_hash()
+
+    assert await fake_redis.type("game:test-game-id") == "hash"
+    assert await fake_redis.ttl("game:test-game-id") > 0
+
+# Tests for document versions (ETags)
+@pytest.mark.asyncio
+async def test_user_version_bumped_by_every_change(fake_redis):
+    await save_user_to_redis(make_user())
+    await save_game_to_redis(make_game())
+    version, user = await get_versioned_user_from_redis("test-user-id")
+    assert version == await get_version_from_redis("user:test-user-id")
+    assert user.games_count == 0
+
+    # Verify adding a game bumps the version, and adding it again does not
+    await add_game_to_user_in_redis("test-user-id", "test-game-id")
+    added = await get_version_from_redis("user:test-user-id")
+    assert added > version
+    await add_game_to_user_in_redis("test-user-id", "test-game-id")
+    assert await get_version_from_redis("user:test-user-id") == added
+
+    await remove_games_from_redis([make_game()])
+    assert await get_version_from_redis("user:test-user-id") > added
+
+    await delete_user_from_redis("test-user-id")
+    assert await get_version_from_redis("user:test-user-id") is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ["json", "hash"])
+async def test_remove_games_keeps_games_changed_since_read(fake_redis, monkeypatch, storage):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", storage)
+    await save_user_to_redis(make_user())
+    for gameid in ["finished", "reset"]:
+        await save_game_to_redis(make_game(gameid))
+        await add_game_to_user_in_redis("test-user-id", gameid)
+    read = [make_game("finished"), make_game("reset")]
+    # A reset lands between the sweeper's read and its delete
+    await save_game_to_redis(make_game("reset").model_copy(update={"currRnd": 0}))
+    
+    assert await remove_games_from_redis(read) == 1
+    
+    assert not await fake_redis.exists("game:finished", "version:game:finished")
+    assert (await get_game_from_redis("reset")).currRnd == 0
+    assert await fake_redis.zrange("user:test-user-id:games", 0, -1) == ["reset"]
+
+@pytest.mark.asyncio
+async def test_versioned_user_written_before_versions(fake_redis):
+    await fake_redis.set("user:test-user-id", make_user().model_dump_json())
+
+    # Verify the first read is not tagged but starts the version for the next one
+    version, user = await get_versioned_user_from_redis("test-user-id", load_games=True)
+    assert version is None and user.userid == "test-user-id"
+    assert (await get_versioned_user_from_redis("test-user-id"))[0] == 1
+
+@pytest.mark.asyncio
+async def test_versioned_user_is_cached_until_it_changes(fake_redis):
+    await save_user_to_redis(make_user())
+    version, user = await get_versioned_user_from_redis("test-user-id")
+    
+    # Verify the pair is served from the cache while the user is unchanged
+    with patch('services.redis_service.get_redis_client') as mock_client:
+        assert await get_versioned_user_from_redis("test-user-id") == (version, user)
+        mock_client.assert_not_called()
+    
+    await add_game_to_user_in_redis("test-user-id", "test-game-id")
+    changed, user = await get_versioned_user_from_redis("test-user-id")
+    assert changed > version and user.games_count == 1
+
+@pytest.mark.asyncio
+async def test_versioned_user_missing():
+    assert await get_versioned_user_from_redis("nonexistent-id") == (None, None)
+    assert await get_version_from_redis("user:nonexistent-id") is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ["json", "hash"])
+async def test_game_version_bumped_by_pull_and_expires_with_game(fake_redis, monkeypatch, storage):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", storage)
+    await save_game_to_redis(make_full_game())
+    version, game = await get_versioned_game_from_redis("test-game-id")
+    assert game.currRnd == 1
+    assert 0 < await fake_redis.ttl("version:game:test-game-id") <= redis_service.USER_GAME_TTL
+
+    await pull_card_from_redis("test-game-id", "test-user-id")
+    pulled, game = await get_versioned_game_from_redis("test-game-id")
+    assert pulled > version and game.currRnd == 2
+
+    await delete_game_from_redis("test-game-id")
+    assert await get_versioned_game_from_redis("test-game-id") == (None, None)
+    assert await get_version_from_redis("game:test-game-id") is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ["json", "hash"])
+async def test_get_game_version_from_redis_reads_owner(fake_redis, monkeypatch, storage):
+    monkeypatch.setattr(redis_service, "GAME_STORAGE", storage)
+    await save_game_to_redis(make_full_game())
+    
+    version, owner = await get_game_version_from_redis("test-game-id")
+    
+    assert (version, owner) == (await get_version_from_redis("game:test-game-id"), "test-user-id")
+    assert await get_game_version_from_redis("missing-game") == (None, None)
+
+@pytest.mark.asyncio
+async def test_get_game_version_from_redis_legacy_games(fake_redis):
+    await fake_redis.set("game:legacy", '{"gameid": "legacy", "currRnd": 0, "card_deck": {"Hearts": ["A"]}}')
+    await fake_redis.set("game:corrupt", "not json")
+    
+    assert await get_game_version_from_redis("legacy") == (None, "guest")
+    assert await get_game_version_from_redis("corrupt") == (None, None)
+
+@pytest.mark.asyncio
+async def test_version_keys_not_listed_as_users_or_games(fake_redis):
+    await save_user_to_redis(make_user())
+    await save_game_to_redis(make_game())
+
+    assert [user.userid for user in await get_all_users_from_redis()] == ["test-user-id"]
+    assert [game.gameid for game in await get_all_games_from_redis()] == ["test-game-id"]
+
+# Test run_migration_once function
+@pytest.mark.asyncio
+async def test_run_migration_once(fake_redis):
+    migration = AsyncMock(return_value=3)
+    
+    assert await run_migration_once("test", migration) == 3
+    
+    # Verify later starts skip it and the lock was released
+    assert await run_migration_once("test", migration) is None
+    migration.assert_awaited_once()
+    assert not await fake_redis.exists(MIGRATION_LOCK_KEY)
+
+@pytest.mark.asyncio
+async def test_run_migration_once_skips_while_locked_and_retries_after_failure(fake_redis):
+    migration = AsyncMock(side_effect=[RuntimeError("Redis is down"), 2])
+    await fake_redis.set(MIGRATION_LOCK_KEY, "another-worker")
+    
+    assert await run_migration_once("test", migration) is None
+    migration.assert_not_awaited()
     
-    # Verify the redis client was called
-    mock_redis.keys.assert_called_once_with("game:*")
-    assert mock_redis.get.call_count == 2
-    assert mock_game_class.parse_raw.call_count == 2
+    # Verify a failed run is not marked done
+    await fake_redis.delete(MIGRATION_LOCK_KEY)
+    with pytest.raises(RuntimeError):
+        await run_migration_once("test", migration)
+    assert await run_migration_once("test", migration) == 2
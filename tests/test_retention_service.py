@@ -0,0 +1,65 @@
+import pytest
+from models import Game, User
+from services.redis_service import (
+    save_user_to_redis, save_game_to_redis, add_game_to_user_in_redis, get_user_from_redis, GUEST_GAME_TTL,
+    USER_GAME_TTL
+)
+from services.retention_service import is_finished, sweep_games, load_archived_games
+
+
+def make_game(gameid, userid="test-user-id", currRnd=0):
+    return Game(
+        gameid=gameid,
+        userid=userid,
+        currRnd=currRnd,
+        card_deck={"Hearts": ["A", "2", "3"], "Spades": ["4", "5", "6"]}
+    )
+
+# Test is_finished function
+def test_is_finished():
+    assert not is_finished(make_game("game", currRnd=2))
+    assert is_finished(make_game("game", currRnd=3))
+    assert is_finished(make_game("game", currRnd=4))
+
+# Test sweep_games function
+@pytest.mark.asyncio
+async def test_sweep_games(fake_redis, tmp_path):
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    for game in [make_game("active"), make_game("finished", currRnd=3), make_game("guest-finished", "guest", 5)]:
+        await save_game_to_redis(game)
+    for gameid in ["active", "finished", "expired"]:
+        await add_game_to_user_in_redis("test-user-id", gameid)
+    # A game saved before TTLs existed
+    await fake_redis.set("game:legacy", make_game("legacy", "guest").model_dump_json())
+
+    # Call the function
+    stats = await sweep_games(batch_size=2, directory=str(tmp_path))
+
+    # Verify finished games moved to the archive and left Redis
+    assert stats == {"archived": 2, "expiring": 1, "unreadable": 0, "pruned": 1}
+    [archive] = tmp_path.iterdir()
+    assert archive.name.endswith(".jsonl.gz")
+    assert sorted(game.gameid for game in load_archived_games(str(archive))) == ["finished", "guest-finished"]
+    assert await fake_redis.exists("game:finished", "game:guest-finished") == 0
+
+    # Verify the legacy game now expires and only live games stay in the user's history
+    assert await fake_redis.ttl("game:legacy") > 0
+    assert (await get_user_from_redis("test-user-id", load_games=True)).games == ["active"]
+
+    # Verify a second sweep appends nothing
+    assert await sweep_games(directory=str(tmp_path)) == {"archived": 0, "expiring": 0, "unreadable": 0, "pruned": 0}
+
+@pytest.mark.asyncio
+async def test_sweep_games_with_legacy_and_unreadable_games(fake_redis, tmp_path):
+    # Shapes left by older code: a game without owner or TTL, and a value that is not a game
+    await fake_redis.set("game:legacy", '{"gameid": "legacy", "currRnd": 0, "card_deck": {"Hearts": ["A", "2"]}}')
+    await fake_redis.set("game:legacy-finished",
+                         '{"gameid": "legacy-finished", "currRnd": 2, "card_deck": {"Hearts": ["A", "2"]}}')
+    await fake_redis.set("game:corrupt", "not json")
+
+    stats = await sweep_games(batch_size=1, directory=str(tmp_path))
+
+    assert stats == {"archived": 1, "expiring": 2, "unreadable": 1, "pruned": 0}
+    assert 0 < await fake_redis.ttl("game:legacy") <= GUEST_GAME_TTL
+    assert GUEST_GAME_TTL < await fake_redis.ttl("game:corrupt") <= USER_GAME_TTL
+    assert not await fake_redis.exists("game:legacy-finished")
@@ -0,0 +1,72 @@
+import pytest
+from models import Game
+from services.redis_service import save_game_to_redis
+from services.session_service import GameSession, SESSION_GAME_NOT_FOUND, SESSION_NOT_OWNER, SESSION_TAKEN
+
+
+async def save_test_game(userid="test-user", currRnd=0):
+    game = Game(gameid="test-game-id", userid=userid, currRnd=currRnd,
+                card_deck={"Hearts": ["A", "2"], "Spades": ["K", "Q"]})
+    await save_game_to_redis(game)
+    return game
+
+# Test opening sessions
+@pytest.mark.asyncio
+async def test_open_player_session_holds_the_game(fake_redis):
+    await save_test_game(currRnd=1)
+    player = GameSession("test-game-id", "test-user")
+    
+    state = await player.open()
+    
+    assert (state["type"], state["player"], state["currRnd"]) == ("game", True, 1)
+    assert state["drawn"] == {"Hearts": ["A"], "Spades": ["K"]}
+    assert (await GameSession("test-game-id", "test-user").open())["code"] == SESSION_TAKEN
+    
+    # Verify closing frees the game for the next player session
+    await player.close()
+    assert (await GameSession("test-game-id", "test-user").open())["player"] is True
+
+@pytest.mark.asyncio
+async def test_open_refused_sessions():
+    await save_test_game()
+    
+    assert (await GameSession("missing-game-id").open())["code"] == SESSION_GAME_NOT_FOUND
+    assert (await GameSession("test-game-id", "other-user").open())["code"] == SESSION_NOT_OWNER
+    assert (await GameSession("test-game-id").open())["player"] is False
+
+# Test session commands
+@pytest.mark.asyncio
+async def test_player_draws_and_resets():
+    await save_test_game()
+    session = GameSession("test-game-id", "test-user", lang="en")
+    await session.open()
+    
+    reply = await session.handle('{"action": "draw"}')
+    assert (reply["type"], reply["round"], reply["cards"]) == ("draw", 0, {"Hearts": "A", "Spades": "K"})
+    assert reply["meanings"]["Hearts"] == "Mouse"
+    assert (await session.handle('{"action": "reset"}'))["type"] == "reset"
+    assert (session.draws, session.resets) == (1, 1)
+
+@pytest.mark.asyncio
+async def test_invalid_commands():
+    await save_test_game()
+    spectator = GameSession("test-game-id")
+    await spectator.open()
+    player = GameSession("test-game-id", "test-user")
+    await player.open()
+    
+    assert (await spectator.handle('{"action": "draw"}'))["message"] == "Spectators cannot send commands"
+    assert (await player.handle("draw"))["message"] == "Commands must be JSON objects"
+    assert (await player.handle('{"action": "shuffle"}'))["message"] == "Unknown action: shuffle"
+
+@pytest.mark.asyncio
+async def test_refresh_demotes_a_lapsed_session(fake_redis):
+    await save_test_game()
+    session = GameSession("test-game-id", "test-user")
+    await session.open()
+    await fake_redis.set("game_session:test-game-id", "another-session")
+    
+    assert await session.refresh() is False
+    
+    assert session.player is False
+    assert (await session.handle('{"action": "draw"}'))["type"] == "error"
@@ -0,0 +1,59 @@
+import pytest
+from exceptions.exceptions import InvalidGameTokenException
+from models import Game
+from services import token_service
+from services.game_service import DeckCards
+from services.token_service import encode_game_token, decode_game_token, _b64decode, _b64encode, _seal
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(token_service, "GAME_TOKEN_SECRET", "test-secret")
+
+def make_game():
+    return Game(gameid="test-game-id", userid="test-user-id", currRnd=4, card_deck=DeckCards().initialize_deck())
+
+# Test encode_game_token / decode_game_token
+def test_game_token_round_trip():
+    game = make_game()
+    
+    token = encode_game_token(game)
+    
+    assert len(token) < 300
+    assert decode_game_token(token) == game
+
+def test_game_token_rejects_tampering():
+    data = bytearray(_b64decode(encode_game_token(make_game())))
+    data[-20] ^= 1
+    
+    with pytest.raises(InvalidGameTokenException, match="Invalid game token"):
+        decode_game_token(_b64encode(bytes(data)))
+    with pytest.raises(InvalidGameTokenException, match="Malformed game token"):
+        decode_game_token(_b64encode(bytes(data[:20])))
+
+def test_game_token_hides_the_deck():
+    game = make_game()
+    first, second = encode_game_token(game), encode_game_token(game)
+    
+    # Verify nothing of the payload shows, and the same game never encodes to the same token
+    assert b"test-game-id" not in _b64decode(first)
+    assert first != second
+
+def test_game_token_rejects_other_secret(monkeypatch):
+    token = encode_game_token(make_game())
+    monkeypatch.setattr(token_service, "GAME_TOKEN_SECRET", "rotated-secret")
+    
+    with pytest.raises(InvalidGameTokenException):
+        decode_game_token(token)
+
+def test_game_token_rejects_separator_in_ids():
+    with pytest.raises(InvalidGameTokenException):
+        encode_game_token(make_game().model_copy(update={"userid": "test|user"}))
+
+@pytest.mark.parametrize("payload", [b"2|test-game-id|test-user-id", b"2|g|u|four|Hearts|A", b"\xff|g"])
+def test_game_token_rejects_malformed_sealed_payload(payload):
+    # Correctly encrypted, so only the payload's parsing can refuse it
+    token = _seal(payload)
+    
+    with pytest.raises(InvalidGameTokenException, match="Malformed game token"):
+        decode_game_token(token)
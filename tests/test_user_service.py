@@ -1,7 +1,11 @@
+import asyncio
 import pytest
 from unittest.mock import patch, MagicMock
-from services.user_service import create_user, get_user, add_game_to_user
+from exceptions.exceptions import UserNotFoundException
+from services.game_service import start_game, pull_card
+from services.user_service import create_user, get_user, get_user_games, add_game_to_user, record_game_for_user
 from models import  User
+from services.redis_service import save_user_to_redis
 
 # Test create_user function
 @pytest.mark.asyncio
@@ -46,7 +50,7 @@ async def test_get_user(mock_get_user):
     assert result == mock_user
     
     # Verify the mock was called with correct parameters
-    mock_get_user.assert_called_once_with("test-user-id")
+    mock_get_user.assert_called_once_with("test-user-id", load_games=False)
 
 # Test add_game_to_user function for guest user
 @pytest.mark.asyncio
@@ -60,45 +64,97 @@ async def test_add_game_to_guest_user():
 
 # Test add_game_to_user function for existing user
 @pytest.mark.asyncio
-@patch('services.user_service.get_user')
-@patch('services.user_service.save_user_to_redis')
-async def test_add_game_to_existing_user(mock_save_user, mock_get_user):
-    # Setup mocks
-    mock_user = MagicMock()
-    mock_user.games = []
-    mock_get_user.return_value = mock_user
-    mock_save_user.return_value = mock_user
+async def test_add_game_to_existing_user(fake_redis):
+    # Setup an existing user
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    document = await fake_redis.get("user:test-user-id")
     
     # Call the function
     result = await add_game_to_user("test-user-id", "test-game-id")
     
     # Verify the result
-    assert result == mock_user
+    assert result.userid == "test-user-id"
+    assert result.games_count == 1
+    
+    # Verify the game went to the games set and the user document was not rewritten
+    assert await fake_redis.zrange("user:test-user-id:games", 0, -1) == ["test-game-id"]
+    assert await fake_redis.get("user:test-user-id") == document
+
+@pytest.mark.asyncio
+async def test_add_game_to_existing_user_keeps_order_and_ignores_duplicates():
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
     
-    # Verify the game was added to the user's games
-    assert "test-game-id" in mock_user.games
+    for gameid in ["game-1", "game-2", "game-1", "game-3"]:
+        await record_game_for_user("test-user-id", gameid)
     
-    # Verify the mocks were called
-    mock_get_user.assert_called_once_with("test-user-id")
-    mock_save_user.assert_called_once_with(mock_user)
+    assert (await get_user("test-user-id", include_games=True)).games == ["game-1", "game-2", "game-3"]
 
-# Test add_game_to_user function for non-existent user
 @pytest.mark.asyncio
-@patch('services.user_service.get_user')
-@patch('services.user_service.save_user_to_redis')
-async def test_add_game_to_nonexistent_user(mock_save_user, mock_get_user):
-    # Setup mocks
-    mock_get_user.return_value = None
-    mock_save_user.return_value = MagicMock()
+async def test_add_game_to_user_concurrently():
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    
+    # Concurrent adds for the same user must not lose each other's games
+    gameids = [f"game-{i}" for i in range(50)]
+    await asyncio.gather(*(record_game_for_user("test-user-id", gameid) for gameid in gameids))
     
+    assert sorted((await get_user("test-user-id", include_games=True)).games) == sorted(gameids)
+
+# Test add_game_to_user function for non-existent user
+@pytest.mark.asyncio
+async def test_add_game_to_nonexistent_user(fake_redis):
     # Call the function
     result = await add_game_to_user("new-user-id", "test-game-id")
     
-    # Verify the mocks were called
-    mock_get_user.assert_called_once_with("new-user-id")
-    mock_save_user.assert_called_once()
+    # Verify nothing was created for an unknown user
+    assert result is None
+    assert not await fake_redis.exists("user:new-user-id:games")
+
+# Test record_game_for_user function
+@pytest.mark.asyncio
+async def test_record_game_for_user(fake_redis):
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    
+    assert await record_game_for_user("test-user-id", "test-game-id") is True
+    assert await record_game_for_user("guest", "test-game-id") is True
+    assert await record_game_for_user("new-user-id", "test-game-id") is False
+    assert await fake_redis.keys("user:*:games") == ["user:test-user-id:games"]
+
+# Test get_user_games function
+@pytest.mark.asyncio
+async def test_get_user_games_pages_newest_first():
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    gameids = [f"game-{i}" for i in range(5)]
+    for gameid in gameids:
+        await record_game_for_user("test-user-id", gameid)
+    
+    # Walk the pages
+    seen = []
+    before = None
+    while True:
+        page = await get_user_games("test-user-id", before=before, limit=2)
+        seen.extend(game["game_id"] for game in page["games"])
+        before = page["next_before"]
+        if before is None:
+            break
     
-    # Verify a new user was created with the game
-    call_args = mock_save_user.call_args[0][0]
-    assert call_args.userid == "new-user-id"
-    assert "test-game-id" in call_args.games
+    assert seen == list(reversed(gameids))
+
+@pytest.mark.asyncio
+async def test_get_user_games_summary():
+    await save_user_to_redis(User(userid="test-user-id", username="testuser", email="test@example.com"))
+    result = await start_game("test-user-id")
+    await pull_card("test-user-id", result["game_id"])
+    await record_game_for_user("test-user-id", "deleted-game")
+    
+    page = await get_user_games("test-user-id", summary=True)
+    
+    deleted, started = page["games"]
+    assert started["game_id"] == result["game_id"]
+    assert started["round"] == 2
+    assert started["remaining_cards"] == 11
+    assert deleted["round"] is None
+
+@pytest.mark.asyncio
+async def test_get_user_games_unknown_user():
+    with pytest.raises(UserNotFoundException):
+        await get_user_games("missing-user")
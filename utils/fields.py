@@ -0,0 +1,22 @@
+from typing import Optional, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+
+# Field names asked for with ?fields= ("round,cards"), or None when the parameter is absent (every field).
+# Raises an HTTPException (400) naming any field `model` does not have.
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[frozenset]:
+    if not fields:
+        return None
+    names = frozenset(name.strip() for name in fields.split(",") if name.strip())
+    unknown = names - model.model_fields.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return names
+
+# Keep only the selected keys of a dict (all of them when fields is None)
+def pick_fields(data: dict, fields: Optional[frozenset]) -> dict:
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
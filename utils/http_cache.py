@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import os
+from typing import NamedTuple
+
+from fastapi import Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+
+# Compress responses with gzip (GZipMiddleware) when clients accept it. Bodies shorter than
+# GZIP_MIN_BYTES are not worth it, neither on the fly nor as a prepared copy.
+GZIP_RESPONSES = os.getenv("GZIP_RESPONSES", "true").lower() == "true"
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "512"))
+# On-the-fly compression level: 6 gets most of level 9's savings for a fraction of the CPU
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Versioned documents (users, games) change at any time: clients keep them but revalidate on every use
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+class CachedBody(NamedTuple):
+    """A response body prepared once: its JSON bytes, a gzip copy (or None) and its strong ETag."""
+    body: bytes
+    gzip_body: bytes
+    etag: str
+
+
+class QualityGZipMiddleware:
+    """
+    The stock GZipMiddleware behind an Accept-Encoding header with its q-values already applied:
+    the header is rewritten to "gzip" or "identity", so "gzip;q=0" refuses compression instead of asking for it.
+    """
+    def __init__(self, app, **options):
+        self.app = GZipMiddleware(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            encoding = b"gzip" if accepts_gzip(Headers(scope=scope)) else b"identity"
+            headers = [(name, value) for name, value in scope["headers"] if name != b"accept-encoding"]
+            # Rewritten in place: outer middleware reads what routing adds to this scope
+            scope["headers"] = headers + [(b"accept-encoding", encoding)]
+        await self.app(scope, receive, send)
+
+
+# True if the Accept-Encoding header accepts gzip: listed, or covered by "*", with a q-value above 0
+def accepts_gzip(headers) -> bool:
+    qualities = {}
+    for item in headers.get("accept-encoding", "").split(","):
+        coding, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def prepare_body(body: bytes) -> CachedBody:
+    gzip_body = gzip.compress(body, compresslevel=9, mtime=0) if len(body) >= GZIP_MIN_BYTES else None
+    return CachedBody(body, gzip_body, etag_for(body))
+
+# ETag of a versioned document; `variant` tells apart representations of the same version
+# (e.g. a user with and without its game IDs)
+def version_etag(version: int, variant: str = "") -> str:
+    return f'"v{version}-{variant}"' if variant else f'"v{version}"'
+
+# Headers of every response carrying a versioned document, 304s included
+def version_headers(etag: str):
+    return {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+
+# True if the request's If-None-Match already names this ETag (weak comparison, as RFC 9110 requires)
+def is_not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+# Serve a prepared body: 304 when the client's copy is current, the gzip copy when accepted
+def cached_response(request: Request, cached: CachedBody, cache_control: str) -> Response:
+    headers = {"ETag": cached.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if is_not_modified(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    if cached.gzip_body is not None and accepts_gzip(request.headers):
+        headers["Content-Encoding"] = "gzip"
+        return Response(cached.gzip_body, media_type="application/json", headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
@@ -1,62 +1,199 @@
+import atexit
 import logging
-import json
+import orjson
 import os
+import queue
+import random
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from utils.metrics import register_collector
+from utils.profiling import profiled_stage
+
+# Log output settings
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one JSON object per line)
+# Records wait in a bounded queue until the background listener thread formats and writes them.
+# When the queue is full, "drop" discards the new record (counted in dropped_records) and
+# "block" makes the caller wait for room.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")
+
+# API call sampling: fraction of calls logged per method (e.g. "get_user=0.05,start-game=1"),
+# falling back to LOG_SAMPLE_RATE. Errors and calls slower than LOG_SLOW_MS are always logged.
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_SLOW_MS = float(os.getenv("LOG_SLOW_MS", "500"))
+
+def _parse_sample_rates(value):
+    rates = {}
+    for item in filter(None, value.split(",")):
+        method, _, rate = item.partition("=")
+        rates[method.strip()] = float(rate)
+    return rates
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def _dumps(data):
+    return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+dropped_records = 0
+listener = None
+# API calls skipped by the sampling policy, per method
+sampled_out = {}
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to the background listener without formatting them on the caller's thread."""
+    def prepare(self, record):
+        # The listener lives in this process, so the record can be passed as-is
+        return record
+
+    def enqueue(self, record):
+        global dropped_records
+        if LOG_QUEUE_POLICY == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+class DailyFileHandler(logging.FileHandler):
+    """Writes to <directory>/api_YYYYMMDD.log, switching to a new file when the date changes."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.current_date = datetime.now().strftime('%Y%m%d')
+        super().__init__(self._filename(self.current_date))
+
+    def _filename(self, date):
+        return os.path.join(self.directory, f"api_{date}.log")
+
+    def emit(self, record):
+        date = datetime.fromtimestamp(record.created).strftime('%Y%m%d')
+        if date != self.current_date:
+            self.current_date = date
+            self.baseFilename = os.path.abspath(self._filename(date))
+            if self.stream:
+                self.stream.close()
+                self.stream = None  # Reopened on the new file by FileHandler.emit
+        super().emit(record)
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Formats each record as a single JSON object, merging in structured API call data."""
+    def format(self, record):
+        log_data = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+        }
+        if hasattr(record, "api_call"):
+            log_data.update(record.api_call)
+        else:
+            log_data["message"] = record.getMessage()
+        if record.exc_info:
+            log_data["exception"] = self.formatException(record.exc_info)
+        return _dumps(log_data)
+
+
+class _JSONArg:
+    """Defers JSON encoding of a log argument until the listener thread formats the record."""
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return _dumps(self.data)
+
 
 # Configure logging
 def setup_logger():
+    global listener
     logger = logging.getLogger("sweaters-api")
     logger.setLevel(logging.INFO)
-    
+
+    # Create formatter
+    if LOG_FORMAT == "json":
+        formatter = JSONLinesFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
     # Create console handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(formatter)
-    
-    # Add handler to logger
-    logger.addHandler(console_handler)
-    
+
     # Create logs directory if it doesn't exist
-    os.makedirs("logs", exist_ok=True)
-    
-    # Create file handler
-    file_handler = logging.FileHandler(f"logs/api_{datetime.now().strftime('%Y%m%d')}.log")
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    # Create file handler, rotated daily
+    file_handler = DailyFileHandler(LOG_DIR)
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
-    
-    # Add file handler to logger
-    logger.addHandler(file_handler)
-    
+
+    # Formatting and I/O happen on the listener thread; the logger itself only enqueues
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+    logger.addHandler(BoundedQueueHandler(log_queue))
+
     return logger
 
+# Flush queued records and stop the listener thread
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+# Decide whether an API call gets logged; runs before any log data is built
+def should_log_api_call(method, response_data=None, message=None, duration_ms=None):
+    if response_data is None or response_data.status_code >= 400 or message:
+        return True
+    if duration_ms is not None and duration_ms >= LOG_SLOW_MS:
+        return True
+    rate = LOG_SAMPLE_RATES.get(method, LOG_SAMPLE_RATE)
+    if rate >= 1 or random.random() < rate:
+        return True
+    sampled_out[method] = sampled_out.get(method, 0) + 1
+    return False
+
 # Create a function to log API calls
-def log_api_call(endpoint, method, request_data=None, response_data=None, user=None, game=None, message=None):
+@profiled_stage("log")
+def log_api_call(endpoint, method, request_data=None, response_data=None, user=None, game=None, message=None,
+                 duration_ms=None):
     logger = logging.getLogger("sweaters-api")
-    
+    if not logger.isEnabledFor(logging.INFO):
+        return None
+    if not should_log_api_call(method, response_data, message, duration_ms):
+        return None
+
     log_data = {
         "timestamp": datetime.now().isoformat(),
         "endpoint": endpoint,
         "method": method,
         "request_data": request_data,
     }
-    
+
     if response_data:
         # Extract only necessary fields to avoid circular references
         log_data["response"] = {
             "status_code": response_data.status_code,
             "message": response_data.message
         }
-    
+
     if user:
         log_data["user"] = {
             "userid": user.userid,
             "username": user.username,
-            "games_count": len(user.games) if hasattr(user, "games") else 0
+            "games_count": user.games_count if getattr(user, "games_count", None) is not None
+            else len(getattr(user, "games", []))
         }
-    
+
     if game:
         log_data["game"] = {
             "gameid": game.gameid,
@@ -66,8 +203,12 @@ def log_api_call(endpoint, method, request_data=None, response_data=None, user=N
 
     if message:
         log_data["message"] = message
-    
-    logger.info(f"API Call: {json.dumps(log_data, default=str)}")
+
+    if duration_ms is not None:
+        log_data["duration_ms"] = round(duration_ms, 2)
+
+    # Serialization is deferred to the listener thread
+    logger.info("API Call: %s", _JSONArg(log_data), extra={"api_call": log_data})
     return log_data
 
 
@@ -82,3 +223,9 @@ def log_func_call(error_msg=None):
     return log_data
 
 logger = setup_logger()
+
+register_collector("log_queue_depth", "Log records waiting for the listener thread", log_queue.qsize)
+register_collector("log_records_dropped_total", "Log records dropped because the queue was full",
+                   lambda: dropped_records, kind="counter")
+register_collector("log_api_calls_sampled_out_total", "API calls not logged by the sampling policy",
+                   lambda: sampled_out, kind="counter", label="method")
@@ -0,0 +1,134 @@
+import bisect
+import os
+import time
+from functools import wraps
+
+from utils.profiling import record_stage, PROFILING_ENABLED
+
+# Collect metrics and serve them on /metrics. Recording is a dict lookup and two adds, cheap
+# enough for production; set to "false" to drop the middleware and timing wrappers entirely.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+histograms = {}
+# Values read at scrape time: name -> (help, type, function returning a number or {label value: number}, label)
+collectors = {}
+
+
+def _labels(pairs):
+    pairs = {name: value for name, value in pairs.items() if name}
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs.items()) + "}"
+
+
+class Histogram:
+    """
+    Latency histogram in the Prometheus text format, with one series per label value.
+    Buckets are stored per bucket and only made cumulative when rendered. Observations also
+    count towards `stage` in the Server-Timing breakdown of profiled requests.
+    """
+    def __init__(self, name: str, help: str, label: str = None, buckets=LATENCY_BUCKETS, stage: str = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.stage = stage
+        self.series = {}  # label value -> [counts per bucket (last is +Inf), sum]
+        histograms[name] = self
+
+    def observe(self, value: float, label_value: str = ""):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        if self.stage:
+            record_stage(self.stage, value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels({self.label: label_value, 'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels({self.label: label_value})} {total}")
+            lines.append(f"{self.name}_count{_labels({self.label: label_value})} {cumulative}")
+        return lines
+
+
+# Register a value read at scrape time, e.g. a queue depth or counters kept elsewhere
+def register_collector(name: str, help: str, func, kind: str = "gauge", label: str = None):
+    collectors[name] = (help, kind, func, label)
+
+# Wrap an async function so each call's duration is observed in `histogram` under `label_value`
+def timed(histogram: Histogram, label_value: str):
+    def decorator(func):
+        if not METRICS_ENABLED and not PROFILING_ENABLED:
+            return func
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, label_value)
+        return wrapper
+    return decorator
+
+# All metrics in the Prometheus text exposition format
+def render():
+    lines = []
+    for histogram in histograms.values():
+        lines.extend(histogram.render())
+    for name, (help, kind, func, label) in collectors.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        value = func()
+        if isinstance(value, dict):
+            lines.extend(f"{name}{_labels({label: key})} {item}" for key, item in value.items())
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+request_latency = Histogram("http_request_duration_seconds", "Request latency by route", label="route")
+request_errors = {}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request under its route template (e.g. /users/{userid}),
+    so path parameters do not create a series per user. Plain ASGI rather than BaseHTTPMiddleware,
+    which would add a task and a body copy per request.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            request_latency.observe(time.perf_counter() - start, path)
+            if status >= 400:
+                request_errors[path] = request_errors.get(path, 0) + 1
+
+
+register_collector("http_request_errors_total", "Requests answered with an HTTP error status, by route",
+                   lambda: request_errors, kind="counter", label="route")
@@ -0,0 +1,118 @@
+import asyncio
+import cProfile
+import os
+import random
+import re
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+# Debug-only request profiling. When enabled, a request is profiled if it carries the
+# PROFILE_HEADER header or is picked at PROFILE_SAMPLE_RATE; it gets a Server-Timing header
+# with its per-stage breakdown, and a cProfile trace is written to PROFILE_DIR
+# (open with `python -m pstats` or snakeviz).
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "x-profile").lower().encode()
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.getenv("LOG_DIR", "logs"))
+
+# Seconds spent per stage ("redis", "log", ...) by the request being profiled, None otherwise
+stage_timings: ContextVar = ContextVar("stage_timings", default=None)
+
+
+# Add time to a stage of the current request; a no-op unless the request is profiled
+def record_stage(stage: str, seconds: float):
+    timings = stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+# Wrap a function so the time it takes counts towards `stage` in profiled requests
+def profiled_stage(stage: str):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = stage_timings.get()
+            if timings is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+        return wrapper
+    return decorator
+
+# Server-Timing value: each stage, what was left ("app": routing, validation, serialization...) and the total
+def server_timing(timings, total: float):
+    parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    parts.append(f"app;dur={max(total - sum(timings.values()), 0) * 1000:.2f}")
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling opted-in requests.
+
+    cProfile sees everything the event loop runs meanwhile, so the trace of a request served
+    alongside others includes their work too; only one request is traced at a time, and the
+    others still get their Server-Timing breakdown.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.tracing = False
+
+    def wants_profile(self, scope):
+        if scope["type"] != "http":
+            return False
+        if any(name == PROFILE_HEADER for name, _ in scope["headers"]):
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if not self.wants_profile(scope):
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = stage_timings.set(timings)
+        profiler = None
+        if not self.tracing:
+            self.tracing = True
+            profiler = cProfile.Profile()
+        trace_path = None
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal trace_path
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - start).encode()))
+                if profiler:
+                    trace_path = _trace_path(scope)
+                    headers.append((b"x-profile-trace", os.path.basename(trace_path).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            if profiler:
+                profiler.enable()
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profiler:
+                profiler.disable()
+                self.tracing = False
+                if trace_path:
+                    await asyncio.to_thread(_dump, profiler, trace_path)
+            stage_timings.reset(token)
+
+
+# logs/profile_<time>_<route>.prof, named after the route template rather than the raw path
+def _trace_path(scope):
+    route = getattr(scope.get("route"), "path", scope["path"])
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    return os.path.join(PROFILE_DIR, f"profile_{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{slug}.prof")
+
+def _dump(profiler, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    profiler.dump_stats(path)